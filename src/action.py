@@ -9,29 +9,62 @@ class ActionType(Enum):
     DUKE = 3
     CHALLENGE = 4
     AMBASSADOR = 5
-    ASSASSIN_TARGET_PLAYER_0 = 6
-    ASSASSIN_TARGET_PLAYER_1 = 7
-    ASSASSIN_TARGET_PLAYER_2 = 8
-    ASSASSIN_TARGET_PLAYER_3 = 9
-    COUP_TARGET_PLAYER_0 = 10
-    COUP_TARGET_PLAYER_1 = 11
-    COUP_TARGET_PLAYER_2 = 12
-    COUP_TARGET_PLAYER_3 = 13
-    CAPTAIN_TARGET_PLAYER_0 = 14
-    CAPTAIN_TARGET_PLAYER_1 = 15
-    CAPTAIN_TARGET_PLAYER_2 = 16
-    CAPTAIN_TARGET_PLAYER_3 = 17
-    COUNTER_FOREIGN_AID_WITH_DUKE = 18
-    COUNTER_ASSASSIN_WITH_CONTESSA = 19
-    COUNTER_CAPTAIN_WITH_CAPTAIN = 20
-    COUNTER_CAPTAIN_WITH_AMBASSADOR = 21
-    REVEAL_CARD_1 = 22
-    REVEAL_CARD_2 = 23
-    DISCARD_CAPTAIN = 24
-    DISCARD_AMBASSADOR = 25
-    DISCARD_ASSASSIN = 26
-    DISCARD_DUKE = 27
-    DISCARD_CONTESSA = 28
+    ASSASSIN = 6
+    COUP = 7
+    CAPTAIN = 8
+    COUNTER_FOREIGN_AID_WITH_DUKE = 9
+    COUNTER_ASSASSIN_WITH_CONTESSA = 10
+    COUNTER_CAPTAIN_WITH_CAPTAIN = 11
+    COUNTER_CAPTAIN_WITH_AMBASSADOR = 12
+    REVEAL_CARD_1 = 13
+    REVEAL_CARD_2 = 14
+    DISCARD_CAPTAIN = 15
+    DISCARD_AMBASSADOR = 16
+    DISCARD_ASSASSIN = 17
+    DISCARD_DUKE = 18
+    DISCARD_CONTESSA = 19
+
+
+# Action types for which the acting player picks a target player
+TARGETED_ACTION_TYPES = (ActionType.ASSASSIN, ActionType.COUP, ActionType.CAPTAIN)
+MIN_PLAYERS = 2
+MAX_PLAYERS = 6
+
+
+def get_nb_actions(nb_players: int) -> int:
+    # Factored (action type, target) space, it grows linearly with nb_players
+    return len(ActionType) * nb_players
+
+
+def get_action_id(
+    action_type: ActionType, target_player_id: int, nb_players: int
+) -> int:
+    # Untargeted action types all use target slot 0
+    target_slot = target_player_id if action_type in TARGETED_ACTION_TYPES else 0
+    return action_type.value * nb_players + target_slot
+
+
+def get_action_type_and_target(action_id: int, nb_players: int):
+    action_type_value, target_slot = divmod(action_id, nb_players)
+    action_type = ActionType(action_type_value)
+    if action_type not in TARGETED_ACTION_TYPES:
+        return action_type, -1
+    return action_type, target_slot
+
+
+# (can_be_countered, can_be_challenged) of the action types as they are
+# played, the others can be neither
+ACTION_RULES = {
+    ActionType.FOREIGN_AID: (True, False),
+    ActionType.DUKE: (False, True),
+    ActionType.AMBASSADOR: (False, True),
+    ActionType.ASSASSIN: (True, True),
+    ActionType.CAPTAIN: (True, True),
+    ActionType.COUNTER_FOREIGN_AID_WITH_DUKE: (False, True),
+    ActionType.COUNTER_ASSASSIN_WITH_CONTESSA: (False, True),
+    ActionType.COUNTER_CAPTAIN_WITH_CAPTAIN: (False, True),
+    ActionType.COUNTER_CAPTAIN_WITH_AMBASSADOR: (False, True),
+}
 
 
 class Action(BaseModel):
@@ -43,3 +76,24 @@ class Action(BaseModel):
 
     def __str__(self):
         return f"Action(action_type={self.action_type}, origin_player_id={self.origin_player_id}, target_player_id={self.target_player_id}, card_to_reveal={self.card_to_reveal}, can_be_countered={self.can_be_countered}, can_be_challenged={self.can_be_challenged})"
+
+
+def make_action(
+    action_id: int,
+    origin_player_id: int,
+    nb_players: int,
+    target_player_id: int = -1,
+) -> Action:
+    """Action of an action id, target_player_id being the target of the
+    untargeted types (the player challenged or countered)"""
+    action_type, action_target = get_action_type_and_target(action_id, nb_players)
+    can_be_countered, can_be_challenged = ACTION_RULES.get(action_type, (False, False))
+    return Action(
+        action_type=action_type,
+        origin_player_id=origin_player_id,
+        target_player_id=action_target
+        if action_type in TARGETED_ACTION_TYPES
+        else target_player_id,
+        can_be_countered=can_be_countered,
+        can_be_challenged=can_be_challenged,
+    )
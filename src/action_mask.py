@@ -0,0 +1,162 @@
+from enum import IntEnum
+from functools import cache
+from typing import NamedTuple
+import numpy as np
+from action import ActionType, get_action_id, get_nb_actions
+from character import Character
+
+# Discard action of each character, in the order of the DISCARD_* types
+DISCARD_ACTION_TYPES = {
+    Character.CAPTAIN: ActionType.DISCARD_CAPTAIN,
+    Character.AMBASSADOR: ActionType.DISCARD_AMBASSADOR,
+    Character.ASSASSIN: ActionType.DISCARD_ASSASSIN,
+    Character.DUKE: ActionType.DISCARD_DUKE,
+    Character.CONTESSA: ActionType.DISCARD_CONTESSA,
+}
+COUNTER_ACTION_TYPES = {
+    ActionType.FOREIGN_AID: (ActionType.COUNTER_FOREIGN_AID_WITH_DUKE,),
+    ActionType.CAPTAIN: (
+        ActionType.COUNTER_CAPTAIN_WITH_CAPTAIN,
+        ActionType.COUNTER_CAPTAIN_WITH_AMBASSADOR,
+    ),
+    ActionType.ASSASSIN: (ActionType.COUNTER_ASSASSIN_WITH_CONTESSA,),
+}
+
+
+class DecisionPhase(IntEnum):
+    ACTION = 0
+    CHALLENGE = 1
+    COUNTER = 2
+    REVEAL = 3
+    DISCARD = 4
+
+
+class MaskKey(NamedTuple):
+    # Everything the legal actions of a decision depend on
+    phase: DecisionPhase
+    coins_bucket: int = 0  # 0 below 7 coins, 1 can coup, 2 must coup
+    targets: int = 0  # bitmask of the other players with influence
+    rich_targets: int = 0  # bitmask of the targets with at least 2 coins
+    pending_action_type: int = 0  # action type being countered
+    hand: int = 0  # bitmask of unrevealed hand slots (reveal) or characters (discard)
+
+
+class ActionMaskGenerator:
+    """Legal action masks looked up from a compact key of the decision. Masks
+    are built once per key and returned as read-only boolean arrays, so a
+    decision costs a key computation and a dictionary hit"""
+
+    def __init__(self, nb_players: int):
+        self.nb_players = nb_players
+        self.n_actions = get_nb_actions(nb_players)
+        self.masks: dict[MaskKey, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def mask(self, key: MaskKey) -> np.ndarray:
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = self.build_mask(key)
+            mask.flags.writeable = False
+            self.masks[key] = mask
+        return mask
+
+    def build_mask(self, key: MaskKey) -> np.ndarray:
+        mask = np.zeros(self.n_actions, dtype=bool)
+
+        def allow(action_type: ActionType, target_player_id: int = -1):
+            mask[get_action_id(action_type, target_player_id, self.nb_players)] = True
+
+        targets = [i for i in range(self.nb_players) if key.targets >> i & 1]
+        match key.phase:
+            case DecisionPhase.ACTION:
+                if key.coins_bucket == 2:
+                    for target in targets:
+                        allow(ActionType.COUP, target)
+                    return mask
+                allow(ActionType.REVENUE)
+                allow(ActionType.FOREIGN_AID)
+                if key.coins_bucket == 1:
+                    for target in targets:
+                        allow(ActionType.COUP, target)
+                        allow(ActionType.ASSASSIN, target)
+                for target in range(self.nb_players):
+                    if key.rich_targets >> target & 1:
+                        allow(ActionType.CAPTAIN, target)
+            case DecisionPhase.CHALLENGE:
+                allow(ActionType.CHALLENGE)
+                allow(ActionType.DO_NOTHING)
+            case DecisionPhase.COUNTER:
+                allow(ActionType.DO_NOTHING)
+                for counter in COUNTER_ACTION_TYPES.get(
+                    ActionType(key.pending_action_type), ()
+                ):
+                    allow(counter)
+            case DecisionPhase.REVEAL:
+                if key.hand & 1:
+                    allow(ActionType.REVEAL_CARD_1)
+                if key.hand & 2:
+                    allow(ActionType.REVEAL_CARD_2)
+            case DecisionPhase.DISCARD:
+                for i, action_type in enumerate(DISCARD_ACTION_TYPES.values()):
+                    if key.hand >> i & 1:
+                        allow(action_type)
+        return mask
+
+    def batch_masks(self, keys: np.ndarray) -> np.ndarray:
+        """Masks of a batch of decisions, keys being an int array with one
+        MaskKey per row. Only distinct keys are looked up"""
+        unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        unique_masks = np.stack(
+            [self.mask(MaskKey(*map(int, key))) for key in unique_keys]
+        )
+        return unique_masks[inverse.reshape(-1)]
+
+    # Keys of the Board decisions
+
+    @staticmethod
+    def action_key(player, alive_players: list) -> MaskKey:
+        targets = rich_targets = 0
+        for other in alive_players:
+            if other.id != player.id and any(
+                not card.is_revealed for card in other.hand
+            ):
+                targets |= 1 << other.id
+                if other.coins >= 2:
+                    rich_targets |= 1 << other.id
+        if player.must_coup:
+            coins_bucket = 2
+        elif player.can_coup and targets:
+            coins_bucket = 1
+        else:
+            coins_bucket = 0
+        return MaskKey(DecisionPhase.ACTION, coins_bucket, targets, rich_targets)
+
+    @staticmethod
+    def counter_key(action_type: ActionType) -> MaskKey:
+        return MaskKey(DecisionPhase.COUNTER, pending_action_type=action_type.value)
+
+    @staticmethod
+    def reveal_key(hand: list) -> MaskKey:
+        slots = sum(1 << i for i in range(2) if not hand[i].is_revealed)
+        return MaskKey(DecisionPhase.REVEAL, hand=slots)
+
+    @staticmethod
+    def discard_key(hand: list) -> MaskKey:
+        characters = 0
+        for i, character in enumerate(DISCARD_ACTION_TYPES):
+            if any(
+                card.character == character and not card.is_revealed for card in hand
+            ):
+                characters |= 1 << i
+        return MaskKey(DecisionPhase.DISCARD, hand=characters)
+
+
+CHALLENGE_KEY = MaskKey(DecisionPhase.CHALLENGE)
+
+
+@cache
+def get_mask_generator(nb_players: int) -> ActionMaskGenerator:
+    # One generator, and so one cache, per player count shared by all agents
+    return ActionMaskGenerator(nb_players)
@@ -1,356 +1,205 @@
-import random
+from collections import deque
+import numpy as np
 import torch
-from action import Action, ActionType
-from card import Card
-from character import Character
+from base_agent import BaseAgent, RandomAgent  # noqa: F401 (re-exported)
 from player import Player
-from dqn import DQN
+from dqn import DQN, RecurrentDQN
+from exploration import ActionSampler
+from inference import InferencePolicy
+from replay import RecurrentContext
 
 
-class CoupAgent:
+class CoupAgent(BaseAgent):
     def __init__(
         self,
         player: Player,
         full_state_length: int,
         state_item_width: int,
+        nb_players: int = 4,
         epsilon: float = 0.1,
+        policy_net: DQN | None = None,
+        inference_policy: InferencePolicy | None = None,
+        sampler: ActionSampler | None = None,
     ):
-        self.id = player.id
-        self.player = player
-        self.state = None
-        self.n_actions = len(ActionType)
+        super().__init__(player, full_state_length, state_item_width, nb_players)
         self.epsilon = epsilon
         self.device = "cpu"
+        # Exploring agents sample their actions, the others act greedily
+        self.sampler = sampler
+        # Decisions taken by the agent, the steps an epsilon schedule of the
+        # sampler is evaluated at. Kept across games replayed with Board.reset
+        self.nb_decisions = 0
+        # Anything exposing select_action_id(state, action_mask, steps): an
+        # InferencePolicy or a shared, batching InferenceServer
+        self.inference_policy = inference_policy
 
-        self.policy_net = DQN(full_state_length, state_item_width, self.n_actions).to(
+        if policy_net is not None or inference_policy is not None:
+            # Frozen agent sharing an already loaded network, it only acts
+            self.policy_net = policy_net
+            self.target_net = None
+            return
+        self.policy_net = DQN(full_state_length, state_item_width, nb_players).to(
             self.device
         )
-        self.target_net = DQN(full_state_length, state_item_width, self.n_actions).to(
+        self.target_net = DQN(full_state_length, state_item_width, nb_players).to(
             self.device
         )
         self.target_net.load_state_dict(self.policy_net.state_dict())
         self.target_net.eval()
 
-    def get_coup_action_type_from_target_player_id(
-        self, target_player_id: int
-    ) -> ActionType:
-        if target_player_id == 0:
-            return ActionType.COUP_TARGET_PLAYER_0
-        elif target_player_id == 1:
-            return ActionType.COUP_TARGET_PLAYER_1
-        elif target_player_id == 2:
-            return ActionType.COUP_TARGET_PLAYER_2
-        elif target_player_id == 3:
-            return ActionType.COUP_TARGET_PLAYER_3
-        else:
-            return ValueError(f"Invalid target player id: {target_player_id}")
+    def optimize_for_inference(
+        self, quantize: bool = False, num_threads: int | None = None
+    ):
+        # For deployed agents that only act: the target net is dropped and
+        # decisions go through a traced (and optionally int8) policy
+        self.inference_policy = InferencePolicy(
+            self.policy_net,
+            self.full_state_length,
+            self.state_item_width,
+            self.n_actions,
+            quantize=quantize,
+            num_threads=num_threads,
+        )
+        self.target_net = None
 
-    def get_captain_action_type_from_target_player_id(
-        self, target_player_id: int
-    ) -> ActionType:
-        if target_player_id == 0:
-            return ActionType.CAPTAIN_TARGET_PLAYER_0
-        elif target_player_id == 1:
-            return ActionType.CAPTAIN_TARGET_PLAYER_1
-        elif target_player_id == 2:
-            return ActionType.CAPTAIN_TARGET_PLAYER_2
-        elif target_player_id == 3:
-            return ActionType.CAPTAIN_TARGET_PLAYER_3
-        else:
-            return ValueError(f"Invalid target player id: {target_player_id}")
+    def compute_q_values(
+        self, state: torch.tensor, action_mask: torch.tensor
+    ) -> torch.tensor:
+        return self.policy_net.select_action(
+            state, action_mask, self.device
+        )  # [n_action_types * nb_players]
 
-    def get_assassin_action_type_from_target_player_id(
-        self, target_player_id: int
-    ) -> ActionType:
-        if target_player_id == 0:
-            return ActionType.ASSASSIN_TARGET_PLAYER_0
-        elif target_player_id == 1:
-            return ActionType.ASSASSIN_TARGET_PLAYER_1
-        elif target_player_id == 2:
-            return ActionType.ASSASSIN_TARGET_PLAYER_2
-        elif target_player_id == 3:
-            return ActionType.ASSASSIN_TARGET_PLAYER_3
-        else:
-            return ValueError(f"Invalid target player id: {target_player_id}")
+    def q_values(self, state: np.ndarray) -> torch.Tensor:
+        # Re-queries of an unchanged state (challenge then counter polling,
+        # a reveal right after a coup) reuse the Q-vector of the first one,
+        # skipping the tensor conversion and the forward pass
+        cache = self.observation_cache if state is self.state else None
+        key = (self.id, self.state_version)
+        if cache is not None:
+            q_values = cache.get(key)
+            if q_values is not None:
+                return q_values
+        with torch.no_grad(), self.profiler.phase("inference"):
+            if self.inference_policy is not None:
+                q_values = self.inference_policy.q_values(state)
+            else:
+                q_values = self.compute_q_values(state, None)
+        if cache is not None:
+            cache.put(key, q_values)
+        return q_values
 
-    def create_action_mask(self, available_actions: list[ActionType]) -> torch.tensor:
-        return torch.tensor(
-            [
-                1
-                if any(
-                    action.action_type == ActionType(i) for action in available_actions
+    def select_action_id(self, state: np.ndarray, action_mask: np.ndarray) -> int:
+        if self.inference_policy is not None and not hasattr(
+            self.inference_policy, "q_values"
+        ):
+            # A shared InferenceServer batches whole decisions
+            with self.profiler.phase("inference"):
+                action_id = self.inference_policy.select_action_id(
+                    state, action_mask, steps=self.nb_decisions
                 )
-                else 0
-                for i in range(len(ActionType))
-            ]
-        )
-
-    def select_action(
-        self,
-        state: torch.tensor,
-        action_mask: torch.tensor,
-        available_actions: list[ActionType],
-    ) -> ActionType:
-        # if random.random() < self.epsilon:
-        #     # explore: choose random valid action
-        #     valid_actions = torch.nonzero(action_mask[0], as_tuple=True)[0]
-        #     action_type_value = valid_actions[
-        #         torch.randint(len(valid_actions), (1,))
-        #     ].item()
-        # else:
-        # exploit: mask Q-values
-        print(f"action_mask: {action_mask}")
-        with torch.no_grad():
-            q_values = self.policy_net.select_action(
-                state, action_mask, self.device
-            )  # [1, n_actions]
-            invalid_value = -1e9
-            masked_q_values = q_values + (action_mask == 0) * invalid_value
-            action_type_value = masked_q_values.argmax(dim=0).item()
+        else:
+            q_values = self.q_values(state)
+            if self.sampler is not None:
+                action_id = self.sampler.sample(
+                    q_values[None], action_mask[None], steps=self.nb_decisions
+                ).item()
+            else:
+                action_id = int(
+                    np.where(action_mask, q_values.numpy(), -np.inf).argmax()
+                )
+        self.nb_decisions += 1
+        return action_id
 
-        print(f"action_type_value: {action_type_value}")
-        # convert model choice to action instead of int
-        for action_type in ActionType:
-            if action_type.value == action_type_value:
-                print(f"action_type: {action_type}")
-                for action in available_actions:
-                    if action.action_type == action_type:
-                        return action
 
-    def choose_card_to_reveal(self, hand: list[Card]) -> Card:
-        if any(not card.is_revealed for card in hand):
-            available_actions = []
-            for i in range(2):
-                if not hand[i].is_revealed:
-                    if i == 0:
-                        action_type = ActionType.REVEAL_CARD_1
-                    else:
-                        action_type = ActionType.REVEAL_CARD_2
-                    available_actions.append(
-                        Action(
-                            action_type=action_type,
-                            origin_player_id=self.player.id,
-                            target_player_id=-1,
-                            can_be_countered=False,
-                            can_be_challenged=False,
-                        )
-                    )
-            action_mask = self.create_action_mask(available_actions)
-            action = self.select_action(self.state, action_mask, available_actions)
-            return action
-        else:
-            return ValueError("No card to reveal")
+class RecurrentCoupAgent(CoupAgent):
+    """Agent whose network only reads the board info and hand rows of the
+    state, the histories are folded into a hidden state one event at a time
+    so a decision costs O(new events) and the horizon is not capped.
 
-    def choose_card_to_discard(self, hand: list[Card]) -> Card:
-        available_actions = []
-        for card in hand:
-            if not card.is_revealed:
-                if card.character == Character.CAPTAIN:
-                    available_actions.append(ActionType.DISCARD_CAPTAIN)
-                elif card.character == Character.AMBASSADOR:
-                    available_actions.append(ActionType.DISCARD_AMBASSADOR)
-                elif card.character == Character.ASSASSIN:
-                    available_actions.append(ActionType.DISCARD_ASSASSIN)
-                elif card.character == Character.DUKE:
-                    available_actions.append(ActionType.DISCARD_DUKE)
-                elif card.character == Character.CONTESSA:
-                    available_actions.append(ActionType.DISCARD_CONTESSA)
-        available_actions = list(set(available_actions))
-        if available_actions:
-            action_mask = self.create_action_mask(available_actions)
-            action = self.select_action(self.state, action_mask, available_actions)
-            card = None
-            if action == ActionType.DISCARD_CAPTAIN:
-                for card in self.player.hand:
-                    if card.character == Character.CAPTAIN:
-                        card = card
-                        break
-            elif action == ActionType.DISCARD_AMBASSADOR:
-                for card in self.player.hand:
-                    if card.character == Character.AMBASSADOR:
-                        card = card
-                        break
-            elif action == ActionType.DISCARD_ASSASSIN:
-                for card in self.player.hand:
-                    if card.character == Character.ASSASSIN:
-                        card = card
-                        break
-            elif action == ActionType.DISCARD_DUKE:
-                for card in self.player.hand:
-                    if card.character == Character.DUKE:
-                        card = card
-                        break
-            elif action == ActionType.DISCARD_CONTESSA:
-                for card in self.player.hand:
-                    if card.character == Character.CONTESSA:
-                        card = card
-                        break
-            return action, card
-        else:
-            return ValueError("No card to discard")
+    An agent feeding a replay buffer also keeps its last history_window
+    history rows and the hidden states before each of them, recorded as the
+    RecurrentContext of its decisions"""
 
-    def choose_action(self, player: Player, alive_players: list[Player]) -> Action:
-        # Random choice from available actions TODO implement RL logic later
-        possible_coup_and_assassin_targets = [
-            p.id
-            for p in alive_players
-            if p.id != self.player.id and any(not card.is_revealed for card in p.hand)
-        ]
-        possible_captain_targets = [
-            p.id
-            for p in alive_players
-            if p.id != self.player.id
-            and any(not card.is_revealed for card in p.hand)
-            and p.coins >= 2
-        ]
-        coup_actions = [
-            Action(
-                action_type=self.get_coup_action_type_from_target_player_id(
-                    target_player_id
-                ),
-                origin_player_id=self.player.id,
-                target_player_id=target_player_id,
-                can_be_countered=False,
-                can_be_challenged=False,
-            )
-            for target_player_id in possible_coup_and_assassin_targets
-        ]
-        captain_actions = [
-            Action(
-                action_type=self.get_captain_action_type_from_target_player_id(
-                    target_player_id
-                ),
-                origin_player_id=self.player.id,
-                target_player_id=-target_player_id,
-                can_be_countered=True,
-                can_be_challenged=True,
-            )
-            for target_player_id in possible_captain_targets
-        ]
-        assassin_actions = [
-            Action(
-                action_type=self.get_assassin_action_type_from_target_player_id(
-                    target_player_id
-                ),
-                origin_player_id=self.player.id,
-                target_player_id=target_player_id,
-                can_be_countered=True,
-                can_be_challenged=True,
-            )
-            for target_player_id in possible_coup_and_assassin_targets
-        ]
-        revenue_action = Action(
-            action_type=ActionType.REVENUE,
-            origin_player_id=player.id,
-            target_player_id=-1,
-            can_be_countered=False,
-            can_be_challenged=False,
-        )
-        foreign_aid_action = Action(
-            action_type=ActionType.FOREIGN_AID,
-            origin_player_id=player.id,
-            target_player_id=-1,
-            can_be_countered=True,
-            can_be_challenged=False,
-        )
-        available_actions = []
-        if player.must_coup:
-            available_actions += coup_actions
-        else:
-            available_actions += [revenue_action, foreign_aid_action]
-            if player.can_coup and possible_coup_and_assassin_targets:
-                available_actions = coup_actions + [
-                    revenue_action,
-                    foreign_aid_action,
-                ]
-                if self.player.coins > 3:
-                    available_actions += assassin_actions
-            if possible_captain_targets:
-                available_actions += captain_actions
-        action_mask = self.create_action_mask(available_actions)
-        action = self.select_action(self.state, action_mask, available_actions)
-        return action
+    streams_history = True
 
-    def choose_challenge(
+    def __init__(
         self,
-        action_to_challenge: Action,  # will be used later with RL logic
-        player_to_challenge: Player,
-    ) -> Action:
-        available_actions = [
-            Action(
-                action_type=ActionType.CHALLENGE,
-                origin_player_id=self.player.id,
-                target_player_id=player_to_challenge.id,
-                can_be_countered=False,
-                can_be_challenged=False,
-            ),
-            Action(
-                action_type=ActionType.DO_NOTHING,
-                origin_player_id=self.player.id,
-                target_player_id=player_to_challenge.id,
-                can_be_countered=False,
-                can_be_challenged=False,
-            ),
-        ]
-        action_mask = self.create_action_mask(available_actions)
-        desired_challenge = self.select_action(
-            self.state, action_mask, available_actions
+        player: Player,
+        full_state_length: int,
+        state_item_width: int,
+        nb_players: int = 4,
+        epsilon: float = 0.1,
+        policy_net: RecurrentDQN | None = None,
+        history_window: int = 16,
+    ):
+        # Board info row, one row per player, one public hand row per player
+        # and the private hand row come before the histories
+        static_state_length = 2 + 2 * nb_players
+        if policy_net is None:
+            policy_net = RecurrentDQN(static_state_length, state_item_width, nb_players)
+            target_net = RecurrentDQN(static_state_length, state_item_width, nb_players)
+            target_net.load_state_dict(policy_net.state_dict())
+            target_net.eval()
+        else:
+            target_net = None
+        super().__init__(
+            player,
+            full_state_length,
+            state_item_width,
+            nb_players,
+            epsilon,
+            policy_net=policy_net,
         )
-        return desired_challenge
+        self.target_net = target_net
+        self.static_state_length = static_state_length
+        self.hidden_state = self.policy_net.initial_hidden_state()
+        self.pending_history_rows = []
+        self.window_rows = deque(maxlen=history_window)
+        self.window_hidden_states = deque(maxlen=history_window)
 
-    def choose_counter(
-        self,
-        action_to_counter: Action,  # will be used later with RL logic
-        player_to_counter: Player,
-    ) -> Action:
-        available_actions = [
-            Action(
-                action_type=ActionType.DO_NOTHING,
-                origin_player_id=self.player.id,
-                target_player_id=player_to_counter.id,
-                can_be_countered=False,
-                can_be_challenged=False,
-            ),
-        ]
-        if action_to_counter.action_type == ActionType.FOREIGN_AID:
-            available_actions.append(
-                Action(
-                    action_type=ActionType.COUNTER_FOREIGN_AID_WITH_DUKE,
-                    origin_player_id=self.player.id,
-                    target_player_id=player_to_counter.id,
-                    can_be_countered=False,
-                    can_be_challenged=True,
-                )
-            )
-        elif action_to_counter.action_type == ActionType.CAPTAIN:
-            available_actions.append(
-                Action(
-                    action_type=ActionType.COUNTER_CAPTAIN_WITH_CAPTAIN,
-                    origin_player_id=self.player.id,
-                    target_player_id=player_to_counter.id,
-                    can_be_countered=False,
-                    can_be_challenged=True,
-                )
-            )
-            available_actions.append(
-                Action(
-                    action_type=ActionType.COUNTER_CAPTAIN_WITH_AMBASSADOR,
-                    origin_player_id=self.player.id,
-                    target_player_id=player_to_counter.id,
-                    can_be_countered=False,
-                    can_be_challenged=True,
-                )
-            )
-        elif action_to_counter.action_type == ActionType.ASSASSIN:
-            available_actions.append(
-                Action(
-                    action_type=ActionType.COUNTER_ASSASSIN_WITH_CONTESSA,
-                    origin_player_id=self.player.id,
-                    target_player_id=player_to_counter.id,
-                    can_be_countered=False,
-                    can_be_challenged=True,
+    def reset(self):
+        super().reset()
+        self.hidden_state = self.policy_net.initial_hidden_state()
+        self.pending_history_rows = []
+        self.window_rows.clear()
+        self.window_hidden_states.clear()
+
+    def update_hidden_state(self):
+        if not self.pending_history_rows:
+            return
+        rows = torch.tensor(np.stack(self.pending_history_rows), dtype=torch.float).to(
+            self.device
+        )
+        with torch.no_grad():
+            if self.replay_buffer is None:
+                self.hidden_state = self.policy_net.encode_history(
+                    rows, self.hidden_state
                 )
+            else:
+                outputs = self.policy_net.encode_history_steps(rows, self.hidden_state)
+                self.window_rows.extend(self.pending_history_rows)
+                self.window_hidden_states.append(self.hidden_state.numpy())
+                self.window_hidden_states.extend(outputs[:-1].numpy())
+                self.hidden_state = outputs[-1]
+        self.pending_history_rows = []
+
+    def get_recurrent_context(self) -> RecurrentContext:
+        if not self.window_rows:
+            return RecurrentContext(
+                self.hidden_state.numpy(),
+                np.zeros((0, self.state_item_width), dtype=np.uint8),
             )
-        action_mask = self.create_action_mask(available_actions)
-        desired_counter = self.select_action(self.state, action_mask, available_actions)
-        return desired_counter
+        # Re-encoding the rows from the hidden state before the oldest one
+        # gives back the current hidden state
+        return RecurrentContext(
+            self.window_hidden_states[0], np.stack(self.window_rows)
+        )
+
+    def compute_q_values(
+        self, state: torch.tensor, action_mask: torch.tensor
+    ) -> torch.tensor:
+        self.update_hidden_state()
+        static_state = torch.tensor(
+            state[: self.static_state_length], dtype=torch.float
+        ).to(self.device)
+        return self.policy_net(static_state, self.hidden_state)
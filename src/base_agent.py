@@ -0,0 +1,222 @@
+import random
+from collections import OrderedDict
+import numpy as np
+from action import Action, get_action_id, get_nb_actions, make_action
+from action_mask import CHALLENGE_KEY, DISCARD_ACTION_TYPES, get_mask_generator
+from card import Card
+from player import Player
+from profiling import NULL_PROFILER
+from replay import NStepReplayWriter, RecurrentContext, ReplayBuffer
+
+
+class ObservationCache:
+    """Small LRU shared by the agents of a board, keyed by (agent id, state
+    version). The board bumps the version each time it re-encodes the
+    states, so an entry is only reused while the state it was computed
+    from is unchanged"""
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: tuple[int, int]):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: tuple[int, int], value):
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class BaseAgent:
+    """Decision plumbing shared by all agents: legal action masks, mapping
+    the chosen action id back to an Action and replay recording. Subclasses
+    only implement select_action_id. This module does not need torch, so
+    rules-only processes can play games with RandomAgent"""
+
+    # Set by agents that consume history rows one event at a time
+    streams_history = False
+    # Replaced by the board's profiler when instrumentation is enabled
+    profiler = NULL_PROFILER
+    # Set by the board: version of self.state and the cache shared by its agents
+    state_version = -1
+    observation_cache: ObservationCache | None = None
+    policy_net = None
+    target_net = None
+    # Set by a game_record.GameRecorder: every chosen action id is appended
+    decision_log: list[int] | None = None
+
+    def __init__(
+        self,
+        player: Player,
+        full_state_length: int,
+        state_item_width: int,
+        nb_players: int = 4,
+    ):
+        self.id = player.id
+        self.player = player
+        self.state = None
+        self.full_state_length = full_state_length
+        self.state_item_width = state_item_width
+        self.nb_players = nb_players
+        self.n_actions = get_nb_actions(nb_players)
+        self.action_masks = get_mask_generator(nb_players)
+        self.replay_buffer: ReplayBuffer | NStepReplayWriter | None = None
+        self.last_decision = None
+
+    def reset(self):
+        # Called by Board.reset when the agent is reused for a new game, the
+        # game before may have been cut short without calling end_episode
+        if isinstance(self.replay_buffer, NStepReplayWriter):
+            self.replay_buffer.flush()
+        self.last_decision = None
+
+    def get_action_id(self, action: Action) -> int:
+        return get_action_id(
+            action.action_type, action.target_player_id, self.nb_players
+        )
+
+    def get_recurrent_context(self) -> RecurrentContext | None:
+        # Only recurrent agents carry a hidden state
+        return None
+
+    def select_action_id(self, state: np.ndarray, action_mask: np.ndarray) -> int:
+        raise NotImplementedError
+
+    def decide(self, state: np.ndarray, action_mask: np.ndarray) -> int:
+        # Every decision goes through here so any agent can feed a replay
+        # buffer, a dataset exporter or a game record
+        action_id = self.select_action_id(state, action_mask)
+        if self.decision_log is not None:
+            self.decision_log.append(action_id)
+        if self.replay_buffer is not None:
+            self.record_decision(state, action_mask, action_id)
+        return action_id
+
+    def record_decision(self, state, action_mask: np.ndarray, action_id: int):
+        # A decision completes the transition started by the previous one
+        decision = (state, action_mask, action_id, self.get_recurrent_context())
+        if self.last_decision is not None:
+            self.push_transition(self.last_decision, decision, reward=0.0, done=False)
+        self.last_decision = decision
+
+    def end_episode(self, reward: float):
+        if self.replay_buffer is not None and self.last_decision is not None:
+            self.push_transition(self.last_decision, None, reward=reward, done=True)
+        self.last_decision = None
+
+    def push_transition(self, decision, next_decision, reward: float, done: bool):
+        state, action_mask, action_id, context = decision
+        if next_decision is None:
+            # Terminal transition, the next state is never bootstrapped from
+            next_decision = (state, action_mask * 0, action_id, context)
+        next_state, next_action_mask, _, next_context = next_decision
+        self.replay_buffer.add(
+            state,
+            action_mask,
+            action_id,
+            reward,
+            next_state,
+            next_action_mask,
+            done,
+            context=context,
+            next_context=next_context,
+        )
+
+    def choose_card_to_reveal(self, hand: list[Card]) -> Card:
+        with self.profiler.phase("reveal_discard"):
+            return self.choose_card_to_reveal_from_hand(hand)
+
+    def choose_card_to_reveal_from_hand(self, hand: list[Card]) -> Action:
+        if any(not card.is_revealed for card in hand):
+            action_mask = self.action_masks.mask(self.action_masks.reveal_key(hand))
+            action_id = self.decide(self.state, action_mask)
+            return make_action(action_id, self.player.id, self.nb_players)
+        else:
+            return ValueError("No card to reveal")
+
+    def choose_card_to_discard(self, hand: list[Card]) -> Card:
+        with self.profiler.phase("reveal_discard"):
+            return self.choose_card_to_discard_from_hand(hand)
+
+    def choose_card_to_discard_from_hand(self, hand: list[Card]):
+        key = self.action_masks.discard_key(hand)
+        if key.hand:
+            action_mask = self.action_masks.mask(key)
+            action_id = self.decide(self.state, action_mask)
+            action = make_action(action_id, self.player.id, self.nb_players)
+            character = next(
+                character
+                for character, action_type in DISCARD_ACTION_TYPES.items()
+                if action_type == action.action_type
+            )
+            card = next(
+                card
+                for card in self.player.hand
+                if card.character == character and not card.is_revealed
+            )
+            return action, card
+        else:
+            return ValueError("No card to discard")
+
+    def choose_action(self, player: Player, alive_players: list[Player]) -> Action:
+        action_mask = self.action_masks.mask(
+            self.action_masks.action_key(player, alive_players)
+        )
+        action_id = self.decide(self.state, action_mask)
+        return make_action(action_id, player.id, self.nb_players)
+
+    def choose_challenge(
+        self,
+        action_to_challenge: Action,  # will be used later with RL logic
+        player_to_challenge: Player,
+    ) -> Action:
+        action_mask = self.action_masks.mask(CHALLENGE_KEY)
+        action_id = self.decide(self.state, action_mask)
+        return make_action(
+            action_id, self.player.id, self.nb_players, player_to_challenge.id
+        )
+
+    def choose_counter(
+        self,
+        action_to_counter: Action,  # will be used later with RL logic
+        player_to_counter: Player,
+    ) -> Action:
+        action_mask = self.action_masks.mask(
+            self.action_masks.counter_key(action_to_counter.action_type)
+        )
+        action_id = self.decide(self.state, action_mask)
+        return make_action(
+            action_id, self.player.id, self.nb_players, player_to_counter.id
+        )
+
+
+class RandomAgent(BaseAgent):
+    # Baseline agent choosing uniformly among the legal actions, it has no network
+    def __init__(
+        self,
+        player: Player,
+        full_state_length: int,
+        state_item_width: int,
+        nb_players: int = 4,
+        rng: random.Random | None = None,
+    ):
+        super().__init__(player, full_state_length, state_item_width, nb_players)
+        self.rng = rng if rng is not None else random.Random()
+
+    def select_action_id(self, state: np.ndarray, action_mask: np.ndarray) -> int:
+        return int(self.rng.choice(np.flatnonzero(action_mask)))
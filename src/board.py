@@ -1,17 +1,28 @@
 import random
 import numpy as np
-from action import Action, ActionType
+from action import MAX_PLAYERS, MIN_PLAYERS, Action, ActionType
 from card import Card
 from character import Character
 from player import Player
-from deck import Deck
-from agent import CoupAgent
+from deck import CHARACTERS, Deck
+from history import CompactHistory
+from base_agent import BaseAgent, ObservationCache
 from pydantic import BaseModel
+from profiling import NULL_PROFILER
+from metrics import NULL_METRICS
+
+
+def default_agent_factories(nb_players: int) -> list:
+    # The DQN agent pulls in torch, it is only imported by games that are
+    # started without agent factories
+    from agent import CoupAgent
+
+    return [CoupAgent] * nb_players
 
 
 class ActionHistoryItem(BaseModel):
     origin_player: Player
-    target_player: Player
+    target_player: Player | None
     action_type: ActionType
 
 
@@ -26,26 +37,63 @@ class DeckHistoryItem(BaseModel):
 class Board:
     nb_players: int
     players: list[Player]
-    agents: list[CoupAgent]
+    agents: list[BaseAgent]
+    streaming_agents: list[BaseAgent]
     alive_players: list[Player]
     current_player: Player
     deck: Deck
     game_has_started: bool
     game_has_ended: bool
     state_item_length = 128
-    full_state_length = 392
+    full_state_length: int
     state_item_width = 128
     agents_states: np.ndarray
     actions_history: list[ActionHistoryItem]
     deck_history: list[DeckHistoryItem]
 
-    def __init__(self, nb_players: int = 4):
+    def __init__(
+        self,
+        nb_players: int = 4,
+        seed: int | None = None,
+        profiler=None,
+        metrics=None,
+        history_length: int | None = None,
+    ):
+        if not MIN_PLAYERS <= nb_players <= MAX_PLAYERS:
+            raise ValueError(
+                f"nb_players must be between {MIN_PLAYERS} and {MAX_PLAYERS}, got {nb_players}"
+            )
         self.nb_players = nb_players
+        # board info row, one row per player, one public hand row per player,
+        # the private hand row, then the actions and the two deck histories
+        self.full_state_length = 2 + 2 * nb_players + 3 * self.state_item_length
+        # Opt-in bounded history: the last history_length events and one
+        # summary row per player replace the full histories, see
+        # history.CompactHistory
+        self.history = None
+        if history_length is not None:
+            self.history = CompactHistory(nb_players, history_length)
+            self.full_state_length = 2 + 3 * nb_players + 3 * history_length
         self.players = []
         self.agents = []
+        self.streaming_agents = []
+        self.eliminated_players = []
         self.current_player = None
         self.game_has_started = False
         self.game_has_ended = True
+        self.rng = random.Random(seed)
+        # Reused across games started with reset
+        self.cards = []
+        self.initial_state_template = None
+        self.initial_states = None
+        # Opt-in instrumentation, see profiling.Profiler
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        # Opt-in game statistics, see metrics.GameMetrics
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self.nb_moves = 0
+        # Bumped each time the agent states are re-encoded, see ObservationCache
+        self.state_version = 0
+        self.observation_cache = ObservationCache()
 
     def get_player_by_id(self, id: int):
         return self.players[id]
@@ -59,7 +107,7 @@ class Board:
     def return_card_from_player_to_deck(self, card: Card, player: Player, public=False):
         self.deck.add_card(card)
         player.lose_card(card)
-        self.deck_history.append(
+        self.append_deck_history_item(
             DeckHistoryItem(
                 card=card,
                 returned_from=True,
@@ -68,12 +116,11 @@ class Board:
                 public=public,
             )
         )
-        self.deck_history = self.deck_history[-self.state_item_length :]
         self.update_agent_states()
 
     def draw_single_card_from_deck_to_player(self, player: Player):
         player.hand.append(self.deck.draw())
-        self.deck_history.append(
+        self.append_deck_history_item(
             DeckHistoryItem(
                 card=player.hand[-1],
                 returned_from=False,
@@ -82,13 +129,14 @@ class Board:
                 public=False,
             )
         )
-        self.deck_history = self.deck_history[-self.state_item_length :]
         self.update_agent_states()
 
-    def start(self):
+    def start(self, agent_factories: list | None = None):
+        # agent_factories optionally holds one callable per seat with the
+        # BaseAgent signature (player, full_state_length, state_item_width)
         self.game_has_started = True
         self.game_has_ended = False
-        self.deck = Deck()
+        self.deck = Deck(rng=self.rng)
         self.deck.shuffle()
         # Clear existing players
         self.players = []
@@ -106,26 +154,147 @@ class Board:
             )
             self.players.append(player)
         self.alive_players = self.players.copy()
-        self.agents = [
-            CoupAgent(player, self.full_state_length, self.state_item_width)
-            for player in self.players
-        ]
+        self.eliminated_players = []
+        if agent_factories is None:
+            agent_factories = default_agent_factories(self.nb_players)
+        with self.profiler.phase("agent_setup"):
+            self.agents = [
+                agent_factory(
+                    player,
+                    self.full_state_length,
+                    self.state_item_width,
+                    self.nb_players,
+                )
+                for agent_factory, player in zip(agent_factories, self.players)
+            ]
         for agent in self.agents:
             agent.player.agent_id = agent.id
-        self.current_player = random.choice(self.alive_players)
+            agent.profiler = self.profiler
+            agent.observation_cache = self.observation_cache
+        # Agents with a recurrent history encoder get each new history row
+        self.streaming_agents = [
+            agent for agent in self.agents if agent.streams_history
+        ]
+        self.current_player = self.rng.choice(self.alive_players)
+        self.nb_moves = 0
         self.actions_history = []
         self.deck_history = []
+        if self.history is not None:
+            self.history.clear()
         self.update_agent_states()
 
+    def reset(self, deal: np.ndarray, agent_factories: list | None = None):
+        """Start a new game from a pre-dealt deck (see deck.DealPool), reusing
+        the cards, players and agents of the previous game. Agents are only
+        built on the first call or when agent_factories is given"""
+        deck_size = len(deal) - 1
+        if len(self.cards) != deck_size:
+            self.cards = [
+                Card(character=CHARACTERS[i % len(CHARACTERS)], is_revealed=False)
+                for i in range(deck_size)
+            ]
+            self.deck = Deck(rng=self.rng)
+            self.players = [
+                Player(
+                    id=i,
+                    name=f"Player {i}",
+                    hand=[],
+                    coins=2,
+                    can_coup=False,
+                    must_coup=False,
+                    is_alive=True,
+                    nb_remaining_cards=2,
+                )
+                for i in range(self.nb_players)
+            ]
+            self.agents = []
+        for card in self.cards:
+            card.is_revealed = False
+        self.deck.deck = [self.cards[card_id] for card_id in deal[:deck_size]]
+        for player in self.players:
+            player.hand = self.deck.draw(2)
+            player.coins = 2
+            player.can_coup = False
+            player.must_coup = False
+            player.is_alive = True
+            player.nb_remaining_cards = 2
+        self.game_has_started = True
+        self.game_has_ended = False
+        self.alive_players = self.players.copy()
+        self.eliminated_players = []
+        self.current_player = self.players[deal[deck_size]]
+        self.nb_moves = 0
+        self.actions_history = []
+        self.deck_history = []
+        if self.history is not None:
+            self.history.clear()
+        if agent_factories is not None or not self.agents:
+            if agent_factories is None:
+                agent_factories = default_agent_factories(self.nb_players)
+            with self.profiler.phase("agent_setup"):
+                self.agents = [
+                    agent_factory(
+                        player,
+                        self.full_state_length,
+                        self.state_item_width,
+                        self.nb_players,
+                    )
+                    for agent_factory, player in zip(agent_factories, self.players)
+                ]
+            for agent in self.agents:
+                agent.player.agent_id = agent.id
+                agent.profiler = self.profiler
+                agent.observation_cache = self.observation_cache
+            self.streaming_agents = [
+                agent for agent in self.agents if agent.streams_history
+            ]
+        else:
+            for agent in self.agents:
+                agent.reset()
+        if self.initial_state_template is None:
+            self.update_agent_states()
+            self.initial_state_template = self.agents[0].state.copy()
+            self.initial_states = np.empty(
+                (self.nb_players, *self.initial_state_template.shape),
+                dtype=self.initial_state_template.dtype,
+            )
+        # Before the first move no encoded row depends on the deal: every
+        # hand is unrevealed, coins are equal and the histories are empty,
+        # so every seat starts from a copy of the same template
+        for agent, initial_state in zip(self.agents, self.initial_states):
+            np.copyto(initial_state, self.initial_state_template)
+            agent.state = initial_state
+        self.bump_state_version()
+
     def extend_actions_history(self, action: Action):
-        self.actions_history.append(
-            ActionHistoryItem(
-                origin_player=self.get_player_by_id(action.origin_player_id),
-                target_player=self.get_player_by_id(action.target_player_id),
-                action_type=action.action_type,
+        if self.history is not None:
+            self.history.add_action(
+                action.origin_player_id, action.action_type, action.target_player_id
             )
+            for agent in self.streaming_agents:
+                agent.pending_history_rows.append(
+                    self.encode_streamed_history_row(
+                        self.history.last_action_row(self.state_item_width),
+                        event_kind=0,
+                    )
+                )
+            self.update_agent_states()
+            return
+        item = ActionHistoryItem(
+            origin_player=self.get_player_by_id(action.origin_player_id),
+            target_player=self.get_player_by_id(action.target_player_id)
+            if action.target_player_id != -1
+            else None,
+            action_type=action.action_type,
         )
+        self.actions_history.append(item)
         self.actions_history = self.actions_history[-self.state_item_length :]
+        for agent in self.streaming_agents:
+            agent.pending_history_rows.append(
+                self.encode_streamed_history_row(
+                    self.encode_action_history_item(item), event_kind=0
+                )
+            )
         self.update_agent_states()
 
     def extend_deck_history(
@@ -134,21 +303,140 @@ class Board:
         returned_from: bool,
         given_to: bool,
         player: Player,
-        visibility: list[Player],
+        public: bool,
     ):
-        self.deck_history.append(
+        self.append_deck_history_item(
             DeckHistoryItem(
                 card=card,
                 returned_from=returned_from,
                 given_to=given_to,
                 player=player,
-                visibility=visibility,
+                public=public,
             )
         )
-        self.deck_history = self.deck_history[-self.state_item_length :]
         self.update_agent_states()
 
+    def append_deck_history_item(self, item: DeckHistoryItem):
+        if self.history is not None:
+            self.history.add_deck_event(
+                item.card.character, item.returned_from, item.player.id, item.public
+            )
+            for agent in self.streaming_agents:
+                viewer_id = None if item.public else agent.player.id
+                agent.pending_history_rows.append(
+                    self.encode_streamed_history_row(
+                        self.history.last_deck_row(self.state_item_width, viewer_id),
+                        event_kind=1,
+                    )
+                )
+            return
+        self.deck_history.append(item)
+        self.deck_history = self.deck_history[-self.state_item_length :]
+        for agent in self.streaming_agents:
+            # Streamed deck events show the card if it is public or the agent's own
+            viewer_id = None if item.public else agent.player.id
+            agent.pending_history_rows.append(
+                self.encode_streamed_history_row(
+                    self.encode_deck_history_item(item, viewer_id), event_kind=1
+                )
+            )
+
+    def encode_action_history_item(self, item: ActionHistoryItem) -> np.ndarray:
+        # Create one-hot vectors for each component
+        origin_vector = [
+            0 if i != item.origin_player.id else 1
+            for i in range(self.state_item_width // 4)
+        ]
+        action_type_vector = [
+            0 if i != item.action_type.value else 1
+            for i in range(self.state_item_width // 4)
+        ]
+        target_vector = [
+            0 if item.target_player is None or i != item.target_player.id else 1
+            for i in range(self.state_item_width // 4)
+        ]
+        # Combine the vectors while maintaining state_item_width dimension
+        return np.concatenate(
+            [
+                origin_vector,
+                action_type_vector,
+                target_vector,
+                np.zeros(self.state_item_width // 4),
+            ]
+        )  # shape: (state_item_width,)
+
+    def encode_deck_history_item(
+        self, item: DeckHistoryItem, viewer_id: int | None = None
+    ) -> np.ndarray:
+        # Without a viewer the card is only shown when public, otherwise it is
+        # only shown to the player it was returned from or given to
+        is_visible = item.public if viewer_id is None else item.player.id == viewer_id
+        if is_visible:
+            card_representation = [
+                1 if i != item.card.character.to_int() else 0
+                for i in range(self.state_item_width // 4)
+            ]
+        else:
+            card_representation = [
+                1 if i == 0 else 0 for i in range(self.state_item_width // 4)
+            ]
+        returned_from_or_given_to_vector = [
+            0 if i != item.returned_from else 1
+            for i in range(self.state_item_width // 4)
+        ]
+        player_vector = [
+            0 if i != item.player.id else 1 for i in range(self.state_item_width // 4)
+        ]
+        return np.concatenate(
+            [
+                card_representation,
+                returned_from_or_given_to_vector,
+                player_vector,
+                np.zeros(self.state_item_width // 4),
+            ]
+        )
+
+    def encode_streamed_history_row(
+        self, row: np.ndarray, event_kind: int
+    ) -> np.ndarray:
+        # Streamed rows interleave both histories, the unused last quarter
+        # tells actions (0) and deck events (1) apart
+        row[3 * self.state_item_width // 4 + event_kind] = 1
+        return row
+
+    # Game events of the metrics hooks, also counted by the compact history
+    def on_claim(self, player: Player, action: Action):
+        if self.history is not None:
+            self.history.claim(player.id, action.action_type)
+        self.metrics.claim(player, action)
+
+    def on_challenge(
+        self,
+        action_type: ActionType,
+        is_bluffing: bool,
+        challenger: Player,
+        claimant: Player,
+    ):
+        if self.history is not None:
+            self.history.challenge(challenger.id, is_bluffing)
+        self.metrics.challenge(action_type, is_bluffing, challenger, claimant)
+
+    def on_steal(self, player: Player, target: Player, amount: int):
+        if self.history is not None:
+            self.history.steal(player.id, amount)
+        self.metrics.steal(player, target, amount)
+
     def update_agent_states(self):
+        with self.profiler.phase("update_agent_states"):
+            self.encode_agent_states()
+        self.bump_state_version()
+
+    def bump_state_version(self):
+        self.state_version += 1
+        for agent in self.agents:
+            agent.state_version = self.state_version
+
+    def encode_agent_states(self):
         """Convert the game state into a numerical representation"""
         deck_size_vector = np.array(
             [
@@ -162,21 +450,23 @@ class Board:
                 for i in range(self.state_item_width // 4)
             ]
         )
-        player_coins_vectors = np.concatenate(
+        # One row per player so the state grows with the number of players
+        # instead of the one-hot width
+        player_rows = np.stack(
             [
-                [
-                    0 if i != player.coins else 1
-                    for i in range(self.state_item_width // 4)
-                ]
-                for player in self.players
-            ]
-        )
-        players_alive_status_vectors = np.concatenate(
-            [
-                [
-                    1 if i == player.id and player.is_alive else 0
-                    for i in range(self.state_item_width // 4)
-                ]
+                np.concatenate(
+                    [
+                        [
+                            0 if i != player.coins else 1
+                            for i in range(self.state_item_width // 4)
+                        ],
+                        [
+                            0 if i != int(player.is_alive) else 1
+                            for i in range(self.state_item_width // 4)
+                        ],
+                        np.zeros(self.state_item_width // 2),
+                    ]
+                )
                 for player in self.players
             ]
         )
@@ -230,33 +520,27 @@ class Board:
                 ],
             )
 
-        # Create actions history with proper shape (state_item_length x state_item_width)
-        actions_history = []
-        for action in self.actions_history:
-            # Create one-hot vectors for each component
-            origin_vector = [
-                0 if i != action.origin_player.id else 1
-                for i in range(self.state_item_width // 4)
-            ]
-            action_type_vector = [
-                0 if i != action.action_type.value else 1
-                for i in range(self.state_item_width // 4)
-            ]
-            target_vector = [
-                0 if i != action.target_player.id else 1
-                for i in range(self.state_item_width // 4)
+        deck_size_plus_nb_players_vectors = np.concatenate(
+            [deck_size_vector, nb_players_vector, np.zeros(self.state_item_width // 2)]
+        )
+
+        board_info = np.vstack(
+            [
+                deck_size_plus_nb_players_vectors,
+                player_rows,
             ]
+        )
 
-            # Combine the vectors while maintaining state_item_width dimension
-            action_representation = np.concatenate(
-                [
-                    origin_vector,
-                    action_type_vector,
-                    target_vector,
-                    np.zeros(self.state_item_width // 4),
-                ]
-            )  # shape: (state_item_width,)
-            actions_history.append(action_representation)
+        if self.history is not None:
+            self.encode_compact_agent_states(
+                board_info, public_player_hands, private_player_hands
+            )
+            return
+
+        # Create actions history with proper shape (state_item_length x state_item_width)
+        actions_history = [
+            self.encode_action_history_item(item) for item in self.actions_history
+        ]
 
         # Convert to numpy array and ensure proper shape
         actions_history = (
@@ -265,35 +549,9 @@ class Board:
             else np.zeros((0, self.state_item_width))
         )
         # Deck history with proper shape (n, state_item_width)
-        public_deck_history = []
-        for item in self.deck_history:
-            if item.public:
-                card_representation = [
-                    1 if i != item.card.character.to_int() else 0
-                    for i in range(self.state_item_width // 4)
-                ]
-            else:
-                card_representation = [
-                    1 if i == 0 else 0 for i in range(self.state_item_width // 4)
-                ]
-            returned_from_or_given_to_vector = [
-                0 if i != item.returned_from else 1
-                for i in range(self.state_item_width // 4)
-            ]
-            player_vector = [
-                0 if i != item.player.id else 1
-                for i in range(self.state_item_width // 4)
-            ]
-            public_deck_history.append(
-                np.concatenate(
-                    [
-                        card_representation,
-                        returned_from_or_given_to_vector,
-                        player_vector,
-                        np.zeros(self.state_item_width // 4),
-                    ]
-                )
-            )
+        public_deck_history = [
+            self.encode_deck_history_item(item) for item in self.deck_history
+        ]
 
         # Convert to numpy array with proper shape
         public_deck_history = (
@@ -304,38 +562,10 @@ class Board:
         # Like private player hands, each deck history item where the player has not seen the card has hidden card representation
         private_deck_history = {}
         for player in self.players:
-            private_deck_history[player.id] = []
-            for item in self.deck_history:
-                # Create card representation
-                if item.player.id == player.id:
-                    card_representation = [
-                        1 if i != item.card.character.to_int() else 0
-                        for i in range(self.state_item_width // 4)
-                    ]
-                else:
-                    card_representation = [
-                        1 if i == 0 else 0 for i in range(self.state_item_width // 4)
-                    ]
-                returned_from_or_given_to_vector = [
-                    0 if i != item.returned_from else 1
-                    for i in range(self.state_item_width // 4)
-                ]
-                player_vector = [
-                    0 if i != item.player.id else 1
-                    for i in range(self.state_item_width // 4)
-                ]
-
-                # Convert to numpy array and append
-                private_deck_history[player.id].append(
-                    np.concatenate(
-                        [
-                            card_representation,
-                            returned_from_or_given_to_vector,
-                            player_vector,
-                            np.zeros(self.state_item_width // 4),
-                        ]
-                    )
-                )
+            private_deck_history[player.id] = [
+                self.encode_deck_history_item(item, player.id)
+                for item in self.deck_history
+            ]
 
             # Convert list to numpy array with proper shape
             if private_deck_history[player.id]:
@@ -347,18 +577,6 @@ class Board:
                 # Initialize with empty array of proper shape
                 private_deck_history[player.id] = np.zeros((0, self.state_item_width))
 
-        deck_size_plus_nb_players_vectors = np.concatenate(
-            [deck_size_vector, nb_players_vector, np.zeros(self.state_item_width // 2)]
-        )
-
-        board_info = np.stack(
-            [
-                deck_size_plus_nb_players_vectors,
-                player_coins_vectors,
-                players_alive_status_vectors,
-            ]
-        )
-
         padded_actions_history = np.vstack(
             [
                 actions_history.squeeze(),
@@ -437,6 +655,34 @@ class Board:
                 ]
             )
 
+    def encode_compact_agent_states(
+        self,
+        board_info: np.ndarray,
+        public_player_hands: np.ndarray,
+        private_player_hands: dict[int, np.ndarray],
+    ):
+        # The summary rows follow the hands, then the last events of the
+        # actions, public deck and private deck histories padded to
+        # history.length rows each
+        history = self.history
+        shared_rows = np.vstack(
+            [
+                history.encode_summary(self.state_item_width),
+                history.encode_actions(self.state_item_width),
+                history.encode_deck_events(self.state_item_width),
+            ]
+        )
+        for agent in self.agents:
+            agent.state = np.vstack(
+                [
+                    board_info,
+                    public_player_hands,
+                    private_player_hands[agent.player.id],
+                    shared_rows,
+                    history.encode_deck_events(self.state_item_width, agent.player.id),
+                ]
+            )
+
     def check_if_game_has_ended(self):
         # Find next alive player before updating alive status else IndexError
         # print(
@@ -448,6 +694,8 @@ class Board:
             player.is_alive = any(not card.is_revealed for card in player.hand)
             if not player.is_alive:
                 player.coins = 0
+                if player not in self.eliminated_players:
+                    self.eliminated_players.append(player)
 
         # Update alive players list
         self.alive_players = [player for player in self.players if player.is_alive]
@@ -473,7 +721,7 @@ class Board:
         return False
 
     def execute_action(
-        self, agent: CoupAgent, player: Player, action: Action, last_actions: list[str]
+        self, agent: BaseAgent, player: Player, action: Action, last_actions: list[str]
     ):
         if not action.can_be_challenged and not action.can_be_countered:
             # Revenue
@@ -483,12 +731,7 @@ class Board:
                 self.extend_actions_history(action)
                 self.update_agent_states()
             # Coup
-            elif (
-                action.action_type == ActionType.COUP_TARGET_PLAYER_0
-                or action.action_type == ActionType.COUP_TARGET_PLAYER_1
-                or action.action_type == ActionType.COUP_TARGET_PLAYER_2
-                or action.action_type == ActionType.COUP_TARGET_PLAYER_3
-            ):
+            elif action.action_type == ActionType.COUP:
                 target_player = self.get_player_by_id(action.target_player_id)
                 target_player_agent = self.agents[target_player.agent_id]
                 player.pay_coup(target_player)
@@ -511,14 +754,16 @@ class Board:
                 last_actions.append(last_action)
                 self.extend_actions_history(action)
                 self.update_agent_states()
+                self.on_claim(player, action)
                 # Get eventual challenges
-                challenges = [
-                    agent.choose_challenge(
-                        player, self.get_player_by_id(agent.player.id)
-                    )
-                    for agent in self.agents
-                    if agent.player.id != player.id
-                ]
+                with self.profiler.phase("challenge_polling"):
+                    challenges = [
+                        agent.choose_challenge(
+                            player, self.get_player_by_id(agent.player.id)
+                        )
+                        for agent in self.agents
+                        if agent.player.id != player.id and agent.player.is_alive
+                    ]
                 challenges = [
                     action
                     for action in challenges
@@ -527,7 +772,7 @@ class Board:
                 if challenges:
                     action.can_be_countered = False  # Action that is challenged cannot be countered afterwards
                     # Select a challenge
-                    selected_challenge = random.choice(challenges)
+                    selected_challenge = self.rng.choice(challenges)
                     challenging_player = self.get_player_by_id(
                         selected_challenge.origin_player_id
                     )
@@ -538,17 +783,15 @@ class Board:
                     self.extend_actions_history(selected_challenge)
                     self.update_agent_states()
                     is_bluffing, action_card = player.is_bluffing(action)
+                    self.on_challenge(
+                        action.action_type, is_bluffing, challenging_player, player
+                    )
                     # Challenge successful
                     if is_bluffing:
                         card_to_reveal_action = agent.choose_card_to_reveal(player.hand)
                         self.reveal_player_card(player, card_to_reveal_action)
                         # Player still pays for failed assassin action
-                        if (
-                            action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_0
-                            or action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_1
-                            or action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_2
-                            or action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_3
-                        ):
+                        if action.action_type == ActionType.ASSASSIN:
                             player.lose_coins(3)
                         last_actions.append(
                             f"{player.name} was bluffing action {action.action_type} and lost an influence"
@@ -577,39 +820,32 @@ class Board:
                             last_actions.append(
                                 f"{player.name} gained 3 coins with duke"
                             )
-                        elif (
-                            action.action_type == ActionType.CAPTAIN_TARGET_PLAYER_0
-                            or action.action_type == ActionType.CAPTAIN_TARGET_PLAYER_1
-                            or action.action_type == ActionType.CAPTAIN_TARGET_PLAYER_2
-                            or action.action_type == ActionType.CAPTAIN_TARGET_PLAYER_3
-                        ):
+                        elif action.action_type == ActionType.CAPTAIN:
                             target_player = self.get_player_by_id(
                                 action.target_player_id
                             )
                             target_player.lose_coins(2)
                             player.gain_coins(2)
+                            self.on_steal(player, target_player, 2)
                             player.update_coup_status()
                             last_actions.append(
                                 f"{player.name} successfully stole 2 coins from {target_player.name} with action {action.action_type}"
                             )
-                        elif (
-                            action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_0
-                            or action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_1
-                            or action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_2
-                            or action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_3
-                        ):
+                        elif action.action_type == ActionType.ASSASSIN:
                             target_player = self.get_player_by_id(
                                 action.target_player_id
                             )
                             target_player_agent = self.agents[target_player.agent_id]
-                            card_to_reveal_action = (
-                                target_player_agent.choose_card_to_reveal(
-                                    target_player.hand
+                            # Target may have lost its last influence by challenging
+                            if any(not card.is_revealed for card in target_player.hand):
+                                card_to_reveal_action = (
+                                    target_player_agent.choose_card_to_reveal(
+                                        target_player.hand
+                                    )
+                                )
+                                self.reveal_player_card(
+                                    target_player, card_to_reveal_action
                                 )
-                            )
-                            self.reveal_player_card(
-                                target_player, card_to_reveal_action
-                            )
                             player.pay_assassin()
                             last_actions.append(
                                 f"{player.name} successfully assassinated {target_player.name} with action {action.action_type}"
@@ -642,14 +878,15 @@ class Board:
             if action.can_be_countered:
                 # Get eventual counters
                 last_actions.append(f"{player.name} tries to use {action.action_type}")
-                counters = [
-                    agent.choose_counter(
-                        action_to_counter=action,
-                        player_to_counter=agent.player,
-                    )
-                    for agent in self.agents
-                    if agent.player.id != player.id
-                ]
+                with self.profiler.phase("counter_polling"):
+                    counters = [
+                        agent.choose_counter(
+                            action_to_counter=action,
+                            player_to_counter=agent.player,
+                        )
+                        for agent in self.agents
+                        if agent.player.id != player.id and agent.player.is_alive
+                    ]
                 counters = [
                     action
                     for action in counters
@@ -657,7 +894,7 @@ class Board:
                 ]
                 if counters:
                     # Select a counter
-                    selected_counter = random.choice(counters)
+                    selected_counter = self.rng.choice(counters)
                     countering_player = self.get_player_by_id(
                         selected_counter.origin_player_id
                     )
@@ -667,6 +904,7 @@ class Board:
                     )
                     self.extend_actions_history(selected_counter)
                     self.update_agent_states()
+                    self.on_claim(countering_player, selected_counter)
                     # All counters can be challenged
                     challenge = agent.choose_challenge(
                         action_to_challenge=action,
@@ -682,6 +920,12 @@ class Board:
                         is_bluffing, countering_card = countering_player.is_bluffing(
                             selected_counter
                         )
+                        self.on_challenge(
+                            selected_counter.action_type,
+                            is_bluffing,
+                            player,
+                            countering_player,
+                        )
                         # Challenge successful
                         if is_bluffing:
                             card_to_reveal_action = (
@@ -701,20 +945,13 @@ class Board:
                                 last_actions.append(
                                     f"{player.name} successfully collected 2 coins with foreign aid"
                                 )
-                            elif (
-                                action.action_type == ActionType.CAPTAIN_TARGET_PLAYER_0
-                                or action.action_type
-                                == ActionType.CAPTAIN_TARGET_PLAYER_1
-                                or action.action_type
-                                == ActionType.CAPTAIN_TARGET_PLAYER_2
-                                or action.action_type
-                                == ActionType.CAPTAIN_TARGET_PLAYER_3
-                            ):
+                            elif action.action_type == ActionType.CAPTAIN:
                                 target_player = self.get_player_by_id(
                                     action.target_player_id
                                 )
                                 target_player.lose_coins(2)
                                 player.gain_coins(2)
+                                self.on_steal(player, target_player, 2)
                                 player.update_coup_status()
                                 last_actions.append(
                                     f"{player.name} successfully stole 2 coins from {target_player.name} with CAPTAIN"
@@ -754,25 +991,16 @@ class Board:
                         last_actions.append(
                             f"{player.name} successfully collected 2 coins with foreign aid"
                         )
-                    elif (
-                        action.action_type == ActionType.CAPTAIN_TARGET_PLAYER_0
-                        or action.action_type == ActionType.CAPTAIN_TARGET_PLAYER_1
-                        or action.action_type == ActionType.CAPTAIN_TARGET_PLAYER_2
-                        or action.action_type == ActionType.CAPTAIN_TARGET_PLAYER_3
-                    ):
+                    elif action.action_type == ActionType.CAPTAIN:
                         target_player = self.get_player_by_id(action.target_player_id)
                         target_player.lose_coins(2)
                         player.gain_coins(2)
+                        self.on_steal(player, target_player, 2)
                         player.update_coup_status()
                         last_actions.append(
                             f"{player.name} successfully stole 2 coins from {target_player.name} with CAPTAIN"
                         )
-                    elif (
-                        action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_0
-                        or action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_1
-                        or action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_2
-                        or action.action_type == ActionType.ASSASSIN_TARGET_PLAYER_3
-                    ):
+                    elif action.action_type == ActionType.ASSASSIN:
                         target_player = self.get_player_by_id(action.target_player_id)
                         target_player_agent = self.agents[target_player.agent_id]
                         card_to_reveal_action = (
@@ -807,28 +1035,75 @@ class Board:
         if self.check_if_game_has_ended():
             return []
 
+        self.profiler.begin_move()
         # Get current player and their agent
         current_player = self.current_player
         current_agent = self.agents[current_player.id]
 
         # Get state and desired action from agent
-        chosen_action = current_agent.choose_action(current_player, self.alive_players)
+        with self.profiler.phase("action_selection"):
+            chosen_action = current_agent.choose_action(
+                current_player, self.alive_players
+            )
 
         # Execute action and update states
-        last_actions = self.execute_action(
-            agent=current_agent,
-            player=current_player,
-            action=chosen_action,
-            last_actions=last_actions,
-        )
+        with self.profiler.phase("execute_action"):
+            last_actions = self.execute_action(
+                agent=current_agent,
+                player=current_player,
+                action=chosen_action,
+                last_actions=last_actions,
+            )
+        self.profiler.end_move()
+        self.nb_moves += 1
+        self.metrics.end_move(self)
         while len(last_actions) > last_actions_max_length:
             last_actions.pop(0)
-        # print(f"Last actions: {last_actions}")
-        for agent in self.agents:
-            # print(f"Agent {agent.player.name} state: {agent.state}")
-            print(agent.state.shape)
 
         # if self.check_if_game_has_ended():
         #     return []
 
         return last_actions
+
+
+def game_placements(board: Board) -> list[int]:
+    # Players eliminated first get the worst placement, survivors of an
+    # unfinished game all share the first place
+    placements = [1] * board.nb_players
+    for order, player in enumerate(board.eliminated_players):
+        placements[player.id] = board.nb_players - order
+    return placements
+
+
+def play_game(
+    board: Board,
+    agent_factories: list | None,
+    max_moves: int = 500,
+    deal: np.ndarray | None = None,
+    endgame_solver=None,
+    on_move=None,
+):
+    """Play a headless game, return (placements, number of moves, completed).
+    With a deal from a deck.DealPool the board is reset in place and reuses
+    its agents unless agent_factories is given. With an endgame.EndgameSolver
+    the game stops as soon as it reaches a solvable endgame, the winner being
+    drawn with its perfect-play win probability. on_move, if given, is
+    called with the board after every move"""
+    if deal is None:
+        board.start(agent_factories)
+    else:
+        board.reset(deal, agent_factories)
+    board.metrics.start_game(board)
+    last_actions = []
+    n_moves = 0
+    while not board.game_has_ended and n_moves < max_moves:
+        if endgame_solver is not None and endgame_solver.can_solve(board):
+            endgame_solver.finish_game(board)
+            break
+        last_actions = board.agents_next_move(last_actions, 0)
+        n_moves += 1
+        if on_move is not None:
+            on_move(board)
+    placements = game_placements(board)
+    board.metrics.end_game(board, placements, n_moves, board.game_has_ended)
+    return placements, n_moves, board.game_has_ended
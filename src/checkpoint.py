@@ -0,0 +1,210 @@
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+import torch
+from pydantic import BaseModel
+from dqn import DQN, RecurrentDQN
+
+POLICY_FILE = "policy.pt"
+TARGET_FILE = "target.pt"
+OPTIMIZER_FILE = "optimizer.pt"
+REGISTRY_FILE = "registry.json"
+REGISTRY_LOCK_FILE = "registry.json.lock"
+# Network class of each architecture name stored in the registry
+ARCHITECTURES = {"dqn": DQN, "recurrent_dqn": RecurrentDQN}
+
+
+class CheckpointEntry(BaseModel):
+    id: str
+    step: int
+    nb_players: int
+    full_state_length: int
+    state_item_width: int
+    # Entries written before recurrent agents existed are all DQNs
+    architecture: str = "dqn"
+    rating: float | None = None
+    parent: str | None = None
+    created_at: float
+
+
+class ModelRegistry:
+    """Small on-disk index of the checkpoints saved under a models directory,
+    used to pick opponents. Writes replace the file atomically so readers in
+    other processes never see a partial registry, and updates hold an
+    exclusive lock from read to write so concurrent writers do not lose
+    each other's entries"""
+
+    def __init__(self, models_path: str = "models"):
+        self.models_path = models_path
+        self.registry_path = os.path.join(models_path, REGISTRY_FILE)
+        self.lock_path = os.path.join(models_path, REGISTRY_LOCK_FILE)
+
+    @contextmanager
+    def locked(self):
+        os.makedirs(self.models_path, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def entries(self) -> list[CheckpointEntry]:
+        if not os.path.exists(self.registry_path):
+            return []
+        with open(self.registry_path) as f:
+            return [CheckpointEntry(**entry) for entry in json.load(f)]
+
+    def write(self, entries: list[CheckpointEntry]):
+        os.makedirs(self.models_path, exist_ok=True)
+        temporary_path = f"{self.registry_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump([entry.model_dump() for entry in entries], f, indent=2)
+        os.replace(temporary_path, self.registry_path)
+
+    def get(self, checkpoint_id: str) -> CheckpointEntry:
+        for entry in self.entries():
+            if entry.id == checkpoint_id:
+                return entry
+        raise KeyError(f"Unknown checkpoint: {checkpoint_id}")
+
+    def add(self, entry: CheckpointEntry):
+        with self.locked():
+            entries = [e for e in self.entries() if e.id != entry.id]
+            self.write(entries + [entry])
+
+    def update_ratings(self, ratings: dict[str, float]):
+        with self.locked():
+            entries = self.entries()
+            for entry in entries:
+                if entry.id in ratings:
+                    entry.rating = ratings[entry.id]
+            self.write(entries)
+
+    def latest(self) -> CheckpointEntry | None:
+        entries = self.entries()
+        return max(entries, key=lambda entry: entry.step) if entries else None
+
+    def checkpoint_path(self, checkpoint_id: str) -> str:
+        return os.path.join(self.models_path, checkpoint_id)
+
+
+def save_checkpoint(
+    agent,
+    checkpoint_id: str,
+    step: int,
+    models_path: str = "models",
+    optimizer: torch.optim.Optimizer | None = None,
+    parent: str | None = None,
+    rating: float | None = None,
+) -> CheckpointEntry:
+    registry = ModelRegistry(models_path)
+    checkpoint_path = registry.checkpoint_path(checkpoint_id)
+    os.makedirs(checkpoint_path, exist_ok=True)
+    # torch.save zip archives keep each tensor storage contiguous and aligned,
+    # which lets torch.load map them instead of reading them
+    torch.save(
+        agent.policy_net.state_dict(), os.path.join(checkpoint_path, POLICY_FILE)
+    )
+    if agent.target_net is not None:
+        torch.save(
+            agent.target_net.state_dict(), os.path.join(checkpoint_path, TARGET_FILE)
+        )
+    if optimizer is not None:
+        torch.save(
+            optimizer.state_dict(), os.path.join(checkpoint_path, OPTIMIZER_FILE)
+        )
+    entry = CheckpointEntry(
+        id=checkpoint_id,
+        step=step,
+        nb_players=agent.nb_players,
+        full_state_length=agent.full_state_length,
+        state_item_width=agent.state_item_width,
+        architecture=network_architecture(agent.policy_net),
+        rating=rating,
+        parent=parent,
+        created_at=time.time(),
+    )
+    registry.add(entry)
+    return entry
+
+
+def load_state_dict(path: str) -> dict:
+    # Memory-mapped: the weights stay in the page cache shared by every
+    # process loading the same file instead of being copied in each one
+    return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+
+
+def network_architecture(net: DQN | RecurrentDQN) -> str:
+    for architecture, network_class in ARCHITECTURES.items():
+        if type(net) is network_class:
+            return architecture
+    raise ValueError(f"No checkpoint architecture for {type(net).__name__}")
+
+
+def load_dqn(
+    path: str,
+    full_state_length: int,
+    state_item_width: int,
+    nb_players: int,
+    architecture: str = "dqn",
+) -> DQN | RecurrentDQN:
+    if architecture not in ARCHITECTURES:
+        raise ValueError(f"Unknown checkpoint architecture {architecture}")
+    # A recurrent net only reads the board info and hand rows of the state
+    input_length = (
+        2 + 2 * nb_players if architecture == "recurrent_dqn" else full_state_length
+    )
+    # Built on the meta device so no memory is allocated or initialised for
+    # weights that are immediately replaced by the mapped ones
+    with torch.device("meta"):
+        net = ARCHITECTURES[architecture](input_length, state_item_width, nb_players)
+    net.load_state_dict(load_state_dict(path), assign=True)
+    return net.eval()
+
+
+def load_policy_net(
+    checkpoint_path: str,
+    full_state_length: int | None = None,
+    state_item_width: int | None = None,
+    nb_players: int | None = None,
+    architecture: str = "dqn",
+) -> DQN | RecurrentDQN:
+    """Load the policy net of a checkpoint directory, built with the class of
+    its registry entry, or of a bare state dict file in which case the
+    dimensions and architecture must be given"""
+    if os.path.isdir(checkpoint_path):
+        models_path, checkpoint_id = os.path.split(os.path.normpath(checkpoint_path))
+        entry = ModelRegistry(models_path).get(checkpoint_id)
+        full_state_length = entry.full_state_length
+        state_item_width = entry.state_item_width
+        nb_players = entry.nb_players
+        architecture = entry.architecture
+        checkpoint_path = os.path.join(checkpoint_path, POLICY_FILE)
+    return load_dqn(
+        checkpoint_path, full_state_length, state_item_width, nb_players, architecture
+    )
+
+
+def load_checkpoint_into_agent(
+    agent,
+    checkpoint_path: str,
+    optimizer: torch.optim.Optimizer | None = None,
+):
+    # For training: weights are copied into the agent's own networks
+    agent.policy_net.load_state_dict(
+        load_state_dict(os.path.join(checkpoint_path, POLICY_FILE))
+    )
+    target_path = os.path.join(checkpoint_path, TARGET_FILE)
+    if agent.target_net is not None:
+        if os.path.exists(target_path):
+            agent.target_net.load_state_dict(load_state_dict(target_path))
+        else:
+            agent.target_net.load_state_dict(agent.policy_net.state_dict())
+    optimizer_path = os.path.join(checkpoint_path, OPTIMIZER_FILE)
+    if optimizer is not None and os.path.exists(optimizer_path):
+        optimizer.load_state_dict(
+            torch.load(optimizer_path, map_location="cpu", weights_only=True)
+        )
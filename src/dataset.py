@@ -0,0 +1,374 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from pydantic import BaseModel
+from metrics import agent_kind
+from replay import RecurrentContext
+from rewards import RewardConfig, RewardLabeller, RewardTally
+
+INDEX_FILE = "index.json"
+
+
+class ShardEntry(BaseModel):
+    name: str
+    size: int  # rows written, the last shard is usually not full
+
+
+class DatasetIndex(BaseModel):
+    full_state_length: int
+    state_item_width: int
+    n_actions: int
+    shard_size: int
+    with_next_states: bool
+    agent_kinds: list[str] = []
+    shards: list[ShardEntry] = []
+
+    @property
+    def size(self) -> int:
+        return sum(shard.size for shard in self.shards)
+
+
+def read_index(path: str) -> DatasetIndex:
+    with open(os.path.join(path, INDEX_FILE)) as f:
+        return DatasetIndex(**json.load(f))
+
+
+def write_index(path: str, index: DatasetIndex):
+    # Replaced atomically, a loader never sees a partial index
+    temporary_path = os.path.join(path, f"{INDEX_FILE}.{os.getpid()}.tmp")
+    with open(temporary_path, "w") as f:
+        json.dump(index.model_dump(), f, indent=2)
+    os.replace(temporary_path, os.path.join(path, INDEX_FILE))
+
+
+def shard_fields(index: DatasetIndex) -> dict[str, tuple]:
+    """dtype and row shape of each array of a shard. States are binary and
+    masks boolean, both are bit-packed along their last axis"""
+    packed_state = (index.full_state_length, index.state_item_width // 8)
+    packed_mask = (-(-index.n_actions // 8),)
+    fields = {
+        "states": (np.uint8, packed_state),
+        "action_masks": (np.uint8, packed_mask),
+        "actions": (np.int16, ()),
+        "rewards": (np.float32, ()),
+        "dones": (np.bool_, ()),
+        "discounts": (np.float32, ()),
+        "seats": (np.int8, ()),
+        "agents": (np.int8, ()),
+    }
+    if index.with_next_states:
+        fields["next_states"] = (np.uint8, packed_state)
+        fields["next_action_masks"] = (np.uint8, packed_mask)
+    return fields
+
+
+class ShardWriter:
+    """Writes decision transitions into fixed-size, memory-mapped .npy
+    shards listed in an index file. It has the ReplayBuffer.add signature;
+    seat() gives the per-agent stand-in to set as an agent's replay_buffer.
+    Writing into an existing dataset appends new shards"""
+
+    def __init__(
+        self,
+        path: str,
+        full_state_length: int,
+        state_item_width: int,
+        n_actions: int,
+        shard_size: int = 1 << 16,
+        with_next_states: bool = True,
+        gamma: float = 0.99,
+    ):
+        self.path = path
+        self.gamma = gamma
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, INDEX_FILE)):
+            self.index = read_index(path)
+        else:
+            self.index = DatasetIndex(
+                full_state_length=full_state_length,
+                state_item_width=state_item_width,
+                n_actions=n_actions,
+                shard_size=shard_size,
+                with_next_states=with_next_states,
+            )
+        self.fields = shard_fields(self.index)
+        self.arrays = None
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __len__(self) -> int:
+        return self.index.size + (self.position if self.arrays is not None else 0)
+
+    def open_shard(self):
+        name = f"shard_{len(self.index.shards):05d}"
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        self.arrays = {
+            field: np.lib.format.open_memmap(
+                os.path.join(self.path, name, f"{field}.npy"),
+                mode="w+",
+                dtype=dtype,
+                shape=(self.index.shard_size, *shape),
+            )
+            for field, (dtype, shape) in self.fields.items()
+        }
+        self.shard_name = name
+        self.position = 0
+
+    def close_shard(self):
+        for array in self.arrays.values():
+            array.flush()
+        self.index.shards.append(ShardEntry(name=self.shard_name, size=self.position))
+        write_index(self.path, self.index)
+        self.arrays = None
+
+    def close(self):
+        if self.arrays is not None:
+            self.close_shard()
+        elif not os.path.exists(os.path.join(self.path, INDEX_FILE)):
+            write_index(self.path, self.index)
+
+    def kind_id(self, kind: str) -> int:
+        if kind not in self.index.agent_kinds:
+            self.index.agent_kinds.append(kind)
+        return self.index.agent_kinds.index(kind)
+
+    def seat(self, seat_id: int, kind: str) -> "SeatWriter":
+        return SeatWriter(self, seat_id, self.kind_id(kind))
+
+    def add(
+        self,
+        state: np.ndarray,
+        action_mask: np.ndarray,
+        action: int,
+        reward: float,
+        next_state: np.ndarray,
+        next_action_mask: np.ndarray,
+        done: bool,
+        context: RecurrentContext | None = None,
+        next_context: RecurrentContext | None = None,
+        discount: float | None = None,
+        seat: int = -1,
+        agent: int = -1,
+    ):
+        if self.arrays is None:
+            self.open_shard()
+        arrays, i = self.arrays, self.position
+        arrays["states"][i] = np.packbits(np.asarray(state, dtype=np.uint8), axis=-1)
+        arrays["action_masks"][i] = np.packbits(np.asarray(action_mask, dtype=bool))
+        arrays["actions"][i] = action
+        arrays["rewards"][i] = reward
+        arrays["dones"][i] = done
+        arrays["discounts"][i] = self.gamma if discount is None else discount
+        arrays["seats"][i] = seat
+        arrays["agents"][i] = agent
+        if self.index.with_next_states:
+            arrays["next_states"][i] = np.packbits(
+                np.asarray(next_state, dtype=np.uint8), axis=-1
+            )
+            arrays["next_action_masks"][i] = np.packbits(
+                np.asarray(next_action_mask, dtype=bool)
+            )
+        self.position += 1
+        if self.position == self.index.shard_size:
+            self.close_shard()
+
+
+class SeatWriter:
+    # replay_buffer of one agent, tags its transitions with its seat and kind
+    def __init__(self, writer: ShardWriter, seat: int, agent: int):
+        self.writer = writer
+        self.seat = seat
+        self.agent = agent
+
+    def add(self, *args, **kwargs):
+        self.writer.add(*args, **kwargs, seat=self.seat, agent=self.agent)
+
+
+class ShardDataset:
+    """Random access to one or more exported datasets without loading them:
+    every shard array is memory-mapped and a minibatch only reads its rows"""
+
+    def __init__(self, paths: str | list[str]):
+        paths = [paths] if isinstance(paths, str) else paths
+        self.indexes = [read_index(path) for path in paths]
+        first = self.indexes[0]
+        self.full_state_length = first.full_state_length
+        self.state_item_width = first.state_item_width
+        self.n_actions = first.n_actions
+        self.with_next_states = all(index.with_next_states for index in self.indexes)
+        self.shard_paths = []
+        sizes = []
+        for path, index in zip(paths, self.indexes):
+            for shard in index.shards:
+                if shard.size:
+                    self.shard_paths.append(os.path.join(path, shard.name))
+                    sizes.append(shard.size)
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self.fields = shard_fields(first)
+        if not self.with_next_states:
+            self.fields.pop("next_states", None)
+            self.fields.pop("next_action_masks", None)
+        self.shards: dict[int, dict[str, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def shard(self, shard_id: int) -> dict[str, np.ndarray]:
+        arrays = self.shards.get(shard_id)
+        if arrays is None:
+            arrays = {
+                field: np.load(
+                    os.path.join(self.shard_paths[shard_id], f"{field}.npy"),
+                    mmap_mode="r",
+                )
+                for field in self.fields
+            }
+            self.shards[shard_id] = arrays
+        return arrays
+
+    def get_batch(
+        self, indices: np.ndarray, unpack_states: bool = True
+    ) -> dict[str, np.ndarray]:
+        indices = np.asarray(indices)
+        # Rows are gathered shard by shard in increasing order, then put back
+        # in the requested order
+        order = np.argsort(indices, kind="stable")
+        sorted_indices = indices[order]
+        shard_ids = np.searchsorted(self.offsets, sorted_indices, side="right") - 1
+        bounds = np.flatnonzero(np.diff(shard_ids)) + 1
+        parts = {field: [] for field in self.fields}
+        for start, end in zip(
+            np.concatenate([[0], bounds]), np.concatenate([bounds, [len(indices)]])
+        ):
+            shard_id = shard_ids[start]
+            rows = sorted_indices[start:end] - self.offsets[shard_id]
+            for field, array in self.shard(shard_id).items():
+                parts[field].append(array[rows])
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        batch = {field: np.concatenate(parts[field])[inverse] for field in parts}
+        for field in ("action_masks", "next_action_masks"):
+            if field in batch:
+                batch[field] = np.unpackbits(
+                    batch[field], axis=-1, count=self.n_actions
+                ).astype(bool)
+        if unpack_states:
+            for field in ("states", "next_states"):
+                if field in batch:
+                    batch[field] = np.unpackbits(batch[field], axis=-1).astype(
+                        np.float32
+                    )
+        batch["actions"] = batch["actions"].astype(np.int64)
+        return batch
+
+    def sample(self, batch_size: int, rng: np.random.Generator) -> dict:
+        return self.get_batch(rng.integers(0, len(self), size=batch_size))
+
+
+def recording_factories(
+    agent_factories: list, writer: ShardWriter, labeller=None
+) -> list:
+    """Agent factories whose agents record every decision into writer, held
+    back until labelled at the end of the game with a RewardLabeller"""
+
+    def recording(agent_factory):
+        def factory(player, full_state_length, state_item_width, nb_players):
+            agent = agent_factory(
+                player, full_state_length, state_item_width, nb_players
+            )
+            agent.replay_buffer = writer.seat(player.id, agent_kind(agent))
+            if labeller is not None:
+                agent.replay_buffer = labeller.seat(player.id, agent.replay_buffer)
+            return agent
+
+        return factory
+
+    return [recording(agent_factory) for agent_factory in agent_factories]
+
+
+def export_games(
+    board,
+    agent_factories: list,
+    writer: ShardWriter,
+    nb_games: int,
+    max_moves: int = 500,
+    rewards: RewardConfig | None = None,
+) -> int:
+    """Play nb_games live games and export every decision with its reward
+    (terminal rewards only by default), returns the number of moves played"""
+    from board import play_game
+
+    # The board's metrics keep running behind the reward tally
+    tally = RewardTally(board.metrics)
+    labeller = RewardLabeller(tally, rewards if rewards is not None else RewardConfig())
+    factories = recording_factories(agent_factories, writer, labeller)
+    n_moves = 0
+    board.metrics = tally
+    try:
+        for _ in range(nb_games):
+            placements, game_moves, completed = play_game(board, factories, max_moves)
+            n_moves += game_moves
+            labeller.finish(board.agents, placements, completed)
+    finally:
+        board.metrics = tally.metrics
+    return n_moves
+
+
+if __name__ == "__main__":
+    import random
+    from functools import partial
+    from action import get_nb_actions
+    from base_agent import RandomAgent
+    from board import Board
+    from rewards import load_reward_config
+
+    parser = argparse.ArgumentParser(description="Export decisions to dataset shards")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--out", default="data/random")
+    parser.add_argument("--shard-size", type=int, default=1 << 16)
+    parser.add_argument("--no-next-states", action="store_true")
+    parser.add_argument(
+        "--rewards", default="terminal", help="reward preset or JSON file"
+    )
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    board = Board(args.players, seed=args.seed)
+    rng = random.Random(args.seed)
+    start_time = time.perf_counter()
+    with ShardWriter(
+        args.out,
+        board.full_state_length,
+        board.state_item_width,
+        get_nb_actions(args.players),
+        args.shard_size,
+        with_next_states=not args.no_next_states,
+    ) as writer:
+        export_games(
+            board,
+            [partial(RandomAgent, rng=rng)] * args.players,
+            writer,
+            args.games,
+            rewards=load_reward_config(args.rewards),
+        )
+    elapsed = time.perf_counter() - start_time
+    dataset = ShardDataset(args.out)
+    print(
+        f"{len(dataset)} decisions in {len(dataset.shard_paths)} shards, {elapsed:.1f}s"
+    )
+    sample_rng = np.random.default_rng(args.seed)
+    start_time = time.perf_counter()
+    for _ in range(20):
+        dataset.sample(args.batch_size, sample_rng)
+    elapsed = time.perf_counter() - start_time
+    print(f"{20 * args.batch_size / elapsed:.0f} sampled decisions/s")
@@ -1,13 +1,23 @@
 import random
+import numpy as np
 from card import Card
 from character import Character
 
 
+# Card i of a full deck is CHARACTERS[i % len(CHARACTERS)], the order in
+# which Deck builds it
+CHARACTERS = list(Character)
+
+
 class Deck:
     deck: list[Card]
     nb_instances_of_each_character: int
+    rng: random.Random
 
-    def __init__(self, nb_instances_of_each_character: int = 3):
+    def __init__(
+        self, nb_instances_of_each_character: int = 3, rng: random.Random | None = None
+    ):
+        self.rng = rng if rng is not None else random.Random()
         self.deck = []
         for _ in range(nb_instances_of_each_character):
             self.deck.extend(
@@ -22,7 +32,7 @@ class Deck:
         self.nb_instances_of_each_character = nb_instances_of_each_character
 
     def shuffle(self):
-        random.shuffle(self.deck)
+        self.rng.shuffle(self.deck)
 
     def draw(self, n: int = 1):
         if n == 1:
@@ -33,3 +43,40 @@ class Deck:
     def add_card(self, card: Card):
         self.deck.append(card)
         self.shuffle()
+
+
+class DealPool:
+    """Pre-generated deals for many games. Each row holds the deck order
+    (card ids, drawn from the end like Deck.draw) followed by the index of
+    the first player, so starting a game is a row lookup instead of building
+    and shuffling cards"""
+
+    def __init__(
+        self,
+        nb_players: int,
+        size: int,
+        seed: int | None = None,
+        nb_instances_of_each_character: int = 3,
+    ):
+        rng = np.random.default_rng(seed)
+        deck_size = nb_instances_of_each_character * len(CHARACTERS)
+        self.nb_players = nb_players
+        self.deck_size = deck_size
+        self.deals = np.empty((size, deck_size + 1), dtype=np.int8)
+        self.deals[:, :deck_size] = rng.permuted(
+            np.broadcast_to(np.arange(deck_size), (size, deck_size)), axis=1
+        )
+        self.deals[:, deck_size] = rng.integers(0, nb_players, size)
+        self.position = 0
+
+    def __len__(self) -> int:
+        return len(self.deals)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.deals[index]
+
+    def next_deal(self) -> np.ndarray:
+        # Cycles through the pool
+        deal = self.deals[self.position]
+        self.position = (self.position + 1) % len(self.deals)
+        return deal
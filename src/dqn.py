@@ -2,6 +2,29 @@ import torch
 import random
 import torch.nn as nn
 import torch.nn.functional as F
+from action import TARGETED_ACTION_TYPES, ActionType
+
+
+class FactoredQHead(nn.Module):
+    def __init__(self, hidden_dim, nb_players):
+        super().__init__()
+        # One Q-value per action type plus one per target player
+        self.action_type_head = nn.Linear(hidden_dim, len(ActionType))
+        self.target_head = nn.Linear(hidden_dim, nb_players)
+        is_targeted = torch.zeros(len(ActionType))
+        is_targeted[[action_type.value for action_type in TARGETED_ACTION_TYPES]] = 1
+        self.register_buffer("is_targeted", is_targeted)
+
+    def forward(self, x):
+        action_type_q_values = self.action_type_head(x)
+        target_q_values = self.target_head(x)
+        # Q(action type, target) = Q(action type) + Q(target), the target
+        # term only applies to targeted action types
+        q_values = (
+            action_type_q_values[..., :, None]
+            + self.is_targeted[:, None] * target_q_values[..., None, :]
+        )
+        return q_values.flatten(start_dim=-2)  # [n_action_types * nb_players]
 
 
 class DQN(nn.Module):
@@ -9,24 +32,82 @@ class DQN(nn.Module):
         self,
         full_state_length,
         state_item_width,
-        n_actions,
+        nb_players,
         hidden_dim=256,
     ):
         super().__init__()
-        input_dim = full_state_length * state_item_width  # flatten (392,64) → ~25k
+        input_dim = full_state_length * state_item_width  # flatten (394,128) → ~50k
+        self.nb_players = nb_players
         self.fc1 = nn.Linear(input_dim, hidden_dim)
         self.fc2 = nn.Linear(hidden_dim, hidden_dim)
-        self.fc3 = nn.Linear(hidden_dim, n_actions)
+        self.head = FactoredQHead(hidden_dim, nb_players)
 
     def forward(self, x):
-        # x: [batch, length, width]
-        x = x.flatten()  # flatten per batch
+        # x: [(batch,) length, width]
+        x = x.flatten(start_dim=-2)  # flatten per batch
         x = F.relu(self.fc1(x))
         x = F.relu(self.fc2(x))
-        return self.fc3(x)  # [batch, n_actions]
+        return self.head(x)  # [(batch,) n_action_types * nb_players]
 
     def select_action(self, state, action_mask, device):
         state = torch.tensor(state, dtype=torch.float).to(device)
-        action_mask = action_mask.to(device)
         action = self.forward(state)
         return action
+
+
+class RecurrentDQN(nn.Module):
+    """Q-network reading only the static part of the state (board info and
+    hands) and summarising the histories in a GRU hidden state that is
+    advanced once per new history event"""
+
+    def __init__(
+        self,
+        static_state_length,
+        state_item_width,
+        nb_players,
+        hidden_dim=256,
+    ):
+        super().__init__()
+        self.static_state_length = static_state_length
+        self.hidden_dim = hidden_dim
+        self.nb_players = nb_players
+        self.fc1 = nn.Linear(static_state_length * state_item_width, hidden_dim)
+        self.history_encoder = nn.GRU(state_item_width, hidden_dim, batch_first=True)
+        self.fc2 = nn.Linear(2 * hidden_dim, hidden_dim)
+        self.head = FactoredQHead(hidden_dim, nb_players)
+
+    def initial_hidden_state(self, batch_size=None):
+        if batch_size is None:
+            return torch.zeros(self.hidden_dim)
+        return torch.zeros(batch_size, self.hidden_dim)
+
+    def encode_history(self, rows, hidden_state):
+        # rows: [n_events, width] or [batch, n_events, width]
+        # hidden_state: [hidden_dim] or [batch, hidden_dim]
+        is_batched = rows.dim() == 3
+        if not is_batched:
+            rows, hidden_state = rows[None], hidden_state[None]
+        _, hidden_state = self.history_encoder(rows, hidden_state[None].contiguous())
+        hidden_state = hidden_state[0]
+        return hidden_state if is_batched else hidden_state[0]
+
+    def encode_history_steps(self, rows, hidden_state):
+        # Hidden state after each of rows [n_events, width]: [n_events, hidden_dim]
+        outputs, _ = self.history_encoder(
+            rows[None], hidden_state[None, None].contiguous()
+        )
+        return outputs[0]
+
+    def encode_history_window(self, rows, lengths, hidden_state):
+        # rows: [batch, window, width] holding lengths events each, padding
+        # after them. The GRU is causal, so the hidden state after the last
+        # event of a row does not depend on the padding that follows it
+        outputs, _ = self.history_encoder(rows, hidden_state[None].contiguous())
+        last_outputs = outputs[torch.arange(len(rows)), (lengths - 1).clamp(min=0)]
+        return torch.where((lengths > 0)[:, None], last_outputs, hidden_state)
+
+    def forward(self, static_state, hidden_state):
+        # static_state: [(batch,) static_state_length, width]
+        x = F.relu(self.fc1(static_state.flatten(start_dim=-2)))
+        x = F.relu(self.fc2(torch.cat([x, hidden_state], dim=-1)))
+        return self.head(x)  # [(batch,) n_action_types * nb_players]
@@ -0,0 +1,519 @@
+import argparse
+import itertools
+import math
+import time
+from enum import IntEnum
+from typing import NamedTuple
+import numpy as np
+from action import (
+    TARGETED_ACTION_TYPES,
+    ActionType,
+    get_action_id,
+    get_nb_actions,
+)
+from character import Character
+from deck import CHARACTERS
+
+DUKE = CHARACTERS.index(Character.DUKE)
+ASSASSIN = CHARACTERS.index(Character.ASSASSIN)
+AMBASSADOR = CHARACTERS.index(Character.AMBASSADOR)
+CAPTAIN = CHARACTERS.index(Character.CAPTAIN)
+CONTESSA = CHARACTERS.index(Character.CONTESSA)
+
+# Character that must be shown to win a challenge on each claim
+CLAIMED_CHARACTERS = {
+    ActionType.CAPTAIN: CAPTAIN,
+    ActionType.ASSASSIN: ASSASSIN,
+    ActionType.COUNTER_FOREIGN_AID_WITH_DUKE: DUKE,
+    ActionType.COUNTER_CAPTAIN_WITH_CAPTAIN: CAPTAIN,
+    ActionType.COUNTER_CAPTAIN_WITH_AMBASSADOR: AMBASSADOR,
+    ActionType.COUNTER_ASSASSIN_WITH_CONTESSA: CONTESSA,
+}
+COUNTERS = {
+    ActionType.FOREIGN_AID: (ActionType.COUNTER_FOREIGN_AID_WITH_DUKE,),
+    ActionType.CAPTAIN: (
+        ActionType.COUNTER_CAPTAIN_WITH_CAPTAIN,
+        ActionType.COUNTER_CAPTAIN_WITH_AMBASSADOR,
+    ),
+    ActionType.ASSASSIN: (ActionType.COUNTER_ASSASSIN_WITH_CONTESSA,),
+}
+
+# Pending steps of an action being resolved, as (kind, player, argument)
+LOSE = 0  # player reveals one of its unrevealed cards, its choice
+SWAP = 1  # player returns the shown character to the deck and draws a card
+STEAL = 2  # player takes 2 coins from the other one
+PAY = 3  # player gains argument coins (negative to pay)
+
+MAX_NODE, MIN_NODE, CHANCE_NODE = 0, 1, 2
+
+
+class Phase(IntEnum):
+    ACT = 0  # actor picks an action
+    CHALLENGE = 1  # other player may challenge the actor's claim
+    COUNTER = 2  # other player may counter the action
+    CHALLENGE_COUNTER = 3  # actor may challenge the counter
+    RESOLVE = 4  # pending steps are applied
+
+
+class EndgameState(NamedTuple):
+    # Plain tuple of small ints so it hashes fast as a transposition table
+    # key. Hands are sorted tuples of unrevealed character indices (the
+    # order of cards does not change the game), deck is a count per
+    # character
+    coins: tuple[int, int]
+    hands: tuple[tuple[int, ...], tuple[int, ...]]
+    deck: tuple[int, ...]
+    actor: int
+    phase: Phase
+    action_type: ActionType = ActionType.DO_NOTHING
+    counter_type: ActionType = ActionType.DO_NOTHING
+    steps: tuple[tuple[int, int, int], ...] = ()
+
+
+def remove_card(hand: tuple[int, ...], character: int) -> tuple[int, ...]:
+    index = hand.index(character)
+    return hand[:index] + hand[index + 1 :]
+
+
+class EndgameSolver:
+    """Exact solver for two-player positions under the Board rules.
+
+    Positions are expanded into decision nodes (actions, challenges,
+    counters, which card to reveal) and chance nodes (the card drawn after
+    winning a challenge). Games can loop forever (captains stealing back
+    and forth, countered foreign aid), and play_game scores unfinished
+    games as a draw, so a position is worth the limit of its finite-horizon
+    values with 0.5 at the horizon. This is computed by value iteration over
+    the newly reachable positions, vectorized over all nodes.
+
+    Values are win probabilities of player slot 0. Solved positions are kept
+    in a transposition table and are leaves of later searches.
+
+    Opponent cards are hidden, so evaluate and action_values average the
+    perfect-information values over every deal of the unseen cards that is
+    consistent with the viewer's hand and the revealed cards."""
+
+    def __init__(self, max_states: int = 2_000_000, tolerance: float = 1e-9):
+        self.max_states = max_states
+        self.tolerance = tolerance
+        self.table: dict[EndgameState, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    # Rules
+
+    def advance(self, state: EndgameState) -> EndgameState | float:
+        """Apply deterministic steps until a decision, a draw or the end of
+        the game, whose value is returned instead of a state"""
+        coins, hands, deck, actor, _, _, _, steps = state
+        while True:
+            if not hands[0]:
+                return 0.0
+            if not hands[1]:
+                return 1.0
+            if not steps:
+                return EndgameState(coins, hands, deck, 1 - actor, Phase.ACT)
+            kind, player, argument = steps[0]
+            if kind == LOSE and len(set(hands[player])) > 1:
+                break
+            if kind == SWAP:
+                break
+            steps = steps[1:]
+            if kind == LOSE:
+                hands = self.replace(hands, player, hands[player][1:])
+            elif kind == STEAL:
+                coins = self.replace(coins, player, coins[player] + 2)
+                coins = self.replace(coins, 1 - player, coins[1 - player] - 2)
+            elif kind == PAY:
+                coins = self.replace(coins, player, coins[player] + argument)
+        return EndgameState(coins, hands, deck, actor, Phase.RESOLVE, steps=steps)
+
+    @staticmethod
+    def replace(pair: tuple, player: int, value) -> tuple:
+        return (value, pair[1]) if player == 0 else (pair[0], value)
+
+    def effect_steps(self, state: EndgameState) -> tuple:
+        # Steps of the actor's action once it goes through
+        actor = state.actor
+        if state.action_type == ActionType.FOREIGN_AID:
+            return ((PAY, actor, 2),)
+        if state.action_type == ActionType.CAPTAIN:
+            return ((STEAL, actor, 0),)
+        return ((LOSE, 1 - actor, 0), (PAY, actor, -3))
+
+    def resolve(self, state: EndgameState, steps: tuple) -> EndgameState | float:
+        return self.advance(state._replace(phase=Phase.RESOLVE, steps=steps))
+
+    def expand(self, state: EndgameState) -> tuple[int, list, list]:
+        """Node kind, children (states or terminal values) and probabilities"""
+        coins, hands, deck, actor, phase, action_type, counter_type, steps = state
+        other = 1 - actor
+        if phase == Phase.ACT:
+            options = []
+            if coins[actor] >= 10:
+                options.append((ActionType.COUP, ((PAY, actor, -7), (LOSE, other, 0))))
+            else:
+                options.append((ActionType.REVENUE, ((PAY, actor, 1),)))
+                options.append((ActionType.FOREIGN_AID, None))
+                if coins[actor] >= 7:
+                    options.append(
+                        (ActionType.COUP, ((PAY, actor, -7), (LOSE, other, 0)))
+                    )
+                    options.append((ActionType.ASSASSIN, None))
+                if coins[other] >= 2:
+                    options.append((ActionType.CAPTAIN, None))
+            children = []
+            for option_type, option_steps in options:
+                if option_steps is not None:
+                    children.append(self.resolve(state, option_steps))
+                elif option_type == ActionType.FOREIGN_AID:
+                    children.append(
+                        state._replace(phase=Phase.COUNTER, action_type=option_type)
+                    )
+                else:
+                    children.append(
+                        state._replace(phase=Phase.CHALLENGE, action_type=option_type)
+                    )
+            return self.decision_kind(actor), children, None
+        if phase == Phase.CHALLENGE:
+            claimed = CLAIMED_CHARACTERS[action_type]
+            if claimed in hands[actor]:
+                challenge_steps = (
+                    (LOSE, other, 0),
+                    (SWAP, actor, claimed),
+                ) + self.effect_steps(state)
+            else:
+                challenge_steps = ((LOSE, actor, 0),)
+                if action_type == ActionType.ASSASSIN:
+                    challenge_steps += ((PAY, actor, -3),)
+            children = [
+                state._replace(phase=Phase.COUNTER),
+                self.resolve(state, challenge_steps),
+            ]
+            return self.decision_kind(other), children, None
+        if phase == Phase.COUNTER:
+            children = [self.resolve(state, self.effect_steps(state))] + [
+                state._replace(phase=Phase.CHALLENGE_COUNTER, counter_type=counter)
+                for counter in COUNTERS[action_type]
+            ]
+            return self.decision_kind(other), children, None
+        if phase == Phase.CHALLENGE_COUNTER:
+            claimed = CLAIMED_CHARACTERS[counter_type]
+            if claimed in hands[other]:
+                challenge_steps = ((LOSE, actor, 0), (SWAP, other, claimed))
+            elif action_type == ActionType.ASSASSIN:
+                # The Board does not carry out a countered assassination
+                # even when the counter was a bluff
+                challenge_steps = ((LOSE, other, 0),)
+            else:
+                challenge_steps = ((LOSE, other, 0),) + self.effect_steps(state)
+            children = [self.resolve(state, ()), self.resolve(state, challenge_steps)]
+            return self.decision_kind(actor), children, None
+        kind, player, character = steps[0]
+        if kind == LOSE:
+            children = [
+                self.advance(
+                    state._replace(
+                        hands=self.replace(
+                            hands, player, remove_card(hands[player], lost)
+                        ),
+                        steps=steps[1:],
+                    )
+                )
+                for lost in sorted(set(hands[player]))
+            ]
+            return self.decision_kind(player), children, None
+        # SWAP: the shown card is shuffled back in and a card is drawn
+        deck = list(deck)
+        deck[character] += 1
+        total = sum(deck)
+        hand = remove_card(hands[player], character)
+        children, probabilities = [], []
+        for drawn, count in enumerate(deck):
+            if count:
+                new_deck = deck.copy()
+                new_deck[drawn] -= 1
+                children.append(
+                    self.advance(
+                        state._replace(
+                            hands=self.replace(
+                                hands, player, tuple(sorted(hand + (drawn,)))
+                            ),
+                            deck=tuple(new_deck),
+                            steps=steps[1:],
+                        )
+                    )
+                )
+                probabilities.append(count / total)
+        return CHANCE_NODE, children, probabilities
+
+    @staticmethod
+    def decision_kind(player: int) -> int:
+        return MAX_NODE if player == 0 else MIN_NODE
+
+    # Solving
+
+    def solve(self, state: EndgameState) -> float:
+        """Value of a position for player slot 0"""
+        if state in self.table:
+            return self.table[state]
+        # Enumerate the positions reachable without going through solved
+        # ones, solved positions and game ends become constant leaves
+        index = {state: 0}
+        states = [state]
+        kinds = []
+        offsets = []
+        edge_children = []
+        edge_probabilities = []
+        constants = {}
+        position = 0
+        while position < len(states):
+            kind, children, probabilities = self.expand(states[position])
+            position += 1
+            kinds.append(kind)
+            offsets.append(len(edge_children))
+            for i, child in enumerate(children):
+                if isinstance(child, float):
+                    key = child
+                elif child in self.table:
+                    key = self.table[child]
+                else:
+                    if child not in index:
+                        index[child] = len(states)
+                        states.append(child)
+                        if len(states) > self.max_states:
+                            raise ValueError(
+                                f"Endgame has more than {self.max_states} positions"
+                            )
+                    edge_children.append(index[child])
+                    edge_probabilities.append(
+                        1.0 if probabilities is None else probabilities[i]
+                    )
+                    continue
+                # Constants are stored after the node values, negated to
+                # tell them apart until the node count is known
+                constant_index = constants.setdefault(key, len(constants))
+                edge_children.append(-1 - constant_index)
+                edge_probabilities.append(
+                    1.0 if probabilities is None else probabilities[i]
+                )
+        nb_nodes = len(states)
+        edge_children = np.array(edge_children)
+        edge_children = np.where(
+            edge_children < 0, nb_nodes - 1 - edge_children, edge_children
+        )
+        edge_probabilities = np.array(edge_probabilities)
+        offsets = np.array(offsets)
+        kinds = np.array(kinds)
+        values = np.full(nb_nodes + len(constants), 0.5)
+        values[nb_nodes:] = list(constants)
+        while True:
+            edge_values = values[edge_children]
+            new_values = np.select(
+                [kinds == MAX_NODE, kinds == MIN_NODE],
+                [
+                    np.maximum.reduceat(edge_values, offsets),
+                    np.minimum.reduceat(edge_values, offsets),
+                ],
+                np.add.reduceat(edge_values * edge_probabilities, offsets),
+            )
+            change = np.abs(new_values - values[:nb_nodes]).max()
+            values[:nb_nodes] = new_values
+            if change < self.tolerance:
+                break
+        self.table.update(zip(states, values[:nb_nodes].tolist()))
+        return self.table[state]
+
+    def value(self, state: EndgameState | float) -> float:
+        return state if isinstance(state, float) else self.solve(state)
+
+    # Board interface
+
+    @staticmethod
+    def alive_players(board) -> list:
+        # board.alive_players is only refreshed at the start of a move
+        return [
+            player
+            for player in board.players
+            if any(not card.is_revealed for card in player.hand)
+        ]
+
+    def can_solve(self, board, max_cards: int = 2, max_coins: int = 12) -> bool:
+        alive_players = self.alive_players(board)
+        return (
+            len(alive_players) == 2
+            and sum(len(self.hidden_characters(player)) for player in alive_players)
+            <= max_cards
+            and all(player.coins <= max_coins for player in alive_players)
+        )
+
+    @staticmethod
+    def hidden_characters(player) -> tuple[int, ...]:
+        return tuple(
+            sorted(
+                CHARACTERS.index(card.character)
+                for card in player.hand
+                if not card.is_revealed
+            )
+        )
+
+    def board_state(self, board) -> EndgameState:
+        """Perfect-information position at the start of the next move, slot 0
+        being the player about to act"""
+        players = self.slot_players(board)
+        deck = [0] * len(CHARACTERS)
+        for card in board.deck.deck:
+            deck[CHARACTERS.index(card.character)] += 1
+        return EndgameState(
+            coins=tuple(player.coins for player in players),
+            hands=tuple(self.hidden_characters(player) for player in players),
+            deck=tuple(deck),
+            actor=0,
+            phase=Phase.ACT,
+        )
+
+    def slot_players(self, board) -> list:
+        # Between moves current_player is the last one to have acted (or the
+        # drawn first player), agents_next_move hands the turn to the next
+        # alive seat
+        alive_ids = {player.id for player in self.alive_players(board)}
+        position = board.players.index(board.current_player)
+        seats = board.players[position + 1 :] + board.players[: position + 1]
+        actor = next(player for player in seats if player.id in alive_ids)
+        return [actor] + [
+            player for player in seats if player.id in alive_ids and player is not actor
+        ]
+
+    def consistent_states(
+        self, board, viewer_id: int
+    ) -> list[tuple[EndgameState, float]]:
+        """Positions the viewer cannot tell apart, with their probabilities:
+        the opponent's unrevealed cards are drawn from the cards the viewer
+        has not seen, the rest of them being in the deck"""
+        state = self.board_state(board)
+        players = self.slot_players(board)
+        viewer_slot = 0 if players[0].id == viewer_id else 1
+        opponent_slot = 1 - viewer_slot
+        unseen = [board.deck.nb_instances_of_each_character] * len(CHARACTERS)
+        for player in board.players:
+            for card in player.hand:
+                if card.is_revealed:
+                    unseen[CHARACTERS.index(card.character)] -= 1
+        for character in state.hands[viewer_slot]:
+            unseen[character] -= 1
+        nb_opponent_cards = len(state.hands[opponent_slot])
+        weighted_states = []
+        for hand in itertools.combinations_with_replacement(
+            range(len(CHARACTERS)), nb_opponent_cards
+        ):
+            weight = math.prod(
+                math.comb(unseen[character], hand.count(character))
+                for character in set(hand)
+            )
+            if weight:
+                deck = tuple(
+                    count - hand.count(character)
+                    for character, count in enumerate(unseen)
+                )
+                weighted_states.append(
+                    (
+                        state._replace(
+                            hands=self.replace(state.hands, opponent_slot, hand),
+                            deck=deck,
+                        ),
+                        weight,
+                    )
+                )
+        total = sum(weight for _, weight in weighted_states)
+        return [(state, weight / total) for state, weight in weighted_states]
+
+    def evaluate(self, board, viewer_id: int) -> float:
+        """Win probability of the viewer under perfect play, in expectation
+        over the deals consistent with what it has seen"""
+        value = sum(
+            probability * self.solve(state)
+            for state, probability in self.consistent_states(board, viewer_id)
+        )
+        return value if self.slot_players(board)[0].id == viewer_id else 1 - value
+
+    def action_values(self, board) -> np.ndarray:
+        """Perfect-play win probability of each legal action of the player
+        about to act (NaN for the others), indexed by action id, as training
+        targets"""
+        values = np.full(get_nb_actions(board.nb_players), np.nan)
+        actor, target = self.slot_players(board)
+        for state, probability in self.consistent_states(board, actor.id):
+            _, children, _ = self.expand(state)
+            for action_type, child in zip(self.action_types(state), children):
+                target_id = target.id if action_type in TARGETED_ACTION_TYPES else -1
+                action_id = get_action_id(action_type, target_id, board.nb_players)
+                if np.isnan(values[action_id]):
+                    values[action_id] = 0.0
+                values[action_id] += probability * self.value(child)
+        return values
+
+    @staticmethod
+    def action_types(state: EndgameState) -> list[ActionType]:
+        # Same order as the ACT children of expand
+        coins, other = state.coins, 1 - state.actor
+        if coins[state.actor] >= 10:
+            return [ActionType.COUP]
+        action_types = [ActionType.REVENUE, ActionType.FOREIGN_AID]
+        if coins[state.actor] >= 7:
+            action_types += [ActionType.COUP, ActionType.ASSASSIN]
+        if coins[other] >= 2:
+            action_types.append(ActionType.CAPTAIN)
+        return action_types
+
+    def finish_game(self, board) -> float:
+        """Short-circuit a solvable game: the winner is drawn with its
+        perfect-play probability and the loser is eliminated. Returns the
+        win probability of the player who was about to act"""
+        value = self.solve(self.board_state(board))
+        players = self.slot_players(board)
+        loser = players[1] if board.rng.random() < value else players[0]
+        for card in loser.hand:
+            card.is_revealed = True
+        board.check_if_game_has_ended()
+        return value
+
+
+if __name__ == "__main__":
+    from functools import partial
+    import random
+    from base_agent import RandomAgent
+    from board import Board
+
+    parser = argparse.ArgumentParser(description="Solve the endgames of random games")
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--players", type=int, default=2)
+    parser.add_argument("--max-cards", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    solver = EndgameSolver()
+    nb_solved, total_time = 0, 0.0
+    for game in range(args.games):
+        board = Board(args.players, seed=args.seed + game)
+        rng = random.Random(args.seed + game)
+        board.start([partial(RandomAgent, rng=rng)] * args.players)
+        last_actions, n_moves = [], 0
+        while not board.game_has_ended and n_moves < 500:
+            if solver.can_solve(board, args.max_cards):
+                actor = solver.slot_players(board)[0]
+                start_time = time.perf_counter()
+                value = solver.evaluate(board, actor.id)
+                total_time += time.perf_counter() - start_time
+                nb_solved += 1
+                print(
+                    f"game {game} move {n_moves}: {actor.name} "
+                    f"wins with probability {value:.3f}"
+                )
+                break
+            last_actions = board.agents_next_move(last_actions, 0)
+            n_moves += 1
+    print(
+        f"{nb_solved} endgames solved in {total_time:.2f}s, "
+        f"{len(solver)} positions in the table"
+    )
@@ -0,0 +1,198 @@
+import argparse
+import math
+from functools import partial
+import numpy as np
+import torch
+
+STRATEGIES = ("greedy", "epsilon_greedy", "boltzmann")
+
+
+class LinearSchedule:
+    """Value going linearly from start to end over duration steps, evaluated
+    for a whole tensor of per-row step counts at once"""
+
+    def __init__(self, start: float = 1.0, end: float = 0.05, duration: int = 100_000):
+        self.start = start
+        self.end = end
+        self.duration = duration
+
+    def __call__(self, steps: torch.Tensor | int) -> torch.Tensor:
+        progress = torch.as_tensor(steps, dtype=torch.float) / self.duration
+        return self.start + (self.end - self.start) * progress.clamp(0, 1)
+
+
+def per_worker_epsilons(
+    nb_workers: int, base: float = 0.4, alpha: float = 7.0
+) -> torch.Tensor:
+    # Ape-X spread: worker i explores with base ** (1 + alpha * i / (n - 1)),
+    # from heavily exploring workers down to almost greedy ones
+    exponents = 1 + alpha * torch.arange(nb_workers) / max(1, nb_workers - 1)
+    return base**exponents
+
+
+def masked_logits(q_values: torch.Tensor, action_masks: torch.Tensor) -> torch.Tensor:
+    return q_values.masked_fill(~action_masks, -math.inf)
+
+
+def gumbel_noise(shape, generator: torch.Generator | None = None) -> torch.Tensor:
+    uniform = torch.rand(shape, generator=generator).clamp_(min=1e-20)
+    return -torch.log(-torch.log(uniform))
+
+
+def greedy(q_values: torch.Tensor, action_masks: torch.Tensor) -> torch.Tensor:
+    return masked_logits(q_values, action_masks).argmax(dim=1)
+
+
+def uniform_legal(
+    action_masks: torch.Tensor, generator: torch.Generator | None = None
+) -> torch.Tensor:
+    # Argmax of uniform noise over the legal actions, a uniform legal draw
+    noise = torch.rand(action_masks.shape, generator=generator)
+    return noise.masked_fill_(~action_masks, -1.0).argmax(dim=1)
+
+
+def epsilon_greedy(
+    q_values: torch.Tensor,
+    action_masks: torch.Tensor,
+    epsilon: float | torch.Tensor,
+    generator: torch.Generator | None = None,
+) -> torch.Tensor:
+    """Greedy action of each row, replaced by a uniform legal action with
+    probability epsilon (a scalar or one value per row)"""
+    explore = torch.rand(len(q_values), generator=generator) < torch.as_tensor(epsilon)
+    return torch.where(
+        explore, uniform_legal(action_masks, generator), greedy(q_values, action_masks)
+    )
+
+
+def boltzmann(
+    q_values: torch.Tensor,
+    action_masks: torch.Tensor,
+    temperature: float | torch.Tensor = 1.0,
+    generator: torch.Generator | None = None,
+) -> torch.Tensor:
+    # Gumbel-max trick: argmax(logits + Gumbel noise) is a softmax sample
+    # without normalising or calling multinomial
+    return gumbel_top_k(q_values, action_masks, 1, temperature, generator)[:, 0]
+
+
+def gumbel_top_k(
+    q_values: torch.Tensor,
+    action_masks: torch.Tensor,
+    k: int,
+    temperature: float | torch.Tensor = 1.0,
+    generator: torch.Generator | None = None,
+) -> torch.Tensor:
+    """k distinct actions per row sampled without replacement from
+    softmax(Q / temperature) over the legal actions, as a [B, k] tensor.
+    Rows with fewer than k legal actions are padded with -1"""
+    temperature = torch.as_tensor(temperature, dtype=q_values.dtype)
+    if temperature.dim() == 1:
+        temperature = temperature[:, None]
+    perturbed = masked_logits(q_values / temperature, action_masks) + gumbel_noise(
+        q_values.shape, generator
+    )
+    scores, action_ids = perturbed.topk(k, dim=1)
+    return action_ids.masked_fill_(scores == -math.inf, -1)
+
+
+class ActionSampler:
+    """Batched action selection of one worker: takes [B, n_actions] Q-values
+    and legal action masks and returns [B] action ids in one vectorized call.
+    Each worker owns its generator so seeded runs are reproducible whatever
+    the other workers do"""
+
+    def __init__(
+        self,
+        strategy: str = "epsilon_greedy",
+        epsilon: float | torch.Tensor | LinearSchedule = 0.1,
+        temperature: float | torch.Tensor = 1.0,
+        seed: int | None = None,
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown exploration strategy {strategy}")
+        self.strategy = strategy
+        self.epsilon = epsilon
+        self.temperature = temperature
+        self.generator = torch.Generator()
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+    def row_epsilons(self, steps: torch.Tensor | int | None) -> torch.Tensor:
+        if isinstance(self.epsilon, LinearSchedule):
+            return self.epsilon(0 if steps is None else steps)
+        return torch.as_tensor(self.epsilon)
+
+    def sample(
+        self,
+        q_values: torch.Tensor,
+        action_masks: torch.Tensor | np.ndarray,
+        epsilon: float | torch.Tensor | None = None,
+        steps: torch.Tensor | int | None = None,
+    ) -> torch.Tensor:
+        """epsilon overrides the sampler's own, steps are the per-row step
+        counts an epsilon schedule is evaluated at"""
+        if isinstance(action_masks, np.ndarray):
+            # Copied, masks from the generator are read-only arrays
+            action_masks = torch.tensor(action_masks, dtype=torch.bool)
+        if self.strategy == "greedy":
+            return greedy(q_values, action_masks)
+        if self.strategy == "boltzmann":
+            return boltzmann(q_values, action_masks, self.temperature, self.generator)
+        if epsilon is None:
+            epsilon = self.row_epsilons(steps)
+        return epsilon_greedy(q_values, action_masks, epsilon, self.generator)
+
+
+if __name__ == "__main__":
+    import sys
+    from agent import CoupAgent
+    from board import Board, play_game
+    from deck import DealPool
+
+    parser = argparse.ArgumentParser(
+        description="Check that an epsilon schedule decays over an agent's decisions"
+    )
+    parser.add_argument("--decisions", type=int, default=400)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    torch.manual_seed(args.seed)
+
+    class ProbedAgent(CoupAgent):
+        # Records whether each decision of seat 0 left its greedy action
+        explored = []
+
+        def select_action_id(self, state: np.ndarray, action_mask: np.ndarray) -> int:
+            action_id = super().select_action_id(state, action_mask)
+            if self.id == 0 and action_mask.sum() > 1:
+                q_values = np.where(action_mask, self.q_values(state).numpy(), -np.inf)
+                self.explored.append(action_id != q_values.argmax())
+            return action_id
+
+    # Fully random at first, greedy after args.decisions decisions
+    sampler = ActionSampler(
+        epsilon=LinearSchedule(1.0, 0.0, args.decisions), seed=args.seed
+    )
+    board = Board(args.players, seed=args.seed)
+    deals = DealPool(args.players, 1000, seed=args.seed)
+    # Agents are kept by Board.reset, so their decision counts carry over
+    play_game(
+        board,
+        [partial(ProbedAgent, sampler=sampler)] * args.players,
+        deal=deals.next_deal(),
+    )
+    while board.agents[0].nb_decisions < args.decisions:
+        play_game(board, None, deal=deals.next_deal())
+    window = len(ProbedAgent.explored) // 4
+    first_rate = np.mean(ProbedAgent.explored[:window])
+    last_rate = np.mean(ProbedAgent.explored[-window:])
+    print(
+        f"{board.agents[0].nb_decisions} decisions, non-greedy actions: "
+        f"{100 * first_rate:.0f}% of the first quarter, "
+        f"{100 * last_rate:.0f}% of the last one"
+    )
+    if not last_rate < first_rate:
+        sys.exit("epsilon did not decay")
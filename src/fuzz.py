@@ -0,0 +1,616 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+import zlib
+from functools import partial
+from typing import NamedTuple
+import numpy as np
+from pydantic import BaseModel
+from action import ActionType, get_action_id, get_nb_actions
+from base_agent import BaseAgent
+from board import Board, play_game
+from deck import DealPool
+from game_record import GameRecorder, GameReplay
+
+# Counters of each action type, as listed by the agents before masks were
+# looked up from a MaskKey
+REFERENCE_COUNTERS = {
+    ActionType.FOREIGN_AID: [ActionType.COUNTER_FOREIGN_AID_WITH_DUKE],
+    ActionType.CAPTAIN: [
+        ActionType.COUNTER_CAPTAIN_WITH_CAPTAIN,
+        ActionType.COUNTER_CAPTAIN_WITH_AMBASSADOR,
+    ],
+    ActionType.ASSASSIN: [ActionType.COUNTER_ASSASSIN_WITH_CONTESSA],
+}
+
+
+def legal_mask(allowed: list[tuple[ActionType, int]], nb_players: int) -> np.ndarray:
+    mask = np.zeros(get_nb_actions(nb_players), dtype=bool)
+    for action_type, target in allowed:
+        mask[get_action_id(action_type, target, nb_players)] = True
+    return mask
+
+
+# Reference legal actions, computed from the players without any cache
+
+
+def reference_action_mask(player, alive_players: list, nb_players: int) -> np.ndarray:
+    targets = [
+        other.id
+        for other in alive_players
+        if other.id != player.id and any(not card.is_revealed for card in other.hand)
+    ]
+    captain_targets = [
+        other.id for other in alive_players if other.id in targets and other.coins >= 2
+    ]
+    if player.must_coup:
+        return legal_mask([(ActionType.COUP, target) for target in targets], nb_players)
+    allowed = [(ActionType.REVENUE, -1), (ActionType.FOREIGN_AID, -1)]
+    if player.can_coup and targets:
+        allowed += [(ActionType.COUP, target) for target in targets]
+        if player.coins > 3:
+            allowed += [(ActionType.ASSASSIN, target) for target in targets]
+    allowed += [(ActionType.CAPTAIN, target) for target in captain_targets]
+    return legal_mask(allowed, nb_players)
+
+
+def reference_challenge_mask(nb_players: int) -> np.ndarray:
+    return legal_mask(
+        [(ActionType.CHALLENGE, -1), (ActionType.DO_NOTHING, -1)], nb_players
+    )
+
+
+def reference_counter_mask(action_type: ActionType, nb_players: int) -> np.ndarray:
+    allowed = [(ActionType.DO_NOTHING, -1)]
+    allowed += [(counter, -1) for counter in REFERENCE_COUNTERS.get(action_type, [])]
+    return legal_mask(allowed, nb_players)
+
+
+def reference_reveal_mask(hand: list, nb_players: int) -> np.ndarray:
+    slots = (ActionType.REVEAL_CARD_1, ActionType.REVEAL_CARD_2)
+    return legal_mask(
+        [(slots[i], -1) for i in range(2) if not hand[i].is_revealed], nb_players
+    )
+
+
+def reference_discard_mask(hand: list, nb_players: int) -> np.ndarray:
+    return legal_mask(
+        [
+            (ActionType[f"DISCARD_{card.character.name}"], -1)
+            for card in hand
+            if not card.is_revealed
+        ],
+        nb_players,
+    )
+
+
+class BoardSnapshot(NamedTuple):
+    # Everything the rules act on, in plain values so snapshots of two
+    # boards compare with ==
+    nb_moves: int
+    current_player: int
+    coins: tuple
+    hands: tuple  # (character, is_revealed) per card, per player
+    alive: tuple
+    eliminated: tuple
+    deck: tuple
+    actions_history: tuple
+    deck_history: tuple
+    rng: int  # hash of the rng state, the next shuffles depend on it
+
+
+def snapshot(board: Board) -> BoardSnapshot:
+    return BoardSnapshot(
+        board.nb_moves,
+        board.current_player.id,
+        tuple(player.coins for player in board.players),
+        tuple(
+            tuple((card.character.name, card.is_revealed) for card in player.hand)
+            for player in board.players
+        ),
+        tuple(player.is_alive for player in board.players),
+        tuple(player.id for player in board.eliminated_players),
+        tuple(card.character.name for card in board.deck.deck),
+        tuple(
+            (
+                item.origin_player.id,
+                item.action_type.name,
+                item.target_player.id if item.target_player is not None else -1,
+            )
+            for item in board.actions_history
+        ),
+        tuple(
+            (
+                item.card.character.name,
+                item.returned_from,
+                item.given_to,
+                item.player.id,
+                item.public,
+            )
+            for item in board.deck_history
+        ),
+        hash(board.rng.getstate()),
+    )
+
+
+class Decision(NamedTuple):
+    seat: int
+    phase: str
+    legal_ids: tuple
+    action_id: int
+    board: BoardSnapshot
+    state: int  # checksum of the deciding agent's encoded state
+
+
+class FuzzCase(BaseModel):
+    """A game to play on every engine: the deal and rng come from the seed,
+    choice i picks the i-th decision's action among its legal ones (modulo
+    their number), decisions past the end of choices pick the first"""
+
+    nb_players: int
+    seed: int
+    choices: list[int] = []
+    max_moves: int = 200
+    encode_states: bool = True
+
+
+class ChoiceStream:
+    # Choices of a case, drawn from rng past the end of the list when given,
+    # so a random game records the choices that replay it
+    def __init__(self, choices: list[int], rng: random.Random | None = None):
+        self.choices = list(choices)
+        self.rng = rng
+        self.position = 0
+
+    def pick(self, legal_ids: np.ndarray) -> int:
+        if self.position == len(self.choices) and self.rng is not None:
+            self.choices.append(self.rng.randrange(len(legal_ids)))
+        choice = self.choices[self.position] if self.position < len(self.choices) else 0
+        self.position += 1
+        return int(legal_ids[choice % len(legal_ids)])
+
+
+class Tracer:
+    """Board metrics hooks and decision maker of the fuzz agents of one
+    board. Records every decision with a snapshot of the board, and the
+    board after every move. With reference, the board is re-encoded from
+    scratch at the start of each game and legal actions come from the
+    reference masks instead of the agents' cached ones"""
+
+    enabled = True
+
+    def __init__(self, reference: bool = False, compare_states: bool = True):
+        self.reference = reference
+        self.compare_states = compare_states
+        self.board = None
+        self.stream = ChoiceStream([])
+        self.decisions: list[Decision] = []
+        self.moves: list[BoardSnapshot] = []
+
+    def begin(self, stream: ChoiceStream):
+        self.stream = stream
+        self.decisions = []
+        self.moves = []
+
+    def decide(self, agent: "FuzzAgent", state: np.ndarray, action_mask: np.ndarray):
+        phase, reference_mask = agent.context
+        if self.reference:
+            action_mask = reference_mask()
+        legal_ids = np.flatnonzero(action_mask)
+        action_id = self.stream.pick(legal_ids)
+        self.decisions.append(
+            Decision(
+                agent.id,
+                phase,
+                tuple(legal_ids.tolist()),
+                action_id,
+                snapshot(self.board),
+                zlib.crc32(state) if self.compare_states else 0,
+            )
+        )
+        return action_id
+
+    def start_game(self, board):
+        self.board = board
+        if self.reference:
+            board.update_agent_states()
+        self.moves.append(snapshot(board))
+
+    def claim(self, player, action):
+        pass
+
+    def challenge(self, action_type, is_bluffing: bool, challenger, claimant):
+        pass
+
+    def steal(self, player, target, amount: int):
+        pass
+
+    def end_move(self, board):
+        self.moves.append(snapshot(board))
+
+    def end_game(self, board, placements: list[int], n_moves: int, completed: bool):
+        if completed:
+            # The last move's eliminations are settled after it
+            self.moves[-1] = snapshot(board)
+
+
+class FuzzAgent(BaseAgent):
+    # Plays the choices of a Tracer, keeping what the reference masks of
+    # the pending decision are computed from
+    def __init__(
+        self,
+        player,
+        full_state_length: int,
+        state_item_width: int,
+        nb_players: int = 4,
+        tracer: Tracer | None = None,
+    ):
+        super().__init__(player, full_state_length, state_item_width, nb_players)
+        self.tracer = tracer
+        self.context = None
+
+    def select_action_id(self, state: np.ndarray, action_mask: np.ndarray) -> int:
+        return self.tracer.decide(self, state, action_mask)
+
+    def choose_action(self, player, alive_players: list):
+        self.context = (
+            "action",
+            partial(reference_action_mask, player, alive_players, self.nb_players),
+        )
+        return super().choose_action(player, alive_players)
+
+    def choose_challenge(self, action_to_challenge, player_to_challenge):
+        self.context = (
+            "challenge",
+            partial(reference_challenge_mask, self.nb_players),
+        )
+        return super().choose_challenge(action_to_challenge, player_to_challenge)
+
+    def choose_counter(self, action_to_counter, player_to_counter):
+        self.context = (
+            "counter",
+            partial(
+                reference_counter_mask, action_to_counter.action_type, self.nb_players
+            ),
+        )
+        return super().choose_counter(action_to_counter, player_to_counter)
+
+    def choose_card_to_reveal_from_hand(self, hand: list):
+        self.context = ("reveal", partial(reference_reveal_mask, hand, self.nb_players))
+        return super().choose_card_to_reveal_from_hand(hand)
+
+    def choose_card_to_discard_from_hand(self, hand: list):
+        self.context = (
+            "discard",
+            partial(reference_discard_mask, hand, self.nb_players),
+        )
+        return super().choose_card_to_discard_from_hand(hand)
+
+
+class RulesOnlyBoard(Board):
+    # States are not encoded, most of the cost of a move: every agent sees
+    # the same blank state
+    def encode_agent_states(self):
+        blank_state = np.zeros((self.full_state_length, self.state_item_width))
+        for agent in self.agents:
+            agent.state = blank_state
+
+
+def case_board(case: FuzzCase, **kwargs) -> Board:
+    board_class = Board if case.encode_states else RulesOnlyBoard
+    return board_class(case.nb_players, **kwargs)
+
+
+class LastRecord:
+    # In-memory stand-in for a GameRecordFile, only the last game is kept
+    def __init__(self):
+        self.record = None
+
+    def __len__(self) -> int:
+        return int(self.record is not None)
+
+    def append(self, record):
+        self.record = record
+
+
+class Trace(NamedTuple):
+    decisions: list[Decision]
+    moves: list[BoardSnapshot]
+    record: object  # game_record.GameRecord of the game
+    completed: bool
+
+
+class Divergence(NamedTuple):
+    engine: str
+    kind: str  # "decision" or "move"
+    index: int
+    field: str
+    expected: object
+    actual: object
+
+    def __str__(self):
+        return (
+            f"{self.engine}: {self.kind} {self.index} differs on {self.field}\n"
+            f"  reference: {self.expected}\n"
+            f"  {self.engine}: {self.actual}"
+        )
+
+
+def case_deal(case: FuzzCase) -> np.ndarray:
+    return DealPool(case.nb_players, 1, seed=case.seed)[0]
+
+
+def run_reference(case: FuzzCase, rng: random.Random | None = None) -> Trace:
+    """Play a case on a new board, every state encoded from scratch and the
+    reference masks deciding. With rng, decisions past the case's choices
+    are drawn from it and appended to case.choices"""
+    tracer = Tracer(reference=True, compare_states=case.encode_states)
+    recorder = GameRecorder(os.devnull, keyframe_every=4, metrics=tracer)
+    recorder.file = LastRecord()
+    board = case_board(case, seed=case.seed, metrics=recorder)
+    stream = ChoiceStream(case.choices, rng)
+    tracer.begin(stream)
+    factories = [partial(FuzzAgent, tracer=tracer)] * case.nb_players
+    _, _, completed = play_game(board, factories, case.max_moves, deal=case_deal(case))
+    if rng is not None:
+        case.choices = stream.choices
+    return Trace(tracer.decisions, tracer.moves, recorder.file.record, completed)
+
+
+# Boards of the reset engine, kept across the cases of a process
+WARM_BOARDS: dict[tuple[int, bool], tuple[Board, Tracer]] = {}
+
+
+def run_reset(case: FuzzCase) -> Trace:
+    """Play a case on a board reused across games with Board.reset: cards,
+    players and agents are recycled, the first states are copied from the
+    template, and the agents' cached masks decide"""
+    key = case.nb_players, case.encode_states
+    if key not in WARM_BOARDS:
+        tracer = Tracer(compare_states=case.encode_states)
+        board = case_board(case, metrics=tracer)
+        board.reset(
+            DealPool(case.nb_players, 1)[0],
+            [partial(FuzzAgent, tracer=tracer)] * case.nb_players,
+        )
+        WARM_BOARDS[key] = board, tracer
+    board, tracer = WARM_BOARDS[key]
+    board.rng.seed(case.seed)
+    tracer.begin(ChoiceStream(case.choices))
+    _, _, completed = play_game(board, None, case.max_moves, deal=case_deal(case))
+    return Trace(tracer.decisions, tracer.moves, None, completed)
+
+
+def first_difference(expected: tuple, actual: tuple, prefix: str = "") -> tuple:
+    # (field path, expected value, actual value) of the first differing field
+    for field, expected_value, actual_value in zip(expected._fields, expected, actual):
+        if expected_value == actual_value:
+            continue
+        if isinstance(expected_value, BoardSnapshot):
+            return first_difference(expected_value, actual_value, f"{prefix}{field}.")
+        return f"{prefix}{field}", expected_value, actual_value
+    return f"{prefix}?", expected, actual
+
+
+def compare(engine: str, kind: str, expected: list, actual: list) -> Divergence | None:
+    for index, (expected_item, actual_item) in enumerate(zip(expected, actual)):
+        if expected_item != actual_item:
+            return Divergence(
+                engine, kind, index, *first_difference(expected_item, actual_item)
+            )
+    if len(expected) != len(actual):
+        index = min(len(expected), len(actual))
+        return Divergence(engine, kind, index, "length", len(expected), len(actual))
+    return None
+
+
+def check_reset(case: FuzzCase, reference: Trace) -> Divergence | None:
+    trace = run_reset(case)
+    return compare("reset", "decision", reference.decisions, trace.decisions) or (
+        compare("reset", "move", reference.moves, trace.moves)
+    )
+
+
+def check_replay(case: FuzzCase, reference: Trace) -> Divergence | None:
+    """Seek a replay of the reference game to each of its moves in a random
+    order, each seek restoring a keyframe or stepping from the last one"""
+    replay = GameReplay(reference.record)
+    # GameReplay settles the last move of a game, even an unfinished one
+    nb_positions = reference.record.n_moves + reference.completed
+    moves = list(range(nb_positions))
+    random.Random(case.seed).shuffle(moves)
+    for move in moves:
+        replay.seek(move)
+        actual = snapshot(replay.board)
+        if actual != reference.moves[move]:
+            return Divergence(
+                "replay", "move", move, *first_difference(reference.moves[move], actual)
+            )
+    return None
+
+
+# Fast paths checked against the reference Board
+ENGINES = {"reset": check_reset, "replay": check_replay}
+
+
+def find_divergence(
+    case: FuzzCase, engines: list[str], rng: random.Random | None = None
+) -> Divergence | None:
+    """First divergence of the engines from the reference on a case. An
+    exception is a divergence too, of the reference itself if it raises"""
+    try:
+        reference = run_reference(case, rng)
+    except Exception as error:
+        return Divergence("reference", "error", -1, type(error).__name__, None, error)
+    for engine in engines:
+        try:
+            divergence = ENGINES[engine](case, reference)
+        except Exception as error:
+            divergence = Divergence(
+                engine, "error", -1, type(error).__name__, None, repr(error)
+            )
+        if divergence is not None:
+            return divergence
+    return None
+
+
+def shrink(
+    case: FuzzCase, engines: list[str], max_attempts: int = 2000
+) -> tuple[FuzzCase, Divergence]:
+    """Greedily simplify a failing case while the same engine still
+    diverges: fewer players, fewer moves, fewer choices, then smaller
+    choices (0 picks the first legal action), until no candidate fails or
+    max_attempts cases were played"""
+    divergence = find_divergence(case, engines)
+    attempts = 0
+
+    def fails(candidate: FuzzCase) -> bool:
+        nonlocal attempts, divergence
+        attempts += 1
+        found = find_divergence(candidate, engines)
+        if found is None or found.engine != divergence.engine:
+            return False
+        divergence = found
+        return True
+
+    def smallest(low: int, high: int, candidate) -> int:
+        # Smallest value in [low, high] whose candidate fails, high failing
+        while low < high and attempts < max_attempts:
+            middle = (low + high) // 2
+            if fails(candidate(middle)):
+                high = middle
+            else:
+                low = middle + 1
+        return high
+
+    def with_changes(**changes) -> FuzzCase:
+        return case.model_copy(update=changes)
+
+    improved = True
+    while improved and attempts < max_attempts:
+        improved = False
+        for nb_players in range(2, case.nb_players):
+            if fails(with_changes(nb_players=nb_players)):
+                case = with_changes(nb_players=nb_players)
+                improved = True
+                break
+        max_moves = smallest(
+            1, case.max_moves, lambda moves: with_changes(max_moves=moves)
+        )
+        nb_choices = smallest(
+            0,
+            len(case.choices),
+            lambda length, choices=case.choices: with_changes(choices=choices[:length]),
+        )
+        if (max_moves, nb_choices) != (case.max_moves, len(case.choices)):
+            case = with_changes(max_moves=max_moves, choices=case.choices[:nb_choices])
+            improved = True
+        for size in (8, 4, 2, 1):
+            start = 0
+            while start < len(case.choices) and attempts < max_attempts:
+                choices = case.choices[:start] + case.choices[start + size :]
+                if fails(with_changes(choices=choices)):
+                    case = with_changes(choices=choices)
+                    improved = True
+                else:
+                    start += size
+        for i in range(len(case.choices)):
+            for value in (0, case.choices[i] - 1):
+                if value < 0 or value >= case.choices[i] or attempts >= max_attempts:
+                    continue
+                choices = case.choices[:i] + [value] + case.choices[i + 1 :]
+                if fails(with_changes(choices=choices)):
+                    case = with_changes(choices=choices)
+                    improved = True
+                    break
+    return case, divergence
+
+
+def fuzz_task(task: tuple) -> tuple[int, int, list[tuple[str, str]]]:
+    """Fuzz the games of a range of seeds. Returns the number of games and
+    of decisions played, and the shrunk failing cases with their
+    divergences"""
+    first_seed, nb_games, players, engines, max_moves, encode_states, max_shrink = task
+    nb_decisions = 0
+    failures = []
+    for seed in range(first_seed, first_seed + nb_games):
+        rng = random.Random(f"fuzz {seed}")
+        case = FuzzCase(
+            nb_players=rng.choice(players),
+            seed=seed,
+            max_moves=max_moves,
+            encode_states=encode_states,
+        )
+        divergence = find_divergence(case, engines, rng)
+        nb_decisions += len(case.choices)
+        if divergence is not None:
+            case, divergence = shrink(case, engines, max_shrink)
+            failures.append((case.model_dump_json(), str(divergence)))
+    return nb_games, nb_decisions, failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Differential fuzzing of the fast paths against the reference Board"
+    )
+    parser.add_argument("--games", type=int, default=10_000)
+    parser.add_argument("--players", default="2,3,4,5,6")
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk", type=int, default=100, help="games per task")
+    parser.add_argument("--max-moves", type=int, default=200)
+    parser.add_argument("--max-failures", type=int, default=5)
+    parser.add_argument(
+        "--rules-only",
+        action="store_true",
+        help="do not encode nor compare agent states, several times faster",
+    )
+    parser.add_argument(
+        "--shrink-attempts", type=int, default=2000, help="games per shrunk failure"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--case", help="JSON of a FuzzCase to play again")
+    args = parser.parse_args()
+    engines = args.engines.split(",")
+
+    if args.case:
+        case = FuzzCase(**json.loads(args.case))
+        divergence = find_divergence(case, engines)
+        print(divergence if divergence is not None else "No divergence")
+        raise SystemExit(divergence is not None)
+
+    players = [int(nb_players) for nb_players in args.players.split(",")]
+    tasks = [
+        (
+            args.seed + first,
+            min(args.chunk, args.games - first),
+            players,
+            engines,
+            args.max_moves,
+            not args.rules_only,
+            args.shrink_attempts,
+        )
+        for first in range(0, args.games, args.chunk)
+    ]
+    nb_games = nb_decisions = 0
+    failures = []
+    start_time = time.perf_counter()
+    with multiprocessing.Pool(args.workers) as pool:
+        for games, decisions, task_failures in pool.imap_unordered(fuzz_task, tasks):
+            nb_games += games
+            nb_decisions += decisions
+            failures += task_failures
+            elapsed = time.perf_counter() - start_time
+            print(
+                f"{nb_games} games, {nb_decisions} decisions compared, "
+                f"{nb_games / elapsed:.0f} games/s, {len(failures)} failures"
+            )
+            if len(failures) >= args.max_failures:
+                pool.terminate()
+                break
+    for case_json, divergence in failures:
+        print(f"\n{divergence}\nReplay with: uv run src/fuzz.py --case '{case_json}'")
+    raise SystemExit(bool(failures))
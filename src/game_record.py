@@ -0,0 +1,323 @@
+import argparse
+import os
+import pickle
+import time
+from functools import partial
+import numpy as np
+from base_agent import BaseAgent
+from board import Board
+from metrics import NULL_METRICS, agent_kind
+
+# Everything a Board needs to continue a game from a move boundary. The deck
+# shares the board's rng and the histories share the players and cards, so
+# they are pickled together to keep these references
+KEYFRAME_FIELDS = (
+    "players",
+    "alive_players",
+    "eliminated_players",
+    "current_player",
+    "deck",
+    "cards",
+    "rng",
+    "game_has_started",
+    "game_has_ended",
+    "actions_history",
+    "deck_history",
+    "history",
+    "nb_moves",
+)
+
+
+def board_keyframe(board) -> bytes:
+    return pickle.dumps(
+        {field: getattr(board, field) for field in KEYFRAME_FIELDS},
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+
+
+def restore_keyframe(board, keyframe: bytes):
+    """Put the board back at a recorded move boundary, its agents are
+    seated again on the restored players"""
+    for field, value in pickle.loads(keyframe).items():
+        setattr(board, field, value)
+    for agent, player in zip(board.agents, board.players):
+        agent.player = player
+    board.update_agent_states()
+
+
+class GameRecord:
+    """One recorded game: every action id chosen in order and keyframes of
+    the board every few moves. With its keyframe at move m and the decisions
+    made from there, a game is re-simulated exactly from move m"""
+
+    def __init__(
+        self,
+        nb_players: int,
+        agent_kinds: list[str],
+        decisions: np.ndarray,
+        move_boundaries: np.ndarray,
+        keyframes: dict[int, bytes],
+        placements: list[int],
+        completed: bool,
+    ):
+        self.nb_players = nb_players
+        self.agent_kinds = agent_kinds
+        self.decisions = decisions
+        # Number of decisions made before each move, and in the whole game
+        self.move_boundaries = move_boundaries
+        self.keyframes = keyframes
+        self.placements = placements
+        self.completed = completed
+
+    @property
+    def n_moves(self) -> int:
+        return len(self.move_boundaries) - 1
+
+    def keyframe_before(self, move: int) -> int:
+        return max(keyframe for keyframe in self.keyframes if keyframe <= move)
+
+
+class GameRecordFile:
+    """Append-only file of pickled GameRecords with a sidecar index of their
+    int64 offsets, so game n is loaded with one seek whatever its position"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + ".index"
+
+    def __len__(self) -> int:
+        if not os.path.exists(self.index_path):
+            return 0
+        return os.path.getsize(self.index_path) // 8
+
+    def append(self, record: GameRecord):
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.index_path, "ab") as f:
+            np.array([offset], dtype=np.int64).tofile(f)
+
+    def load(self, game: int) -> GameRecord:
+        if not 0 <= game < len(self):
+            raise IndexError(f"No game {game} in {self.path}")
+        offset = np.fromfile(self.index_path, np.int64, count=1, offset=8 * game)
+        with open(self.path, "rb") as f:
+            f.seek(int(offset[0]))
+            return pickle.load(f)
+
+
+class GameRecorder:
+    """Board metrics hooks recording every game played on the board into a
+    GameRecordFile. Other hooks are forwarded to the wrapped metrics. The
+    game loop pays a list append per decision and a pickle of the board
+    every keyframe_every moves"""
+
+    enabled = True
+
+    def __init__(self, path: str, keyframe_every: int = 16, metrics=NULL_METRICS):
+        self.file = GameRecordFile(path)
+        self.keyframe_every = keyframe_every
+        self.metrics = metrics
+        self.decisions = []
+        self.move_boundaries = []
+        self.keyframes = {}
+
+    def start_game(self, board):
+        self.decisions = []
+        self.move_boundaries = [0]
+        self.keyframes = {0: board_keyframe(board)}
+        for agent in board.agents:
+            agent.decision_log = self.decisions
+        self.metrics.start_game(board)
+
+    def claim(self, player, action):
+        self.metrics.claim(player, action)
+
+    def challenge(self, action_type, is_bluffing: bool, challenger, claimant):
+        self.metrics.challenge(action_type, is_bluffing, challenger, claimant)
+
+    def steal(self, player, target, amount: int):
+        self.metrics.steal(player, target, amount)
+
+    def end_move(self, board):
+        self.move_boundaries.append(len(self.decisions))
+        if board.nb_moves % self.keyframe_every == 0:
+            self.keyframes[board.nb_moves] = board_keyframe(board)
+        self.metrics.end_move(board)
+
+    def end_game(self, board, placements: list[int], n_moves: int, completed: bool):
+        for agent in board.agents:
+            agent.decision_log = None
+        self.file.append(
+            GameRecord(
+                board.nb_players,
+                [agent_kind(agent) for agent in board.agents],
+                np.array(self.decisions, dtype=np.int16),
+                np.array(self.move_boundaries, dtype=np.int32),
+                self.keyframes,
+                placements,
+                completed,
+            )
+        )
+        self.metrics.end_game(board, placements, n_moves, completed)
+
+
+class ReplayDivergence(ValueError):
+    pass
+
+
+class DecisionScript:
+    # Cursor over the recorded decisions, shared by the replay agents
+    def __init__(self, decisions: np.ndarray):
+        self.decisions = decisions.tolist()
+        self.position = 0
+
+    def next(self) -> int:
+        if self.position >= len(self.decisions):
+            raise ReplayDivergence("The game asks for more decisions than recorded")
+        self.position += 1
+        return self.decisions[self.position - 1]
+
+
+class ReplayAgent(BaseAgent):
+    """Plays back the decisions of a GameRecord, shared by all the seats of
+    the board in the order they were made. A recorded action that is not
+    legal any more means the rules changed since the game was recorded"""
+
+    def __init__(
+        self,
+        player,
+        full_state_length: int,
+        state_item_width: int,
+        nb_players: int = 4,
+        script: DecisionScript | None = None,
+    ):
+        super().__init__(player, full_state_length, state_item_width, nb_players)
+        self.script = script
+
+    def select_action_id(self, state: np.ndarray, action_mask: np.ndarray) -> int:
+        action_id = self.script.next()
+        if not action_mask[action_id]:
+            raise ReplayDivergence(
+                f"Recorded action {action_id} of decision {self.script.position - 1} "
+                f"is not legal for player {self.id}"
+            )
+        return action_id
+
+
+class ReplayBoard(Board):
+    # Replay agents do not look at their states, encoding them is most of
+    # the cost of a move
+    def encode_agent_states(self):
+        pass
+
+
+class GameReplay:
+    """A recorded game on a board of replay agents, positioned at any move.
+    Seeking restores the closest keyframe at or before the move and
+    re-simulates the few moves after it, or keeps going forward from the
+    current position when that is closer. Agent states are only encoded
+    with encode_states, to inspect what an agent saw. Games finished by an
+    endgame solver replay up to the solved position"""
+
+    def __init__(
+        self,
+        record: GameRecord,
+        last_actions_max_length: int = 5,
+        encode_states: bool = False,
+    ):
+        self.record = record
+        self.last_actions_max_length = last_actions_max_length
+        self.script = DecisionScript(record.decisions)
+        board_class = Board if encode_states else ReplayBoard
+        self.board = board_class(record.nb_players)
+        self.board.start([partial(ReplayAgent, script=self.script)] * record.nb_players)
+        self.last_actions = []
+        self.restore(0)
+
+    @property
+    def move(self) -> int:
+        return self.board.nb_moves
+
+    def restore(self, keyframe: int):
+        restore_keyframe(self.board, self.record.keyframes[keyframe])
+        self.script.position = int(self.record.move_boundaries[keyframe])
+        self.last_actions = []
+
+    def step(self):
+        if self.move >= self.record.n_moves:
+            return
+        self.last_actions = self.board.agents_next_move(
+            self.last_actions, self.last_actions_max_length
+        )
+        if self.script.position != self.record.move_boundaries[self.move]:
+            raise ReplayDivergence(
+                f"Move {self.move - 1} did not use the decisions it was recorded with"
+            )
+        self.settle()
+
+    def settle(self):
+        if self.move == self.record.n_moves:
+            # Eliminations and the next player are settled at the start of
+            # a move, which the recorded game did without playing it
+            self.board.check_if_game_has_ended()
+
+    def seek(self, move: int):
+        move = max(0, min(move, self.record.n_moves))
+        keyframe = self.record.keyframe_before(move)
+        if not keyframe <= self.move <= move or self.move == self.record.n_moves:
+            self.restore(keyframe)
+            self.settle()
+        while self.move < move:
+            self.step()
+
+
+if __name__ == "__main__":
+    import random
+    from base_agent import RandomAgent
+    from board import play_game
+    from heuristic_agent import HEURISTIC_PRESETS, heuristic_factory
+
+    # Records must pickle game_record.GameRecord, not __main__.GameRecord,
+    # to be loaded by the replay viewer
+    from game_record import GameRecorder, GameReplay
+
+    parser = argparse.ArgumentParser(
+        description="Record headless games and time random seeks into them"
+    )
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--out", default="games.rec")
+    parser.add_argument("--keyframe-every", type=int, default=16)
+    parser.add_argument("--seeks", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    agent_factories = [heuristic_factory(preset, rng) for preset in HEURISTIC_PRESETS]
+    agent_factories.append(partial(RandomAgent, rng=rng))
+    recorder = GameRecorder(args.out, args.keyframe_every)
+    board = Board(args.players, seed=args.seed, metrics=recorder)
+    first_game = len(recorder.file)
+    start_time = time.perf_counter()
+    for game in range(args.games):
+        seats = [
+            agent_factories[(game + seat) % len(agent_factories)]
+            for seat in range(args.players)
+        ]
+        play_game(board, seats)
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"{args.games} games recorded in {elapsed:.1f}s, "
+        f"{os.path.getsize(args.out) / len(recorder.file) / 1024:.1f} KB per game"
+    )
+
+    start_time = time.perf_counter()
+    nb_moves = 0
+    for _ in range(args.seeks):
+        record = recorder.file.load(rng.randrange(first_game, len(recorder.file)))
+        replay = GameReplay(record)
+        replay.seek(rng.randint(0, record.n_moves))
+        nb_moves += replay.move
+    elapsed = time.perf_counter() - start_time
+    print(f"{1000 * elapsed / args.seeks:.1f} ms per game load and seek")
@@ -0,0 +1,200 @@
+import random
+import numpy as np
+from action import ActionType, get_action_id
+from action_mask import DISCARD_ACTION_TYPES
+from base_agent import BaseAgent
+from card import Card
+from character import Character
+from player import Player
+
+# Character a claim has to be backed by
+CLAIMED_CHARACTERS = {
+    ActionType.DUKE: Character.DUKE,
+    ActionType.AMBASSADOR: Character.AMBASSADOR,
+    ActionType.ASSASSIN: Character.ASSASSIN,
+    ActionType.CAPTAIN: Character.CAPTAIN,
+    ActionType.COUNTER_FOREIGN_AID_WITH_DUKE: Character.DUKE,
+    ActionType.COUNTER_ASSASSIN_WITH_CONTESSA: Character.CONTESSA,
+    ActionType.COUNTER_CAPTAIN_WITH_CAPTAIN: Character.CAPTAIN,
+    ActionType.COUNTER_CAPTAIN_WITH_AMBASSADOR: Character.AMBASSADOR,
+}
+# Characters from the most to the least worth keeping
+CHARACTER_VALUES = {
+    Character.DUKE: 4,
+    Character.ASSASSIN: 3,
+    Character.CAPTAIN: 2,
+    Character.CONTESSA: 1,
+    Character.AMBASSADOR: 0,
+}
+REVEAL_ACTION_TYPES = (ActionType.REVEAL_CARD_1, ActionType.REVEAL_CARD_2)
+DISCARD_TYPE_VALUES = [
+    action_type.value for action_type in DISCARD_ACTION_TYPES.values()
+]
+
+
+class HeuristicAgent(BaseAgent):
+    """Rule-based agent: coups as soon as it can, assassinates and steals
+    from the strongest opponent, counters with the characters it holds and
+    gives up its least valuable cards. bluff_rate is the probability
+    of making a claim without the character, challenge_rate the base
+    probability of challenging. Fast and torch-free, used as a baseline and
+    as the teacher of behaviour cloning"""
+
+    def __init__(
+        self,
+        player: Player,
+        full_state_length: int,
+        state_item_width: int,
+        nb_players: int = 4,
+        bluff_rate: float = 0.0,
+        challenge_rate: float = 0.1,
+        rng: random.Random | None = None,
+        kind: str | None = None,
+    ):
+        super().__init__(player, full_state_length, state_item_width, nb_players)
+        self.bluff_rate = bluff_rate
+        self.challenge_rate = challenge_rate
+        self.rng = rng if rng is not None else random.Random()
+        self.kind = kind if kind is not None else type(self).__name__
+        self.opponents: list[Player] = []
+
+    def choose_action(self, player: Player, alive_players: list[Player]):
+        # Only choose_action gets the other players, kept to pick targets
+        self.opponents = [other for other in alive_players if other.id != player.id]
+        return super().choose_action(player, alive_players)
+
+    def unrevealed(self) -> list[Card]:
+        return [card for card in self.player.hand if not card.is_revealed]
+
+    def holds(self, character: Character) -> bool:
+        return any(card.character == character for card in self.unrevealed())
+
+    def claims(self, action_type: ActionType) -> bool:
+        # Honest claims always, bluffs with probability bluff_rate
+        character = CLAIMED_CHARACTERS.get(action_type)
+        return (
+            character is None
+            or self.holds(character)
+            or self.rng.random() < self.bluff_rate
+        )
+
+    def legal(self, action_mask: np.ndarray, action_type: ActionType, target=0):
+        return action_mask[get_action_id(action_type, target, self.nb_players)]
+
+    def strongest_target(self, action_mask: np.ndarray, action_type: ActionType):
+        """Legal target with the most influence, then the most coins"""
+        candidates = [
+            other
+            for other in self.opponents
+            if self.legal(action_mask, action_type, other.id)
+        ]
+        if not candidates:
+            return None
+        return max(
+            candidates,
+            key=lambda other: (
+                sum(not card.is_revealed for card in other.hand),
+                other.coins,
+            ),
+        ).id
+
+    def select_action_id(self, state: np.ndarray, action_mask: np.ndarray) -> int:
+        legal_types = action_mask.reshape(-1, self.nb_players).any(axis=1)
+        if legal_types[ActionType.REVENUE.value] or legal_types[ActionType.COUP.value]:
+            return self.select_main_action(action_mask)
+        if legal_types[ActionType.CHALLENGE.value]:
+            return self.select_challenge(action_mask)
+        if any(legal_types[action_type.value] for action_type in REVEAL_ACTION_TYPES):
+            return self.select_reveal(action_mask)
+        if legal_types[DISCARD_TYPE_VALUES].any():
+            return self.select_discard(action_mask)
+        return self.select_counter(action_mask)
+
+    def select_main_action(self, action_mask: np.ndarray) -> int:
+        for action_type in (ActionType.COUP, ActionType.ASSASSIN):
+            target = self.strongest_target(action_mask, action_type)
+            if target is not None and self.claims(action_type):
+                return get_action_id(action_type, target, self.nb_players)
+        stealable = [
+            other
+            for other in self.opponents
+            if self.legal(action_mask, ActionType.CAPTAIN, other.id)
+        ]
+        if stealable and self.claims(ActionType.CAPTAIN):
+            target = max(stealable, key=lambda other: other.coins).id
+            return get_action_id(ActionType.CAPTAIN, target, self.nb_players)
+        # Foreign aid is blocked by any Duke claim, revenue is safe
+        if self.legal(action_mask, ActionType.FOREIGN_AID) and self.rng.random() < 0.5:
+            return get_action_id(ActionType.FOREIGN_AID, 0, self.nb_players)
+        return get_action_id(ActionType.REVENUE, 0, self.nb_players)
+
+    def select_challenge(self, action_mask: np.ndarray) -> int:
+        # The board does not tell every challenger which claim is at stake,
+        # so claims are challenged at a flat rate
+        if self.rng.random() < self.challenge_rate:
+            return get_action_id(ActionType.CHALLENGE, 0, self.nb_players)
+        return get_action_id(ActionType.DO_NOTHING, 0, self.nb_players)
+
+    def select_counter(self, action_mask: np.ndarray) -> int:
+        legal_ids = np.flatnonzero(action_mask)
+        counters = [
+            action_id
+            for action_id in legal_ids
+            if ActionType(action_id // self.nb_players) in CLAIMED_CHARACTERS
+        ]
+        honest = [
+            action_id
+            for action_id in counters
+            if self.holds(CLAIMED_CHARACTERS[ActionType(action_id // self.nb_players)])
+        ]
+        if honest:
+            return int(honest[0])
+        if counters and self.rng.random() < self.bluff_rate:
+            return int(self.rng.choice(counters))
+        return get_action_id(ActionType.DO_NOTHING, 0, self.nb_players)
+
+    def select_reveal(self, action_mask: np.ndarray) -> int:
+        # Gives up the least valuable unrevealed card
+        slots = [
+            slot
+            for slot, action_type in enumerate(REVEAL_ACTION_TYPES)
+            if self.legal(action_mask, action_type)
+        ]
+        slot = min(
+            slots, key=lambda slot: CHARACTER_VALUES[self.player.hand[slot].character]
+        )
+        return get_action_id(REVEAL_ACTION_TYPES[slot], 0, self.nb_players)
+
+    def select_discard(self, action_mask: np.ndarray) -> int:
+        legal = [
+            (character, action_type)
+            for character, action_type in DISCARD_ACTION_TYPES.items()
+            if self.legal(action_mask, action_type)
+        ]
+        _, action_type = min(legal, key=lambda item: CHARACTER_VALUES[item[0]])
+        return get_action_id(action_type, 0, self.nb_players)
+
+
+# Presets: the teachers of behaviour cloning and the baselines of tournaments
+HEURISTIC_PRESETS = {
+    "honest": {"bluff_rate": 0.0, "challenge_rate": 0.05},
+    "bluffer": {"bluff_rate": 0.35, "challenge_rate": 0.1},
+    "skeptic": {"bluff_rate": 0.1, "challenge_rate": 0.3},
+}
+
+
+def heuristic_factory(preset: str, rng: random.Random | None = None):
+    """Agent factory of a preset, its agents report the preset as their kind"""
+
+    def factory(player, full_state_length, state_item_width, nb_players):
+        return HeuristicAgent(
+            player,
+            full_state_length,
+            state_item_width,
+            nb_players,
+            rng=rng,
+            kind=preset,
+            **HEURISTIC_PRESETS[preset],
+        )
+
+    return factory
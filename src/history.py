@@ -0,0 +1,211 @@
+import argparse
+import time
+import numpy as np
+from action import ActionType
+from character import Character
+
+# Character claimed by each challengeable action and counter
+CLAIMED_CHARACTERS = {
+    ActionType.DUKE: Character.DUKE,
+    ActionType.COUNTER_FOREIGN_AID_WITH_DUKE: Character.DUKE,
+    ActionType.ASSASSIN: Character.ASSASSIN,
+    ActionType.AMBASSADOR: Character.AMBASSADOR,
+    ActionType.COUNTER_CAPTAIN_WITH_AMBASSADOR: Character.AMBASSADOR,
+    ActionType.CAPTAIN: Character.CAPTAIN,
+    ActionType.COUNTER_CAPTAIN_WITH_CAPTAIN: Character.CAPTAIN,
+    ActionType.COUNTER_ASSASSIN_WITH_CONTESSA: Character.CONTESSA,
+}
+# Per-player running counters, claims of each character first
+SUMMARY_COUNTERS = (
+    *(f"{character.name.lower()}_claims" for character in Character),
+    "challenges_won",
+    "challenges_lost",
+    "coins_taken",
+)
+NB_SUMMARY_COUNTERS = len(SUMMARY_COUNTERS)
+CHALLENGES_WON = SUMMARY_COUNTERS.index("challenges_won")
+CHALLENGES_LOST = SUMMARY_COUNTERS.index("challenges_lost")
+COINS_TAKEN = SUMMARY_COUNTERS.index("coins_taken")
+# Columns of the compact events
+ORIGIN, ACTION_TYPE, TARGET = range(3)
+CHARACTER, RETURNED_FROM, PLAYER, PUBLIC = range(4)
+
+
+def encode_action_rows(events: np.ndarray, width: int) -> np.ndarray:
+    # Same rows as Board.encode_action_history_item: one-hot origin, action
+    # type and target (none for -1) in the first three quarters
+    quarter = width // 4
+    events = events.astype(np.intp)
+    rows = np.zeros((len(events), width))
+    index = np.arange(len(events))
+    rows[index, events[:, ORIGIN]] = 1
+    rows[index, quarter + events[:, ACTION_TYPE]] = 1
+    targeted = events[:, TARGET] >= 0
+    rows[index[targeted], 2 * quarter + events[targeted, TARGET]] = 1
+    return rows
+
+
+def encode_deck_rows(
+    events: np.ndarray, width: int, viewer_id: int | None = None
+) -> np.ndarray:
+    # Same rows as Board.encode_deck_history_item, including its visible card
+    # representation: ones everywhere but at the character
+    quarter = width // 4
+    events = events.astype(np.intp)
+    rows = np.zeros((len(events), width))
+    index = np.arange(len(events))
+    if viewer_id is None:
+        is_visible = events[:, PUBLIC] == 1
+    else:
+        is_visible = events[:, PLAYER] == viewer_id
+    rows[is_visible, :quarter] = 1
+    rows[index[is_visible], events[is_visible, CHARACTER]] = 0
+    rows[index[~is_visible], 0] = 1
+    rows[index, quarter + events[:, RETURNED_FROM]] = 1
+    rows[index, 2 * quarter + events[:, PLAYER]] = 1
+    return rows
+
+
+class CompactHistory:
+    """Bounded-memory game history: the last length action and deck events
+    as small integer rows, and per-player running counters (claims of each
+    character, challenges won and lost as the challenger, coins taken with
+    the captain) over the whole game, so an event leaving the window is
+    still accounted for. Memory and encoding cost do not grow with the
+    length of the game"""
+
+    def __init__(self, nb_players: int, length: int):
+        self.nb_players = nb_players
+        self.length = length
+        self.actions = np.zeros((length, 3), dtype=np.int8)
+        self.deck_events = np.zeros((length, 4), dtype=np.int8)
+        self.counters = np.zeros((nb_players, NB_SUMMARY_COUNTERS), dtype=np.int16)
+        self.nb_actions = 0
+        self.nb_deck_events = 0
+
+    def clear(self):
+        self.counters[:] = 0
+        self.nb_actions = 0
+        self.nb_deck_events = 0
+
+    def add_action(self, origin: int, action_type: ActionType, target: int):
+        # Events stay in order, a full window drops its oldest row
+        if self.nb_actions == self.length:
+            self.actions[:-1] = self.actions[1:]
+            self.nb_actions -= 1
+        self.actions[self.nb_actions] = (origin, action_type.value, target)
+        self.nb_actions += 1
+
+    def add_deck_event(
+        self, character: Character, returned_from: bool, player: int, public: bool
+    ):
+        if self.nb_deck_events == self.length:
+            self.deck_events[:-1] = self.deck_events[1:]
+            self.nb_deck_events -= 1
+        self.deck_events[self.nb_deck_events] = (
+            character.to_int(),
+            returned_from,
+            player,
+            public,
+        )
+        self.nb_deck_events += 1
+
+    def claim(self, player_id: int, action_type: ActionType):
+        character = CLAIMED_CHARACTERS[action_type]
+        self.counters[player_id, character.to_int() - 1] += 1
+
+    def challenge(self, challenger_id: int, is_bluffing: bool):
+        self.counters[
+            challenger_id, CHALLENGES_WON if is_bluffing else CHALLENGES_LOST
+        ] += 1
+
+    def steal(self, player_id: int, amount: int):
+        self.counters[player_id, COINS_TAKEN] += amount
+
+    def last_action_row(self, width: int) -> np.ndarray:
+        return encode_action_rows(
+            self.actions[self.nb_actions - 1 : self.nb_actions], width
+        )[0]
+
+    def last_deck_row(self, width: int, viewer_id: int | None = None) -> np.ndarray:
+        return encode_deck_rows(
+            self.deck_events[self.nb_deck_events - 1 : self.nb_deck_events],
+            width,
+            viewer_id,
+        )[0]
+
+    def encode_summary(self, width: int) -> np.ndarray:
+        # One row per player, each counter one-hot in its own block of
+        # width // NB_SUMMARY_COUNTERS columns, saturating at the last one
+        block = width // NB_SUMMARY_COUNTERS
+        counts = np.minimum(self.counters, block - 1)
+        rows = np.zeros((self.nb_players, width))
+        columns = np.arange(NB_SUMMARY_COUNTERS) * block + counts
+        rows[np.arange(self.nb_players)[:, None], columns] = 1
+        return rows
+
+    def encode_actions(self, width: int) -> np.ndarray:
+        # length rows, the events first then zero padding
+        rows = np.zeros((self.length, width))
+        rows[: self.nb_actions] = encode_action_rows(
+            self.actions[: self.nb_actions], width
+        )
+        return rows
+
+    def encode_deck_events(
+        self, width: int, viewer_id: int | None = None
+    ) -> np.ndarray:
+        rows = np.zeros((self.length, width))
+        rows[: self.nb_deck_events] = encode_deck_rows(
+            self.deck_events[: self.nb_deck_events], width, viewer_id
+        )
+        return rows
+
+
+if __name__ == "__main__":
+    import random
+    from board import Board, play_game
+    from heuristic_agent import heuristic_factory
+
+    parser = argparse.ArgumentParser(
+        description="Per-move cost and state size with the full and the compact history"
+    )
+    parser.add_argument("--games", type=int, default=50)
+    parser.add_argument("--players", type=int, default=6)
+    parser.add_argument("--history-length", type=int, default=16)
+    parser.add_argument("--max-moves", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Cost of a move by how far into the game it is played
+    buckets = (0, 10, 20, 40, 80)
+    for history_length in (None, args.history_length):
+        board = Board(args.players, seed=args.seed, history_length=history_length)
+        rng = random.Random(args.seed)
+        times = [[] for _ in buckets]
+        move_start = [0.0]
+
+        def on_move(board):
+            now = time.perf_counter()
+            bucket = sum(board.nb_moves > start for start in buckets) - 1
+            times[bucket].append(now - move_start[0])
+            move_start[0] = now
+
+        for _ in range(args.games):
+            move_start[0] = time.perf_counter()
+            play_game(
+                board,
+                [heuristic_factory("honest", rng)] * args.players,
+                max_moves=args.max_moves,
+                on_move=on_move,
+            )
+        name = "full" if history_length is None else f"compact {history_length}"
+        costs = ", ".join(
+            f"moves {start}+: {1000 * np.mean(bucket_times):.2f} ms"
+            for start, bucket_times in zip(buckets, times)
+            if bucket_times
+        )
+        print(
+            f"{name:<11} state {board.full_state_length}x{board.state_item_width}, "
+            f"{costs}"
+        )
@@ -0,0 +1,85 @@
+import warnings
+import numpy as np
+import torch
+import torch.nn as nn
+from dqn import DQN, RecurrentDQN
+
+
+class InferencePolicy:
+    """Act-only version of a trained DQN for deployed agents: the network is
+    traced once into TorchScript, inputs are copied into preallocated buffers
+    and every call runs under torch.inference_mode"""
+
+    def __init__(
+        self,
+        policy_net: DQN | torch.jit.ScriptModule,
+        full_state_length: int,
+        state_item_width: int,
+        n_actions: int,
+        quantize: bool = False,
+        num_threads: int | None = None,
+    ):
+        if isinstance(policy_net, RecurrentDQN):
+            raise TypeError(
+                "Recurrent policies need their hidden state, "
+                "play them with agent.RecurrentCoupAgent"
+            )
+        if num_threads is not None:
+            # Actor processes usually run one game each, extra intra-op
+            # threads only add contention
+            torch.set_num_threads(num_threads)
+        self.state_buffer = torch.zeros(1, full_state_length, state_item_width)
+        self.mask_buffer = torch.zeros(n_actions, dtype=torch.bool)
+        # Masks are shared read-only arrays, they are copied through a numpy
+        # view of the buffer
+        self.mask_array = self.mask_buffer.numpy()
+        if isinstance(policy_net, torch.jit.ScriptModule):
+            self.model = policy_net
+            return
+        # No copy of the network: weights memory-mapped from a checkpoint
+        # stay shared between the processes using them
+        model = policy_net.eval()
+        with warnings.catch_warnings(), torch.inference_mode():
+            # Eager dynamic quantization and TorchScript are deprecated in
+            # favour of torchao and torch.compile but remain the lightest way
+            # to get an int8, graph-frozen Linear stack on CPU
+            warnings.simplefilter("ignore")
+            if quantize:
+                model = torch.ao.quantization.quantize_dynamic(
+                    model, {nn.Linear}, dtype=torch.qint8
+                )
+            self.model = torch.jit.freeze(
+                torch.jit.trace(model, self.state_buffer, check_trace=False)
+            )
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        full_state_length: int,
+        state_item_width: int,
+        n_actions: int,
+        num_threads: int | None = None,
+    ) -> "InferencePolicy":
+        return cls(
+            torch.jit.load(path, map_location="cpu"),
+            full_state_length,
+            state_item_width,
+            n_actions,
+            num_threads=num_threads,
+        )
+
+    def save(self, path: str):
+        torch.jit.save(self.model, path)
+
+    def q_values(self, state: np.ndarray) -> torch.Tensor:
+        with torch.inference_mode():
+            self.state_buffer[0].copy_(torch.from_numpy(state))
+            return self.model(self.state_buffer)[0]
+
+    def select_action_id(self, state: np.ndarray, action_mask: np.ndarray) -> int:
+        with torch.inference_mode():
+            self.state_buffer[0].copy_(torch.from_numpy(state))
+            np.copyto(self.mask_array, action_mask)
+            q_values = self.model(self.state_buffer)[0]
+            return q_values.masked_fill_(~self.mask_buffer, -1e9).argmax().item()
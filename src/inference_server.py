@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import queue
+import threading
+import time
+import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+import numpy as np
+import torch
+import torch.nn as nn
+from dqn import DQN
+from exploration import STRATEGIES, ActionSampler
+
+
+class InferenceRequest:
+    __slots__ = ("state", "action_mask", "epsilon", "steps", "future")
+
+    def __init__(
+        self,
+        state: np.ndarray,
+        action_mask: np.ndarray,
+        epsilon: float | None = None,
+        steps: int | None = None,
+    ):
+        self.state = state
+        self.action_mask = action_mask
+        self.epsilon = epsilon
+        # Decisions taken by the requesting agent, for epsilon schedules
+        self.steps = steps
+        self.future = Future()
+
+
+def stopped_error() -> RuntimeError:
+    return RuntimeError("The inference server is not running")
+
+
+class InferenceServer:
+    """In-process inference service shared by many concurrent games. Requests
+    are grouped into dynamic batches (up to max_batch_size, waiting at most
+    max_wait_us after the first one) and answered with a single forward pass.
+
+    It exposes the same select_action_id as InferencePolicy so it can be
+    given to CoupAgent as its inference_policy. With an ActionSampler the
+    batch explores, each request optionally carrying its own epsilon or the
+    step count a schedule is evaluated at."""
+
+    def __init__(
+        self,
+        policy_net: DQN,
+        full_state_length: int,
+        state_item_width: int,
+        n_actions: int,
+        max_batch_size: int = 64,
+        max_wait_us: int = 500,
+        quantize: bool = False,
+        num_threads: int | None = None,
+        sampler: ActionSampler | None = None,
+    ):
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.model = policy_net.eval()
+        if quantize:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                self.model = torch.ao.quantization.quantize_dynamic(
+                    self.model, {nn.Linear}, dtype=torch.qint8
+                )
+        self.sampler = sampler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_us / 1e6
+        self.state_buffer = torch.zeros(
+            max_batch_size, full_state_length, state_item_width
+        )
+        self.mask_buffer = torch.zeros(max_batch_size, n_actions, dtype=torch.bool)
+        self.mask_array = self.mask_buffer.numpy()
+        self.requests = queue.SimpleQueue()
+        self.thread = None
+        self.is_running = False
+        self.nb_requests = 0
+        self.nb_batches = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        self.is_running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        self.requests.put(None)  # wakes the serving thread up
+        self.thread.join()
+        # Requests queued while the server was stopping are never served
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None and request.future.set_running_or_notify_cancel():
+                request.future.set_exception(stopped_error())
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.nb_requests / max(1, self.nb_batches)
+
+    def submit(
+        self,
+        state: np.ndarray,
+        action_mask: np.ndarray,
+        epsilon: float | None = None,
+        steps: int | None = None,
+    ) -> Future:
+        request = InferenceRequest(state, action_mask, epsilon, steps)
+        if not self.is_running:
+            request.future.set_exception(stopped_error())
+            return request.future
+        self.requests.put(request)
+        return request.future
+
+    def select_action_id(
+        self, state: np.ndarray, action_mask: np.ndarray, steps: int | None = None
+    ) -> int:
+        # Blocking call for games running in their own thread
+        return self.submit(state, action_mask, steps=steps).result()
+
+    async def select_action_id_async(
+        self, state: np.ndarray, action_mask: np.ndarray, steps: int | None = None
+    ) -> int:
+        return await asyncio.wrap_future(self.submit(state, action_mask, steps=steps))
+
+    def collect_batch(self, first_request: InferenceRequest) -> list:
+        batch = [first_request]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = (
+                    self.requests.get(timeout=remaining)
+                    if remaining > 0
+                    else self.requests.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if request is None:
+                break
+            batch.append(request)
+        return batch
+
+    def serve(self):
+        while self.is_running:
+            request = self.requests.get()
+            if request is None:
+                continue
+            # Requests of cancelled tasks are dropped, the others can no
+            # longer be cancelled
+            batch = [
+                request
+                for request in self.collect_batch(request)
+                if request.future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+            try:
+                action_ids = self.forward_batch(batch)
+            except Exception as exception:
+                for request in batch:
+                    request.future.set_exception(exception)
+                continue
+            for request, action_id in zip(batch, action_ids):
+                request.future.set_result(action_id)
+
+    def forward_batch(self, batch: list[InferenceRequest]) -> list[int]:
+        batch_size = len(batch)
+        with torch.inference_mode():
+            for i, request in enumerate(batch):
+                self.state_buffer[i].copy_(torch.from_numpy(request.state))
+                np.copyto(self.mask_array[i], request.action_mask)
+            q_values = self.model(self.state_buffer[:batch_size])
+            if self.sampler is None:
+                q_values.masked_fill_(~self.mask_buffer[:batch_size], -1e9)
+                action_ids = q_values.argmax(dim=1).tolist()
+            else:
+                # Requests without a step count are at the start of a schedule
+                steps = torch.tensor(
+                    [request.steps or 0 for request in batch], dtype=torch.int64
+                )
+                # The sampler's epsilon for the rows not carrying their own
+                epsilon = self.sampler.row_epsilons(steps).expand(batch_size).clone()
+                for i, request in enumerate(batch):
+                    if request.epsilon is not None:
+                        epsilon[i] = request.epsilon
+                action_ids = self.sampler.sample(
+                    q_values, self.mask_buffer[:batch_size], epsilon, steps
+                ).tolist()
+        self.nb_requests += batch_size
+        self.nb_batches += 1
+        return action_ids
+
+
+def play_concurrent_games(
+    server: InferenceServer, nb_games: int, nb_threads: int, nb_players: int = 4
+) -> int:
+    """Play headless games in nb_threads threads, every agent querying the
+    shared server. Returns the number of moves played"""
+    from agent import CoupAgent
+    from board import Board, play_game
+
+    def play(seed: int) -> int:
+        board = Board(nb_players, seed=seed)
+        agent_factories = [partial(CoupAgent, inference_policy=server)] * nb_players
+        _, n_moves, _ = play_game(board, agent_factories)
+        return n_moves
+
+    with ThreadPoolExecutor(nb_threads) as executor:
+        return sum(executor.map(play, range(nb_games)))
+
+
+if __name__ == "__main__":
+    from action import get_nb_actions
+    from board import Board
+
+    parser = argparse.ArgumentParser(description="Batched inference throughput")
+    parser.add_argument("--games", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-us", type=int, default=500)
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--exploration", default=None, choices=STRATEGIES)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    torch.manual_seed(args.seed)
+
+    board = Board(args.players)
+    server = InferenceServer(
+        DQN(board.full_state_length, board.state_item_width, args.players),
+        board.full_state_length,
+        board.state_item_width,
+        get_nb_actions(args.players),
+        max_batch_size=args.max_batch_size,
+        max_wait_us=args.max_wait_us,
+        quantize=args.quantize,
+        sampler=ActionSampler(args.exploration, seed=args.seed)
+        if args.exploration is not None
+        else None,
+    )
+    start_time = time.perf_counter()
+    with server:
+        n_moves = play_concurrent_games(server, args.games, args.threads, args.players)
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"{args.games / elapsed:.1f} games/s, {n_moves / elapsed:.1f} moves/s, "
+        f"{server.nb_requests / elapsed:.1f} decisions/s, "
+        f"mean batch size {server.mean_batch_size:.1f}"
+    )
@@ -0,0 +1,262 @@
+import argparse
+import os
+import random
+import time
+from collections import OrderedDict
+from functools import partial
+from pydantic import BaseModel
+import checkpoint
+from action import get_nb_actions
+from agent import CoupAgent
+from board import Board, play_game
+from inference import InferencePolicy
+
+LEARNER = "learner"
+
+
+class OpponentRecord(BaseModel):
+    checkpoint_id: str
+    n_games: int = 0
+    score: float = 0.0  # results against the learner, 1 per win, 0.5 per tie
+
+    @property
+    def win_rate(self) -> float:
+        # Smoothed towards 0.5 so unplayed opponents are not starved
+        return (self.score + 1) / (self.n_games + 2)
+
+
+class PolicyCache:
+    """LRU cache of inference-optimized frozen policies with a memory cap.
+    Weights are memory-mapped from the checkpoint files, so an evicted
+    policy costs one mapping and one trace to bring back"""
+
+    def __init__(
+        self,
+        models_path: str,
+        max_bytes: int = 1 << 30,
+        quantize: bool = False,
+        num_threads: int | None = None,
+    ):
+        self.models_path = models_path
+        self.max_bytes = max_bytes
+        self.quantize = quantize
+        self.num_threads = num_threads
+        self.policies: OrderedDict[str, tuple[InferencePolicy, int]] = OrderedDict()
+        self.nb_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.policies)
+
+    def __contains__(self, checkpoint_id: str) -> bool:
+        return checkpoint_id in self.policies
+
+    def get(self, checkpoint_id: str) -> InferencePolicy:
+        if checkpoint_id in self.policies:
+            self.hits += 1
+            self.policies.move_to_end(checkpoint_id)
+            return self.policies[checkpoint_id][0]
+        self.misses += 1
+        policy, nb_bytes = self.load(checkpoint_id)
+        self.policies[checkpoint_id] = (policy, nb_bytes)
+        self.nb_bytes += nb_bytes
+        # The policy just loaded stays even if it alone exceeds the cap
+        while self.nb_bytes > self.max_bytes and len(self.policies) > 1:
+            _, (_, evicted_bytes) = self.policies.popitem(last=False)
+            self.nb_bytes -= evicted_bytes
+            self.evictions += 1
+        return policy
+
+    def load(self, checkpoint_id: str) -> tuple[InferencePolicy, int]:
+        checkpoint_path = os.path.join(self.models_path, checkpoint_id)
+        entry = checkpoint.ModelRegistry(self.models_path).get(checkpoint_id)
+        policy = InferencePolicy(
+            checkpoint.load_policy_net(checkpoint_path),
+            entry.full_state_length,
+            entry.state_item_width,
+            get_nb_actions(entry.nb_players),
+            quantize=self.quantize,
+            num_threads=self.num_threads,
+        )
+        # The weights file size is the memory estimate, mapped pages
+        # included since they count towards the page cache
+        nb_bytes = os.path.getsize(
+            os.path.join(checkpoint_path, checkpoint.POLICY_FILE)
+        )
+        return policy, nb_bytes
+
+
+class League:
+    """Fills the seats of each game with the learner and frozen past
+    policies from the model registry. Opponents are drawn with prioritized
+    fictitious self-play: the better an opponent does against the learner,
+    the more often it is picked"""
+
+    def __init__(
+        self,
+        learner_factory,
+        nb_players: int = 4,
+        models_path: str = "models",
+        max_cache_bytes: int = 1 << 30,
+        self_play_probability: float = 0.2,
+        weighting: str = "hard",
+        exponent: float = 2.0,
+        quantize: bool = False,
+        history_length: int | None = None,
+        seed: int | None = None,
+    ):
+        # learner_factory has the agent factory signature and builds the
+        # agents of the policy being trained
+        self.learner_factory = learner_factory
+        self.nb_players = nb_players
+        self.history_length = history_length
+        # Shape of the states of the league's boards, which frozen policies
+        # have to read
+        board = Board(nb_players, history_length=history_length)
+        self.full_state_length = board.full_state_length
+        self.state_item_width = board.state_item_width
+        self.models_path = models_path
+        self.self_play_probability = self_play_probability
+        self.weighting = weighting
+        self.exponent = exponent
+        self.rng = random.Random(seed)
+        self.cache = PolicyCache(models_path, max_cache_bytes, quantize)
+        self.records: dict[str, OpponentRecord] = {}
+        self.refresh()
+
+    def is_playable(self, entry: checkpoint.CheckpointEntry) -> bool:
+        # Frozen seats are played by an InferencePolicy, which takes neither
+        # recurrent nets nor the states of another board
+        return (
+            entry.architecture == "dqn"
+            and entry.nb_players == self.nb_players
+            and entry.full_state_length == self.full_state_length
+            and entry.state_item_width == self.state_item_width
+        )
+
+    def refresh(self):
+        # Picks up the checkpoints added to the registry since the last call
+        for entry in checkpoint.ModelRegistry(self.models_path).entries():
+            if entry.id not in self.records and self.is_playable(entry):
+                self.records[entry.id] = OpponentRecord(checkpoint_id=entry.id)
+
+    def add_snapshot(self, agent: CoupAgent, step: int, **kwargs) -> str:
+        """Freeze the learner into the pool"""
+        checkpoint_id = f"step_{step}"
+        checkpoint.save_checkpoint(
+            agent, checkpoint_id, step, self.models_path, **kwargs
+        )
+        self.refresh()
+        return checkpoint_id
+
+    def priority(self, record: OpponentRecord) -> float:
+        win_rate = record.win_rate
+        if self.weighting == "hard":
+            return win_rate**self.exponent
+        if self.weighting == "variance":
+            return win_rate * (1 - win_rate)
+        return 1.0
+
+    def sample_seats(self) -> list[str]:
+        """Seat assignment of a game, LEARNER or a checkpoint id per seat"""
+        records = list(self.records.values())
+        weights = [self.priority(record) for record in records]
+        learner_seat = self.rng.randrange(self.nb_players)
+        seats = []
+        for seat in range(self.nb_players):
+            if (
+                seat == learner_seat
+                or not records
+                or self.rng.random() < self.self_play_probability
+            ):
+                seats.append(LEARNER)
+            else:
+                seats.append(self.rng.choices(records, weights)[0].checkpoint_id)
+        return seats
+
+    def agent_factories(self, seats: list[str]) -> list:
+        return [
+            self.learner_factory
+            if seat == LEARNER
+            else partial(CoupAgent, inference_policy=self.cache.get(seat))
+            for seat in seats
+        ]
+
+    def play_game(self, board: Board | None = None, max_moves: int = 500):
+        """Play one league game and update the opponent records. Returns the
+        seats and the result of board.play_game"""
+        if board is None:
+            board = Board(self.nb_players, history_length=self.history_length)
+        seats = self.sample_seats()
+        placements, n_moves, completed = play_game(
+            board, self.agent_factories(seats), max_moves
+        )
+        self.update(seats, placements)
+        return seats, placements, n_moves, completed
+
+    def update(self, seats: list[str], placements: list[int]):
+        learner_placements = [
+            placement for seat, placement in zip(seats, placements) if seat == LEARNER
+        ]
+        for seat, placement in zip(seats, placements):
+            if seat == LEARNER:
+                continue
+            record = self.records[seat]
+            for learner_placement in learner_placements:
+                record.n_games += 1
+                if placement < learner_placement:
+                    record.score += 1
+                elif placement == learner_placement:
+                    record.score += 0.5
+
+    def __str__(self):
+        lines = [f"{'opponent':<20} {'games':>7} {'win rate':>9} {'priority':>9}"]
+        for record in sorted(self.records.values(), key=lambda r: -r.win_rate):
+            lines.append(
+                f"{record.checkpoint_id:<20} {record.n_games:>7} "
+                f"{record.win_rate:>9.3f} {self.priority(record):>9.3f}"
+            )
+        lines.append(
+            f"cache: {len(self.cache)} policies, {self.cache.nb_bytes / 2**20:.0f} MB, "
+            f"{self.cache.hits} hits, {self.cache.misses} misses, "
+            f"{self.cache.evictions} evictions"
+        )
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import torch
+    from dqn import DQN
+
+    parser = argparse.ArgumentParser(description="League games against past policies")
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--models-path", default="models")
+    parser.add_argument("--cache-mb", type=int, default=1024)
+    parser.add_argument(
+        "--weighting", default="hard", choices=["hard", "variance", "uniform"]
+    )
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    torch.manual_seed(args.seed)
+
+    board = Board(args.players)
+    learner_net = DQN(board.full_state_length, board.state_item_width, args.players)
+    league = League(
+        partial(CoupAgent, policy_net=learner_net),
+        args.players,
+        args.models_path,
+        max_cache_bytes=args.cache_mb << 20,
+        weighting=args.weighting,
+        quantize=args.quantize,
+        seed=args.seed,
+    )
+    start_time = time.perf_counter()
+    for game in range(args.games):
+        league.play_game(Board(args.players, seed=args.seed + game))
+    elapsed = time.perf_counter() - start_time
+    print(league)
+    print(f"{args.games / elapsed:.1f} games/s")
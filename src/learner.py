@@ -0,0 +1,351 @@
+import argparse
+import threading
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from dqn import DQN, RecurrentDQN
+from exploration import masked_logits
+from prefetch import Prefetcher
+from replay import PrioritizedReplayBuffer, ReplayBuffer
+
+# Row b holds the 8 bits of byte b as floats, most significant first like
+# np.unpackbits, so expanding packed states is one np.take into the batch
+UNPACK_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(
+    np.float32
+)
+# Replay fields copied as they are, with the dtype of their batch tensor
+ROW_FIELDS = {
+    "action_masks": torch.bool,
+    "next_action_masks": torch.bool,
+    "actions": torch.int64,
+    "rewards": torch.float32,
+    "dones": torch.bool,
+    "discounts": torch.float32,
+}
+# Recurrent contexts stored by buffers with a hidden_dim, the history rows
+# are bit-packed and expanded like the states
+RECURRENT_FIELDS = {
+    "hidden_states": torch.float32,
+    "next_hidden_states": torch.float32,
+    "history_lengths": torch.int64,
+    "next_history_lengths": torch.int64,
+}
+PACKED_HISTORY_FIELDS = ("history_rows", "next_history_rows")
+
+
+class BatchSlot:
+    """Preallocated tensors of one batch and the scratch arrays they are
+    filled from. Tensors and arrays share their memory, so a batch is
+    written in place and handed to torch without a copy"""
+
+    def __init__(self, buffer: ReplayBuffer, batch_size: int, pin_memory: bool):
+        full_state_length, packed_width = buffer.states.shape[1:]
+        shapes = {
+            "states": (full_state_length, buffer.state_item_width),
+            "next_states": (full_state_length, buffer.state_item_width),
+            "action_masks": buffer.action_masks.shape[1:],
+            "next_action_masks": buffer.next_action_masks.shape[1:],
+            "weights": (),
+            "indices": (),
+        }
+        dtypes = {
+            "states": torch.float32,
+            "next_states": torch.float32,
+            "weights": torch.float32,
+            "indices": torch.int64,
+        } | ROW_FIELDS
+        packed_shapes = {
+            "states": (full_state_length, packed_width),
+            "next_states": (full_state_length, packed_width),
+        }
+        if buffer.hidden_dim:
+            dtypes |= RECURRENT_FIELDS
+            shapes["hidden_states"] = shapes["next_hidden_states"] = (
+                buffer.hidden_dim,
+            )
+            for field in PACKED_HISTORY_FIELDS:
+                shapes[field] = (buffer.history_window, buffer.state_item_width)
+                dtypes[field] = torch.float32
+                packed_shapes[field] = (buffer.history_window, packed_width)
+        self.tensors = {
+            field: torch.empty(
+                (batch_size, *shapes.get(field, ())),
+                dtype=dtype,
+                pin_memory=pin_memory,
+            )
+            for field, dtype in dtypes.items()
+        }
+        self.arrays = {field: tensor.numpy() for field, tensor in self.tensors.items()}
+        self.packed = {
+            field: np.empty((batch_size, *shape), dtype=np.uint8)
+            for field, shape in packed_shapes.items()
+        }
+
+
+class BatchPipeline(Prefetcher):
+    """Endless training batches of a replay buffer, prepared ahead of the
+    learner by a thread pool. Each batch is sampled, its bit-packed rows
+    gathered with np.take and its states expanded to float32 straight into
+    one of nb_slots reusable (pinned when a GPU is present) slots, so a
+    training step pays no Python collation and no allocation. A batch stays
+    valid until the next one is requested: with two slots the learner reads
+    one while the other is filled.
+
+    Sampling and gathering hold lock, which writers adding to the buffer
+    from other threads should hold too. Expanding the states, most of the
+    work, runs outside of it"""
+
+    def __init__(
+        self,
+        buffer: ReplayBuffer,
+        batch_size: int = 256,
+        nb_threads: int = 2,
+        nb_slots: int = 2,
+        seed: int = 0,
+        pin_memory: bool | None = None,
+    ):
+        # One batch in flight per slot: the slot of the batch the learner
+        # is done with is refilled, the others are already being filled
+        super().__init__(nb_threads, nb_slots, seed)
+        if pin_memory is None:
+            pin_memory = torch.cuda.is_available()
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.slots = [
+            BatchSlot(buffer, batch_size, pin_memory) for _ in range(nb_slots)
+        ]
+
+    def load(
+        self, batch_index: int, rng: np.random.Generator
+    ) -> dict[str, torch.Tensor]:
+        slot = self.slots[batch_index % len(self.slots)]
+        buffer, arrays = self.buffer, slot.arrays
+        with self.lock:
+            indices, weights = buffer.sample_indices(self.batch_size, rng)
+            for field, packed in slot.packed.items():
+                np.take(
+                    getattr(buffer, field), indices, axis=0, out=packed, mode="clip"
+                )
+            for field in (*ROW_FIELDS, *RECURRENT_FIELDS):
+                if field in arrays:
+                    np.take(
+                        getattr(buffer, field),
+                        indices,
+                        axis=0,
+                        out=arrays[field],
+                        mode="clip",
+                    )
+        arrays["indices"][:] = indices
+        arrays["weights"][:] = 1.0 if weights is None else weights
+        for field, packed in slot.packed.items():
+            np.take(
+                UNPACK_TABLE,
+                packed,
+                axis=0,
+                out=arrays[field].reshape(*packed.shape, 8),
+                mode="clip",
+            )
+        return slot.tensors
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray):
+        with self.lock:
+            self.buffer.update_priorities(indices, td_errors)
+
+
+def batch_q_values(
+    net: DQN | RecurrentDQN, batch: dict[str, torch.Tensor], prefix: str = ""
+) -> torch.Tensor:
+    # A recurrent net reads the static rows of the states instead of the
+    # histories, and re-encodes the history rows stored with them so that
+    # its history encoder is trained too
+    states = batch[f"{prefix}states"]
+    if isinstance(net, RecurrentDQN):
+        hidden_states = net.encode_history_window(
+            batch[f"{prefix}history_rows"],
+            batch[f"{prefix}history_lengths"],
+            batch[f"{prefix}hidden_states"],
+        )
+        return net(states[:, : net.static_state_length], hidden_states)
+    return net(states)
+
+
+def td_loss(
+    policy_net: DQN | RecurrentDQN,
+    target_net: DQN | RecurrentDQN,
+    batch: dict[str, torch.Tensor],
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """Double DQN loss of a batch: the next action is the best legal one for
+    policy_net, valued by target_net. Huber loss weighted by the importance
+    weights, returned with the TD errors"""
+    q_values = batch_q_values(policy_net, batch).gather(1, batch["actions"][:, None])[
+        :, 0
+    ]
+    with torch.no_grad():
+        next_actions = masked_logits(
+            batch_q_values(policy_net, batch, "next_"), batch["next_action_masks"]
+        ).argmax(dim=1)
+        next_q_values = batch_q_values(target_net, batch, "next_").gather(
+            1, next_actions[:, None]
+        )[:, 0]
+        # Terminal transitions have no legal next action to bootstrap from
+        next_q_values = torch.where(batch["dones"], 0.0, next_q_values)
+        targets = batch["rewards"] + batch["discounts"] * next_q_values
+    losses = F.smooth_l1_loss(q_values, targets, reduction="none")
+    return (batch["weights"] * losses).mean(), (targets - q_values).detach()
+
+
+class Learner:
+    """DQN training loop fed by a BatchPipeline, recurrent nets train on the
+    hidden states stored in the buffer. Priorities are updated
+    with the TD errors of each batch when the buffer is prioritized, the
+    target net is synced every target_sync_every steps"""
+
+    def __init__(
+        self,
+        policy_net: DQN | RecurrentDQN,
+        target_net: DQN | RecurrentDQN,
+        pipeline: BatchPipeline,
+        learning_rate: float = 1e-4,
+        target_sync_every: int = 1000,
+    ):
+        buffer = pipeline.buffer
+        if isinstance(policy_net, RecurrentDQN) and (
+            buffer.hidden_dim != policy_net.hidden_dim or not buffer.history_window
+        ):
+            # Without history rows to re-encode the encoder gets no gradient
+            raise ValueError(
+                f"A recurrent net of hidden size {policy_net.hidden_dim} needs a "
+                f"buffer storing hidden states of that size and history rows, not "
+                f"{buffer.hidden_dim} and a window of {buffer.history_window}"
+            )
+        self.policy_net = policy_net
+        self.target_net = target_net
+        self.pipeline = pipeline
+        self.optimizer = torch.optim.Adam(policy_net.parameters(), lr=learning_rate)
+        self.target_sync_every = target_sync_every
+        self.is_prioritized = isinstance(pipeline.buffer, PrioritizedReplayBuffer)
+        self.nb_steps = 0
+
+    def step(self) -> float:
+        batch = next(self.pipeline)
+        loss, td_errors = td_loss(self.policy_net, self.target_net, batch)
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
+        if self.is_prioritized:
+            self.pipeline.update_priorities(batch["indices"].numpy(), td_errors.numpy())
+        self.nb_steps += 1
+        if self.nb_steps % self.target_sync_every == 0:
+            self.target_net.load_state_dict(self.policy_net.state_dict())
+        return loss.item()
+
+
+if __name__ == "__main__":
+    import random
+    from action import get_nb_actions
+    from agent import RecurrentCoupAgent
+    from base_agent import RandomAgent
+    from board import Board, play_game
+
+    parser = argparse.ArgumentParser(
+        description="Training steps per second with and without the batch pipeline"
+    )
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--slots", type=int, default=2)
+    parser.add_argument("--prioritized", action="store_true")
+    parser.add_argument(
+        "--recurrent",
+        action="store_true",
+        help="Train a RecurrentDQN on transitions recorded with their hidden states",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    torch.manual_seed(args.seed)
+
+    board = Board(args.players, seed=args.seed)
+    if args.recurrent:
+        static_state_length = 2 + 2 * args.players
+        policy_net, target_net = (
+            RecurrentDQN(static_state_length, board.state_item_width, args.players)
+            for _ in range(2)
+        )
+    else:
+        policy_net, target_net = (
+            DQN(board.full_state_length, board.state_item_width, args.players)
+            for _ in range(2)
+        )
+    target_net.load_state_dict(policy_net.state_dict())
+    buffer_class = PrioritizedReplayBuffer if args.prioritized else ReplayBuffer
+    buffer = buffer_class(
+        1 << 16,
+        board.full_state_length,
+        board.state_item_width,
+        get_nb_actions(args.players),
+        hidden_dim=policy_net.hidden_dim if args.recurrent else 0,
+    )
+    rng = random.Random(args.seed)
+
+    def recording(player, full_state_length, state_item_width, nb_players):
+        if args.recurrent:
+            # Greedy players sharing the recurrent net record its hidden states
+            agent = RecurrentCoupAgent(
+                player,
+                full_state_length,
+                state_item_width,
+                nb_players,
+                policy_net=policy_net,
+            )
+        else:
+            agent = RandomAgent(
+                player, full_state_length, state_item_width, nb_players, rng=rng
+            )
+        agent.replay_buffer = buffer
+        return agent
+
+    for _ in range(args.games):
+        placements, _, _ = play_game(board, [recording] * args.players)
+        for agent, placement in zip(board.agents, placements):
+            agent.end_episode(1.0 if placement == 1 else -1.0)
+    print(f"{len(buffer)} transitions from {args.games} games")
+
+    # Baseline: the learner samples and collates each batch itself
+    optimizer = torch.optim.Adam(policy_net.parameters(), lr=1e-4)
+    sample_rng = np.random.default_rng(args.seed)
+    collation_time = 0.0
+    start_time = time.perf_counter()
+    for _ in range(args.steps):
+        collation_start = time.perf_counter()
+        batch = buffer.sample(args.batch_size, sample_rng)
+        batch = {field: torch.from_numpy(np.asarray(batch[field])) for field in batch}
+        batch.setdefault("weights", torch.ones(args.batch_size))
+        collation_time += time.perf_counter() - collation_start
+        loss, _ = td_loss(policy_net, target_net, batch)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"inline sampling: {args.steps / elapsed:.1f} steps/s, "
+        f"collating took {100 * collation_time / elapsed:.0f}% of the time"
+    )
+
+    with BatchPipeline(
+        buffer, args.batch_size, args.threads, args.slots, args.seed
+    ) as pipeline:
+        learner = Learner(policy_net, target_net, pipeline)
+        learner.step()
+        pipeline.wait_time = 0.0
+        start_time = time.perf_counter()
+        for _ in range(args.steps):
+            learner.step()
+        elapsed = time.perf_counter() - start_time
+        print(
+            f"batch pipeline: {args.steps / elapsed:.1f} steps/s, "
+            f"waited for batches {100 * pipeline.wait_time / elapsed:.0f}% of the time"
+        )
@@ -0,0 +1,336 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+import numpy as np
+from action import MAX_PLAYERS, ActionType
+
+NB_ACTION_TYPES = len(ActionType)
+LENGTH_BIN_WIDTH = 5
+NB_LENGTH_BINS = 101  # the last bin counts games of 500 moves or more
+COIN_HORIZON = 200  # coin trajectories are kept for the first moves of a game
+MAX_AGENT_KINDS = 16  # columns of the on-disk series, extra kinds share the last
+
+
+class NullMetrics:
+    # Default metrics, every hook is a no-op so games not measured pay a call
+    enabled = False
+
+    def start_game(self, board):
+        pass
+
+    def claim(self, player, action):
+        pass
+
+    def challenge(
+        self, action_type: ActionType, is_bluffing: bool, challenger, claimant
+    ):
+        pass
+
+    def steal(self, player, target, amount: int):
+        pass
+
+    def end_move(self, board):
+        pass
+
+    def end_game(self, board, placements: list[int], n_moves: int, completed: bool):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def agent_kind(agent) -> str:
+    return getattr(agent, "kind", type(agent).__name__)
+
+
+class GameMetrics:
+    """Bounded-memory aggregates of any number of games: counters,
+    fixed-bin histograms and per-move coin sums, no per-game record. Two
+    aggregates merge by addition, so workers can each keep one and ship it
+    to a parent that merges and flushes them to a MetricsSeries"""
+
+    enabled = True
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.n_games = 0
+        self.n_completed = 0
+        self.n_moves = 0
+        self.seat_games = np.zeros(MAX_PLAYERS, dtype=np.int64)
+        self.seat_wins = np.zeros(MAX_PLAYERS, dtype=np.int64)
+        self.agent_games = Counter()
+        self.agent_wins = Counter()
+        self.length_histogram = np.zeros(NB_LENGTH_BINS, dtype=np.int64)
+        # Per ActionType: claims of a character (actions and counters), how
+        # many were bluffs, how many were challenged and how many of these
+        # challenges caught a bluff
+        self.claims = np.zeros(NB_ACTION_TYPES, dtype=np.int64)
+        self.bluffs = np.zeros(NB_ACTION_TYPES, dtype=np.int64)
+        self.challenges = np.zeros(NB_ACTION_TYPES, dtype=np.int64)
+        self.caught = np.zeros(NB_ACTION_TYPES, dtype=np.int64)
+        # Coins of the alive players after each move, as count, sum and sum
+        # of squares per move index for the mean and spread
+        self.coin_count = np.zeros(COIN_HORIZON, dtype=np.int64)
+        self.coin_sum = np.zeros(COIN_HORIZON, dtype=np.int64)
+        self.coin_sum_sq = np.zeros(COIN_HORIZON, dtype=np.int64)
+
+    # Board hooks
+
+    def start_game(self, board):
+        pass
+
+    def claim(self, player, action):
+        self.claims[action.action_type.value] += 1
+        if player.is_bluffing(action)[0]:
+            self.bluffs[action.action_type.value] += 1
+
+    def challenge(
+        self, action_type: ActionType, is_bluffing: bool, challenger, claimant
+    ):
+        self.challenges[action_type.value] += 1
+        if is_bluffing:
+            self.caught[action_type.value] += 1
+
+    def steal(self, player, target, amount: int):
+        pass
+
+    def end_move(self, board):
+        move = board.nb_moves - 1
+        if move < COIN_HORIZON:
+            for player in board.alive_players:
+                self.coin_count[move] += 1
+                self.coin_sum[move] += player.coins
+                self.coin_sum_sq[move] += player.coins * player.coins
+
+    def end_game(self, board, placements: list[int], n_moves: int, completed: bool):
+        self.n_games += 1
+        self.n_completed += completed
+        self.n_moves += n_moves
+        self.length_histogram[min(n_moves // LENGTH_BIN_WIDTH, NB_LENGTH_BINS - 1)] += 1
+        for seat, (agent, placement) in enumerate(zip(board.agents, placements)):
+            is_winner = completed and placement == 1
+            self.seat_games[seat] += 1
+            self.seat_wins[seat] += is_winner
+            kind = agent_kind(agent)
+            self.agent_games[kind] += 1
+            self.agent_wins[kind] += is_winner
+
+    def merge(self, other: "GameMetrics") -> "GameMetrics":
+        self.n_games += other.n_games
+        self.n_completed += other.n_completed
+        self.n_moves += other.n_moves
+        self.agent_games.update(other.agent_games)
+        self.agent_wins.update(other.agent_wins)
+        for name in (
+            "seat_games",
+            "seat_wins",
+            "length_histogram",
+            "claims",
+            "bluffs",
+            "challenges",
+            "caught",
+            "coin_count",
+            "coin_sum",
+            "coin_sum_sq",
+        ):
+            getattr(self, name).__iadd__(getattr(other, name))
+        return self
+
+    def length_quantile(self, q: float) -> float:
+        # Upper edge of the histogram bin holding the quantile
+        cumulative = np.cumsum(self.length_histogram)
+        if cumulative[-1] == 0:
+            return 0.0
+        return float(
+            (np.searchsorted(cumulative, q * cumulative[-1]) + 1) * LENGTH_BIN_WIDTH
+        )
+
+    def summary(self) -> dict:
+        def rate(numerator, denominator):
+            return float(numerator / denominator) if denominator else None
+
+        coin_mean = self.coin_sum / np.maximum(1, self.coin_count)
+        coin_std = np.sqrt(
+            np.maximum(
+                0, self.coin_sum_sq / np.maximum(1, self.coin_count) - coin_mean**2
+            )
+        )
+        return {
+            "games": self.n_games,
+            "completed": rate(self.n_completed, self.n_games),
+            "mean_length": rate(self.n_moves, self.n_games),
+            "length_p50": self.length_quantile(0.5),
+            "length_p90": self.length_quantile(0.9),
+            "seat_win_rates": [
+                rate(wins, games)
+                for wins, games in zip(self.seat_wins, self.seat_games)
+                if games
+            ],
+            "agent_win_rates": {
+                kind: rate(self.agent_wins[kind], games)
+                for kind, games in self.agent_games.items()
+            },
+            "claims": {
+                action_type.name: {
+                    "count": int(self.claims[action_type.value]),
+                    "bluff_rate": rate(
+                        self.bluffs[action_type.value], self.claims[action_type.value]
+                    ),
+                    "challenge_rate": rate(
+                        self.challenges[action_type.value],
+                        self.claims[action_type.value],
+                    ),
+                    "challenge_success_rate": rate(
+                        self.caught[action_type.value],
+                        self.challenges[action_type.value],
+                    ),
+                }
+                for action_type in ActionType
+                if self.claims[action_type.value]
+            },
+            "coins_by_move": {
+                move: (
+                    round(float(coin_mean[move]), 2),
+                    round(float(coin_std[move]), 2),
+                )
+                for move in range(0, COIN_HORIZON, 10)
+                if self.coin_count[move]
+            },
+        }
+
+
+SERIES_DTYPE = np.dtype(
+    [
+        ("time", np.float64),
+        ("n_games", np.int64),
+        ("n_completed", np.int64),
+        ("n_moves", np.int64),
+        ("seat_games", np.int64, MAX_PLAYERS),
+        ("seat_wins", np.int64, MAX_PLAYERS),
+        ("agent_games", np.int64, MAX_AGENT_KINDS),
+        ("agent_wins", np.int64, MAX_AGENT_KINDS),
+        ("length_histogram", np.int64, NB_LENGTH_BINS),
+        ("claims", np.int64, NB_ACTION_TYPES),
+        ("bluffs", np.int64, NB_ACTION_TYPES),
+        ("challenges", np.int64, NB_ACTION_TYPES),
+        ("caught", np.int64, NB_ACTION_TYPES),
+        ("coin_count", np.int64, COIN_HORIZON),
+        ("coin_sum", np.int64, COIN_HORIZON),
+        ("coin_sum_sq", np.int64, COIN_HORIZON),
+    ]
+)
+
+
+class MetricsSeries:
+    """Append-only time series of metrics on disk: one fixed-size binary
+    record per flush holding the aggregates of the games played since the
+    previous one, readable with numpy.fromfile. Agent kinds get a column
+    each, listed in order in a JSON sidecar"""
+
+    def __init__(self, path: str, period: float = 60.0):
+        self.path = path
+        self.kinds_path = path + ".kinds.json"
+        self.period = period
+        self.last_flush = time.time()
+        self.kinds = []
+        if os.path.exists(self.kinds_path):
+            with open(self.kinds_path) as f:
+                self.kinds = json.load(f)
+
+    def kind_column(self, kind: str) -> int:
+        if kind not in self.kinds:
+            if len(self.kinds) == MAX_AGENT_KINDS - 1:
+                return MAX_AGENT_KINDS - 1
+            self.kinds.append(kind)
+            with open(self.kinds_path, "w") as f:
+                json.dump(self.kinds, f)
+        return self.kinds.index(kind)
+
+    def flush(self, metrics: GameMetrics):
+        """Write the aggregates as one record and clear them"""
+        record = np.zeros(1, SERIES_DTYPE)
+        record["time"] = time.time()
+        for name in SERIES_DTYPE.names:
+            if name not in ("time", "agent_games", "agent_wins"):
+                record[name] = getattr(metrics, name)
+        for kind, games in metrics.agent_games.items():
+            column = self.kind_column(kind)
+            record["agent_games"][0, column] += games
+            record["agent_wins"][0, column] += metrics.agent_wins[kind]
+        with open(self.path, "ab") as f:
+            record.tofile(f)
+        metrics.clear()
+        self.last_flush = time.time()
+
+    def maybe_flush(self, metrics: GameMetrics):
+        if time.time() - self.last_flush >= self.period:
+            self.flush(metrics)
+
+    def read(self) -> np.ndarray:
+        return np.fromfile(self.path, dtype=SERIES_DTYPE)
+
+    def total(self, records: np.ndarray) -> GameMetrics:
+        """Merge records of the series (all of them, or a time window) back
+        into one aggregate"""
+        metrics = GameMetrics()
+        for name in SERIES_DTYPE.names:
+            if name not in ("time", "agent_games", "agent_wins"):
+                setattr(metrics, name, records[name].sum(axis=0))
+        for name in ("n_games", "n_completed", "n_moves"):
+            setattr(metrics, name, int(getattr(metrics, name)))
+        for column, kind in enumerate(self.kinds):
+            metrics.agent_games[kind] = int(records["agent_games"][:, column].sum())
+            metrics.agent_wins[kind] = int(records["agent_wins"][:, column].sum())
+        return metrics
+
+
+def play_games(nb_games: int, nb_players: int, seed: int) -> GameMetrics:
+    # Rules-only worker: random agents, no torch import
+    import random
+    from functools import partial
+    from base_agent import RandomAgent
+    from board import Board, play_game
+
+    metrics = GameMetrics()
+    rng = random.Random(seed)
+    board = Board(nb_players, seed=seed, metrics=metrics)
+    for _ in range(nb_games):
+        play_game(board, [partial(RandomAgent, rng=rng)] * nb_players)
+    return metrics
+
+
+def play_task(task: tuple) -> GameMetrics:
+    return play_games(*task)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming metrics of headless games")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=50, help="games per worker task")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--series", default="metrics.bin")
+    parser.add_argument("--period", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    series = MetricsSeries(args.series, args.period)
+    pending = GameMetrics()
+    nb_tasks = -(-args.games // args.batch)
+    tasks = [
+        (min(args.batch, args.games - i * args.batch), args.players, args.seed + i)
+        for i in range(nb_tasks)
+    ]
+    with multiprocessing.Pool(args.workers) as pool:
+        for worker_metrics in pool.imap_unordered(play_task, tasks):
+            pending.merge(worker_metrics)
+            series.maybe_flush(pending)
+    series.flush(pending)
+    records = series.read()
+    print(json.dumps(series.total(records).summary(), indent=2))
+    print(f"{len(records)} records in {args.series}")
@@ -23,12 +23,7 @@ class Player(BaseModel):
                     if card.character == Character.DUKE and not card.is_revealed:
                         return False, card
                 return True, None
-            case (
-                ActionType.ASSASSIN_TARGET_PLAYER_0
-                | ActionType.ASSASSIN_TARGET_PLAYER_1
-                | ActionType.ASSASSIN_TARGET_PLAYER_2
-                | ActionType.ASSASSIN_TARGET_PLAYER_3
-            ):
+            case ActionType.ASSASSIN:
                 for card in self.hand:
                     if card.character == Character.ASSASSIN and not card.is_revealed:
                         return False, card
@@ -38,13 +33,7 @@ class Player(BaseModel):
                     if card.character == Character.AMBASSADOR and not card.is_revealed:
                         return False, card
                 return True, None
-            case (
-                ActionType.CAPTAIN_TARGET_PLAYER_0
-                | ActionType.CAPTAIN_TARGET_PLAYER_1
-                | ActionType.CAPTAIN_TARGET_PLAYER_2
-                | ActionType.CAPTAIN_TARGET_PLAYER_3
-                | ActionType.COUNTER_CAPTAIN_WITH_CAPTAIN
-            ):
+            case ActionType.CAPTAIN | ActionType.COUNTER_CAPTAIN_WITH_CAPTAIN:
                 for card in self.hand:
                     if card.character == Character.CAPTAIN and not card.is_revealed:
                         return False, card
@@ -58,10 +47,7 @@ class Player(BaseModel):
                 ActionType.CHALLENGE
                 | ActionType.REVENUE
                 | ActionType.FOREIGN_AID
-                | ActionType.COUP_TARGET_PLAYER_0
-                | ActionType.COUP_TARGET_PLAYER_1
-                | ActionType.COUP_TARGET_PLAYER_2
-                | ActionType.COUP_TARGET_PLAYER_3
+                | ActionType.COUP
                 | ActionType.DO_NOTHING
                 | ActionType.REVEAL_CARD_1
                 | ActionType.REVEAL_CARD_2
@@ -71,7 +57,6 @@ class Player(BaseModel):
                 | ActionType.DISCARD_DUKE
                 | ActionType.DISCARD_CONTESSA
             ):
-                print(f"Action {action.action_type} is not a bluff")
                 return False, None
             case _:
                 return ValueError(f"Unknown action type: {action.action_type}")
@@ -97,9 +82,7 @@ class Player(BaseModel):
         self.update_coup_status()
 
     def lose_coins(self, amount: int):
-        print(f"Player {self.name} Initial coins: {self.coins}")
         self.coins -= amount
-        print(f"Player {self.name} Coins after losing {amount}: {self.coins}")
         self.update_coup_status()
 
     def lose_card(self, card: Card):
@@ -0,0 +1,53 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+
+
+class Prefetcher:
+    """Endless stream of training batches loaded in a thread pool, up to
+    depth batches ahead of the training loop. Subclasses implement load.
+    Each batch has its own generator seeded with (seed, batch index), so
+    the stream does not depend on thread scheduling"""
+
+    def __init__(self, nb_threads: int, depth: int, seed: int = 0):
+        self.depth = depth
+        self.seed = seed
+        self.executor = ThreadPoolExecutor(nb_threads)
+        self.pending = deque()
+        self.nb_batches = 0
+        # Time the training loop spent waiting for a batch
+        self.wait_time = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        for future in self.pending:
+            future.cancel()
+        self.executor.shutdown()
+
+    def load(
+        self, batch_index: int, rng: np.random.Generator
+    ) -> dict[str, torch.Tensor]:
+        raise NotImplementedError
+
+    def load_batch(self, batch_index: int) -> dict[str, torch.Tensor]:
+        return self.load(batch_index, np.random.default_rng([self.seed, batch_index]))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict[str, torch.Tensor]:
+        while len(self.pending) < self.depth:
+            self.pending.append(self.executor.submit(self.load_batch, self.nb_batches))
+            self.nb_batches += 1
+        start_time = time.perf_counter()
+        batch = self.pending.popleft().result()
+        self.wait_time += time.perf_counter() - start_time
+        return batch
@@ -0,0 +1,224 @@
+import argparse
+import multiprocessing
+import os
+import random
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from dataset import ShardDataset, ShardWriter, export_games
+from dqn import DQN
+from exploration import masked_logits
+from heuristic_agent import HEURISTIC_PRESETS, heuristic_factory
+from prefetch import Prefetcher
+
+
+def generate_shards(
+    path: str,
+    nb_games: int,
+    nb_players: int,
+    teachers: list[str],
+    seed: int,
+    shard_size: int = 1 << 16,
+) -> int:
+    """Export the decisions of nb_games heuristic games into the dataset at
+    path, seats rotating between the teacher presets. Returns the number of
+    decisions written"""
+    from action import get_nb_actions
+    from board import Board
+
+    rng = random.Random(seed)
+    board = Board(nb_players, seed=seed)
+    factories = [heuristic_factory(teacher, rng) for teacher in teachers]
+    # Only (state, mask, action) are cloned, next states are not stored
+    with ShardWriter(
+        path,
+        board.full_state_length,
+        board.state_item_width,
+        get_nb_actions(nb_players),
+        shard_size,
+        with_next_states=False,
+    ) as writer:
+        for game in range(nb_games):
+            seats = [
+                factories[(game + seat) % len(factories)] for seat in range(nb_players)
+            ]
+            export_games(board, seats, writer, 1)
+        return len(writer)
+
+
+def generate_task(task: tuple) -> int:
+    return generate_shards(*task)
+
+
+def generate_datasets(
+    path: str,
+    nb_games: int,
+    nb_workers: int,
+    nb_players: int,
+    teachers: list[str],
+    seed: int = 0,
+    shard_size: int = 1 << 16,
+) -> list[str]:
+    """Headless rules-only workers, each writing its own dataset under path
+    so no two processes share an index. Returns the dataset paths"""
+    paths = [os.path.join(path, f"worker_{i:03d}") for i in range(nb_workers)]
+    tasks = [
+        (
+            worker_path,
+            nb_games // nb_workers + (i < nb_games % nb_workers),
+            nb_players,
+            teachers,
+            seed + i,
+            shard_size,
+        )
+        for i, worker_path in enumerate(paths)
+    ]
+    with multiprocessing.Pool(nb_workers) as pool:
+        for _ in pool.imap_unordered(generate_task, tasks):
+            pass
+    return paths
+
+
+class BatchLoader(Prefetcher):
+    """Endless minibatches of a ShardDataset as torch tensors. Gathering the
+    rows from the memory-mapped shards and unpacking the bits runs in a
+    thread pool, up to prefetch batches ahead of the training loop"""
+
+    def __init__(
+        self,
+        dataset: ShardDataset,
+        batch_size: int = 512,
+        nb_threads: int = 4,
+        prefetch: int = 8,
+        seed: int = 0,
+    ):
+        super().__init__(nb_threads, prefetch, seed)
+        self.dataset = dataset
+        self.batch_size = batch_size
+
+    def load(
+        self, batch_index: int, rng: np.random.Generator
+    ) -> dict[str, torch.Tensor]:
+        batch = self.dataset.sample(self.batch_size, rng)
+        return {
+            "states": torch.from_numpy(batch["states"]),
+            "action_masks": torch.from_numpy(batch["action_masks"]),
+            "actions": torch.from_numpy(batch["actions"]),
+        }
+
+
+def behaviour_cloning_loss(
+    q_values: torch.Tensor, action_masks: torch.Tensor, actions: torch.Tensor
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """Cross-entropy of the teacher's actions under a softmax of the
+    Q-values restricted to the legal actions, and the accuracy of the
+    greedy action"""
+    logits = masked_logits(q_values, action_masks)
+    loss = F.cross_entropy(logits, actions)
+    accuracy = (logits.argmax(dim=1) == actions).float().mean()
+    return loss, accuracy
+
+
+def pretrain(
+    policy_net: DQN,
+    loader: BatchLoader,
+    nb_steps: int,
+    learning_rate: float = 1e-3,
+    log_every: int = 100,
+) -> list[tuple[int, float, float]]:
+    """Train policy_net as a classifier of the teacher actions. Returns the
+    (step, loss, accuracy) averaged over each logging window"""
+    optimizer = torch.optim.Adam(policy_net.parameters(), lr=learning_rate)
+    policy_net.train()
+    history = []
+    window_loss = window_accuracy = 0.0
+    start_time = time.perf_counter()
+    for step in range(1, nb_steps + 1):
+        batch = next(loader)
+        loss, accuracy = behaviour_cloning_loss(
+            policy_net(batch["states"]), batch["action_masks"], batch["actions"]
+        )
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        window_loss += loss.item()
+        window_accuracy += accuracy.item()
+        if step % log_every == 0 or step == nb_steps:
+            window = (step - 1) % log_every + 1
+            history.append((step, window_loss / window, window_accuracy / window))
+            elapsed = time.perf_counter() - start_time
+            print(
+                f"step {step}: loss {history[-1][1]:.4f}, "
+                f"accuracy {history[-1][2]:.3f}, "
+                f"{step * loader.batch_size / elapsed:.0f} samples/s"
+            )
+            window_loss = window_accuracy = 0.0
+    return history
+
+
+if __name__ == "__main__":
+    import checkpoint
+    from agent import CoupAgent, RandomAgent
+    from board import Board
+
+    parser = argparse.ArgumentParser(
+        description="Behaviour cloning of heuristic agents as a warm start"
+    )
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument(
+        "--teachers",
+        default=",".join(HEURISTIC_PRESETS),
+        help="comma separated heuristic presets sharing the seats",
+    )
+    parser.add_argument("--data", default="data/behaviour_cloning")
+    parser.add_argument(
+        "--skip-generation", action="store_true", help="reuse the datasets in --data"
+    )
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--threads", type=int, default=4, help="loader threads")
+    parser.add_argument("--learning-rate", type=float, default=1e-3)
+    parser.add_argument("--models-path", default="models")
+    parser.add_argument("--checkpoint-id", default="pretrained")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    torch.manual_seed(args.seed)
+
+    if args.skip_generation:
+        paths = sorted(
+            os.path.join(args.data, name)
+            for name in os.listdir(args.data)
+            if name.startswith("worker_")
+        )
+    else:
+        start_time = time.perf_counter()
+        paths = generate_datasets(
+            args.data,
+            args.games,
+            args.workers,
+            args.players,
+            args.teachers.split(","),
+            args.seed,
+        )
+        print(f"{args.games} games exported in {time.perf_counter() - start_time:.1f}s")
+    dataset = ShardDataset(paths)
+    print(f"{len(dataset)} decisions in {len(dataset.shard_paths)} shards")
+
+    # The learner's own networks, so the checkpoint has a synced target net.
+    # Seated on a started board only to get a player
+    board = Board(args.players)
+    board.start([RandomAgent] * args.players)
+    agent = CoupAgent(
+        board.players[0], board.full_state_length, board.state_item_width, args.players
+    )
+    with BatchLoader(dataset, args.batch_size, args.threads, seed=args.seed) as loader:
+        pretrain(agent.policy_net, loader, args.steps, args.learning_rate)
+    agent.policy_net.eval()
+    agent.target_net.load_state_dict(agent.policy_net.state_dict())
+    entry = checkpoint.save_checkpoint(agent, args.checkpoint_id, 0, args.models_path)
+    print(
+        f"Warm start saved to {checkpoint.ModelRegistry(args.models_path).checkpoint_path(entry.id)}"
+    )
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import time
+from collections import Counter, defaultdict
+
+
+class NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class NullProfiler:
+    # Default profiler, every hook is a no-op so instrumentation costs a call
+    enabled = False
+
+    def phase(self, name: str) -> NullPhase:
+        return NULL_PHASE
+
+    def begin_move(self):
+        pass
+
+    def end_move(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class ProfiledPhase:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Profiler:
+    """Counts and cumulative wall time per phase of a game. Phases nest (an
+    inference runs inside a challenge polling) so times are inclusive"""
+
+    enabled = True
+
+    def __init__(self, trace: bool = False, max_trace_events: int = 1_000_000):
+        self.counts = defaultdict(int)
+        self.total_times = defaultdict(float)
+        self.origin = time.perf_counter()
+        self.trace = trace
+        self.max_trace_events = max_trace_events
+        self.trace_events = []
+        self.nb_moves = 0
+        self.move_start_updates = 0
+        # Histogram of update_agent_states calls per move
+        self.updates_per_move = Counter()
+
+    def phase(self, name: str) -> ProfiledPhase:
+        return ProfiledPhase(self, name)
+
+    def record(self, name: str, start: float, end: float):
+        self.counts[name] += 1
+        self.total_times[name] += end - start
+        if self.trace and len(self.trace_events) < self.max_trace_events:
+            self.trace_events.append((name, start, end))
+
+    def begin_move(self):
+        self.move_start_updates = self.counts["update_agent_states"]
+
+    def end_move(self):
+        self.nb_moves += 1
+        updates = self.counts["update_agent_states"] - self.move_start_updates
+        self.updates_per_move[updates] += 1
+
+    def summary(self) -> dict:
+        phases = {
+            name: {
+                "count": self.counts[name],
+                "total_ms": self.total_times[name] * 1000,
+                "mean_us": self.total_times[name] / self.counts[name] * 1e6,
+            }
+            for name in sorted(self.counts, key=lambda name: -self.total_times[name])
+        }
+        return {
+            "moves": self.nb_moves,
+            "phases": phases,
+            "update_agent_states_per_move": {
+                "mean": self.counts["update_agent_states"] / max(1, self.nb_moves),
+                "histogram": dict(sorted(self.updates_per_move.items())),
+            },
+        }
+
+    def export_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def export_chrome_trace(self, path: str):
+        # Complete ("X") events in microseconds, viewable in chrome://tracing
+        # or Perfetto
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": 0,
+            }
+            for name, start, end in self.trace_events
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+if __name__ == "__main__":
+    from board import Board, play_game
+
+    parser = argparse.ArgumentParser(description="Profile headless Coup games")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--summary", default="profile.json")
+    parser.add_argument("--trace", default=None, help="Chrome trace output path")
+    args = parser.parse_args()
+
+    profiler = Profiler(trace=args.trace is not None)
+    for game in range(args.games):
+        board = Board(args.players, seed=args.seed + game, profiler=profiler)
+        with profiler.phase("game"):
+            play_game(board, None)
+    profiler.export_json(args.summary)
+    if args.trace is not None:
+        profiler.export_chrome_trace(args.trace)
+    print(json.dumps(profiler.summary(), indent=2))
@@ -0,0 +1,322 @@
+from collections import deque
+from typing import NamedTuple
+import numpy as np
+
+
+class RecurrentContext(NamedTuple):
+    # What the Q-values of a recurrent agent depend on besides the state:
+    # its last streamed history rows and its hidden state before them.
+    # Training re-encodes the rows, so the history encoder learns too
+    hidden_state: np.ndarray
+    history_rows: np.ndarray  # [nb rows, state_item_width]
+
+
+class ReplayBuffer:
+    """Fixed capacity ring buffer of agent transitions stored as numpy arrays.
+    States are binary so they are kept bit-packed along the item width"""
+
+    def __init__(
+        self,
+        capacity: int,
+        full_state_length: int,
+        state_item_width: int,
+        n_actions: int,
+        hidden_dim: int = 0,
+        gamma: float = 0.99,
+        history_window: int = 16,
+    ):
+        self.capacity = capacity
+        self.gamma = gamma
+        self.state_item_width = state_item_width
+        packed_state_shape = (capacity, full_state_length, state_item_width // 8)
+        self.states = np.zeros(packed_state_shape, dtype=np.uint8)
+        self.next_states = np.zeros(packed_state_shape, dtype=np.uint8)
+        self.next_action_masks = np.zeros((capacity, n_actions), dtype=bool)
+        self.action_masks = np.zeros((capacity, n_actions), dtype=bool)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=bool)
+        # Discount applied to the bootstrapped value of next_state, gamma**n
+        # for n-step transitions
+        self.discounts = np.zeros(capacity, dtype=np.float32)
+        # RecurrentContexts of recurrent agents (hidden_dim > 0): up to
+        # history_window bit-packed history rows and the hidden state before
+        # them, so training does not need to replay the whole history
+        self.hidden_dim = hidden_dim
+        self.history_window = history_window if hidden_dim else 0
+        packed_rows_shape = (capacity, self.history_window, state_item_width // 8)
+        self.hidden_states = np.zeros((capacity, hidden_dim), dtype=np.float32)
+        self.next_hidden_states = np.zeros((capacity, hidden_dim), dtype=np.float32)
+        self.history_rows = np.zeros(packed_rows_shape, dtype=np.uint8)
+        self.next_history_rows = np.zeros(packed_rows_shape, dtype=np.uint8)
+        self.history_lengths = np.zeros(capacity, dtype=np.int64)
+        self.next_history_lengths = np.zeros(capacity, dtype=np.int64)
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def pack_state(self, state: np.ndarray) -> np.ndarray:
+        return np.packbits(np.asarray(state, dtype=np.uint8), axis=-1)
+
+    def unpack_states(self, packed_states: np.ndarray) -> np.ndarray:
+        return np.unpackbits(packed_states, axis=-1).astype(np.float32)
+
+    def add(
+        self,
+        state: np.ndarray,
+        action_mask: np.ndarray,
+        action: int,
+        reward: float,
+        next_state: np.ndarray,
+        next_action_mask: np.ndarray,
+        done: bool,
+        context: RecurrentContext | None = None,
+        next_context: RecurrentContext | None = None,
+        discount: float | None = None,
+    ) -> int:
+        index = self.position
+        self.states[index] = self.pack_state(state)
+        self.action_masks[index] = action_mask
+        self.actions[index] = action
+        self.rewards[index] = reward
+        self.next_states[index] = self.pack_state(next_state)
+        self.next_action_masks[index] = next_action_mask
+        self.dones[index] = done
+        self.discounts[index] = self.gamma if discount is None else discount
+        if self.hidden_dim:
+            (
+                self.hidden_states[index],
+                self.history_rows[index],
+                self.history_lengths[index],
+            ) = self.pack_context(context)
+            (
+                self.next_hidden_states[index],
+                self.next_history_rows[index],
+                self.next_history_lengths[index],
+            ) = self.pack_context(next_context)
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return index
+
+    def pack_context(
+        self, context: RecurrentContext
+    ) -> tuple[np.ndarray, np.ndarray, int]:
+        nb_rows = len(context.history_rows)
+        if nb_rows > self.history_window:
+            # Rows cannot be dropped, the hidden state is the one before them
+            raise ValueError(
+                f"{nb_rows} history rows do not fit a window of {self.history_window}"
+            )
+        rows = np.zeros(self.history_rows.shape[1:], dtype=np.uint8)
+        rows[:nb_rows] = self.pack_state(context.history_rows)
+        return context.hidden_state, rows, nb_rows
+
+    def get_batch(self, indices: np.ndarray) -> dict[str, np.ndarray]:
+        batch = {
+            "states": self.unpack_states(self.states[indices]),
+            "action_masks": self.action_masks[indices],
+            "actions": self.actions[indices],
+            "rewards": self.rewards[indices],
+            "next_states": self.unpack_states(self.next_states[indices]),
+            "next_action_masks": self.next_action_masks[indices],
+            "dones": self.dones[indices],
+            "discounts": self.discounts[indices],
+        }
+        if self.hidden_dim:
+            batch["hidden_states"] = self.hidden_states[indices]
+            batch["history_rows"] = self.unpack_states(self.history_rows[indices])
+            batch["history_lengths"] = self.history_lengths[indices]
+            batch["next_hidden_states"] = self.next_hidden_states[indices]
+            batch["next_history_rows"] = self.unpack_states(
+                self.next_history_rows[indices]
+            )
+            batch["next_history_lengths"] = self.next_history_lengths[indices]
+        return batch
+
+    def sample_indices(
+        self, batch_size: int, rng: np.random.Generator
+    ) -> tuple[np.ndarray, np.ndarray | None]:
+        # Rows of a batch and their importance weights, None when uniform
+        return rng.integers(0, self.size, size=batch_size), None
+
+    def sample(self, batch_size: int, rng: np.random.Generator) -> dict:
+        return self.get_batch(self.sample_indices(batch_size, rng)[0])
+
+
+class SumTree:
+    """Array-based binary sum tree over capacity leaves. Updates and prefix
+    sum searches are vectorized over whole batches: the Python loops only
+    run over the log2(capacity) levels, never over items"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.depth = max(1, int(np.ceil(np.log2(capacity))))
+        self.nb_leaves = 2**self.depth
+        # Node i has children 2i and 2i + 1, the root is node 1
+        self.nodes = np.zeros(2 * self.nb_leaves, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        return self.nodes[1]
+
+    def get(self, indices: np.ndarray) -> np.ndarray:
+        return self.nodes[self.nb_leaves + indices]
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray):
+        nodes = self.nb_leaves + np.asarray(indices)
+        self.nodes[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        # Index of the leaf where each cumulative value falls. A value pushed
+        # past the total by rounding never descends into an empty subtree,
+        # so the leaf found always has a non-zero priority
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left_sums = self.nodes[2 * nodes]
+            go_right = (values >= left_sums) & (self.nodes[2 * nodes + 1] > 0)
+            values -= np.where(go_right, left_sums, 0)
+            nodes = 2 * nodes + go_right
+        return nodes - self.nb_leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """Proportional prioritized replay: transitions are sampled with
+    probability priority**alpha / total, and importance weights correct the
+    induced bias"""
+
+    def __init__(
+        self,
+        capacity: int,
+        full_state_length: int,
+        state_item_width: int,
+        n_actions: int,
+        hidden_dim: int = 0,
+        gamma: float = 0.99,
+        alpha: float = 0.6,
+        beta: float = 0.4,
+        priority_epsilon: float = 1e-6,
+        history_window: int = 16,
+    ):
+        super().__init__(
+            capacity,
+            full_state_length,
+            state_item_width,
+            n_actions,
+            hidden_dim,
+            gamma,
+            history_window,
+        )
+        self.alpha = alpha
+        self.beta = beta
+        self.priority_epsilon = priority_epsilon
+        self.sum_tree = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def add(self, *args, **kwargs) -> int:
+        index = super().add(*args, **kwargs)
+        # New transitions get the highest priority so they are seen at least once
+        self.sum_tree.update(np.array([index]), np.array([self.max_priority]))
+        return index
+
+    def sample_indices(
+        self, batch_size: int, rng: np.random.Generator, beta: float | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        beta = self.beta if beta is None else beta
+        # Stratified sampling: one value in each of batch_size equal segments
+        segment = self.sum_tree.total / batch_size
+        values = (np.arange(batch_size) + rng.random(batch_size)) * segment
+        indices = self.sum_tree.find(values)
+        probabilities = self.sum_tree.get(indices) / self.sum_tree.total
+        weights = (self.size * probabilities) ** -beta
+        return indices, (weights / weights.max()).astype(np.float32)
+
+    def sample(
+        self, batch_size: int, rng: np.random.Generator, beta: float | None = None
+    ) -> dict:
+        indices, weights = self.sample_indices(batch_size, rng, beta)
+        batch = self.get_batch(indices)
+        batch["indices"] = indices
+        batch["weights"] = weights
+        return batch
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray):
+        priorities = (np.abs(td_errors) + self.priority_epsilon) ** self.alpha
+        self.sum_tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+
+class NStepReplayWriter:
+    """Sits between one agent and a shared replay buffer (same add signature)
+    and aggregates its consecutive transitions into n-step ones at insertion
+    time. Coup rewards only come at the end of a game, so n-step returns
+    carry them back n decisions per update instead of one"""
+
+    def __init__(self, replay_buffer: ReplayBuffer, n: int = 3):
+        self.replay_buffer = replay_buffer
+        self.n = n
+        self.pending = deque()
+
+    def add(
+        self,
+        state: np.ndarray,
+        action_mask: np.ndarray,
+        action: int,
+        reward: float,
+        next_state: np.ndarray,
+        next_action_mask: np.ndarray,
+        done: bool,
+        context: RecurrentContext | None = None,
+        next_context: RecurrentContext | None = None,
+    ):
+        self.pending.append(
+            (
+                state,
+                action_mask,
+                action,
+                reward,
+                next_state,
+                next_action_mask,
+                done,
+                context,
+                next_context,
+            )
+        )
+        if done:
+            self.flush()
+        elif len(self.pending) == self.n:
+            self.write_oldest()
+
+    def flush(self):
+        # Writes what is left of the episode, so an episode cut short without
+        # a terminal transition does not run into the next one. Its last
+        # transitions bootstrap from their next state over fewer steps
+        while self.pending:
+            self.write_oldest()
+
+    def write_oldest(self):
+        gamma = self.replay_buffer.gamma
+        state, action_mask, action, _, _, _, _, context, _ = self.pending[0]
+        rewards = np.array([transition[3] for transition in self.pending])
+        n_step_return = float(np.dot(gamma ** np.arange(len(rewards)), rewards))
+        _, _, _, _, next_state, next_action_mask, done, _, next_context = self.pending[
+            -1
+        ]
+        self.replay_buffer.add(
+            state,
+            action_mask,
+            action,
+            n_step_return,
+            next_state,
+            next_action_mask,
+            done,
+            context=context,
+            next_context=next_context,
+            discount=gamma ** len(rewards),
+        )
+        self.pending.popleft()
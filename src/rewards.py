@@ -0,0 +1,318 @@
+import argparse
+import json
+import numpy as np
+from pydantic import BaseModel
+from action import MAX_PLAYERS
+from metrics import NULL_METRICS, agent_kind
+
+# Per-player quantities tracked during a game. Shaped rewards are weighted
+# differences of them between consecutive decisions of a player
+FEATURES = (
+    "coins",
+    "influence",
+    "opponent_influence",
+    "coins_stolen",
+    "uncaught_bluffs",  # bluffs claimed minus bluffs caught by a challenge
+    "challenges_won",
+)
+NB_FEATURES = len(FEATURES)
+INFLUENCE_PER_PLAYER = 2
+
+
+class RewardConfig(BaseModel):
+    """Rewards of an experiment. Terminal rewards go to the last transition
+    of each player: win and loss, or a linear scale from win to loss over
+    the placements with by_placement, survivors of an unfinished game get
+    unfinished. Shaping weights default to 0 (terminal rewards only)"""
+
+    win: float = 1.0
+    loss: float = -1.0
+    unfinished: float = 0.0
+    by_placement: bool = False
+    coins_gained: float = 0.0  # per coin gained, coins spent count negatively
+    influence_lost: float = 0.0
+    influence_taken: float = 0.0  # per influence lost by any opponent
+    coins_stolen: float = 0.0
+    bluff_success: float = 0.0  # per bluff not caught
+    challenge_success: float = 0.0  # per challenge catching a bluff
+
+    def feature_weights(self) -> np.ndarray:
+        # In the order of FEATURES, losses are decreases of the feature
+        return np.array(
+            [
+                self.coins_gained,
+                -self.influence_lost,
+                -self.influence_taken,
+                self.coins_stolen,
+                self.bluff_success,
+                self.challenge_success,
+            ],
+            dtype=np.float32,
+        )
+
+    def terminal_rewards(self, placements: list[int], completed: bool) -> np.ndarray:
+        placements = np.asarray(placements)
+        if self.by_placement:
+            nb_players = len(placements)
+            rewards = self.win + (self.loss - self.win) * (placements - 1) / max(
+                1, nb_players - 1
+            )
+        else:
+            rewards = np.where(placements == 1, self.win, self.loss)
+        if not completed:
+            rewards = np.where(placements == 1, self.unfinished, rewards)
+        return rewards.astype(np.float32)
+
+
+REWARD_PRESETS = {
+    "terminal": RewardConfig(),
+    "placement": RewardConfig(by_placement=True),
+    "shaped": RewardConfig(
+        coins_gained=0.01,
+        influence_lost=0.2,
+        influence_taken=0.1,
+        coins_stolen=0.01,
+        bluff_success=0.05,
+        challenge_success=0.1,
+    ),
+}
+
+
+def load_reward_config(spec: str) -> RewardConfig:
+    """A preset name or the path of a JSON file of RewardConfig fields"""
+    if spec in REWARD_PRESETS:
+        return REWARD_PRESETS[spec]
+    with open(spec) as f:
+        return RewardConfig(**json.load(f))
+
+
+class RewardTally:
+    """Board metrics hooks counting the per-player events rewards depend on.
+    Other hooks are forwarded to the wrapped metrics, so a board can both
+    measure and label its games. The rules only pay a few counter updates,
+    rewards are computed after the game by label_trajectories. The features
+    of a player are frozen at the end of the move that eliminates it, so it
+    is not credited with what happens after it is out"""
+
+    enabled = True
+
+    def __init__(self, metrics=NULL_METRICS):
+        self.metrics = metrics
+        self.board = None
+        self.coins_stolen = np.zeros(MAX_PLAYERS, dtype=np.int64)
+        self.uncaught_bluffs = np.zeros(MAX_PLAYERS, dtype=np.int64)
+        self.challenges_won = np.zeros(MAX_PLAYERS, dtype=np.int64)
+        self.baseline = np.zeros((MAX_PLAYERS, NB_FEATURES), dtype=np.float32)
+        self.is_eliminated = np.zeros(MAX_PLAYERS, dtype=bool)
+        self.eliminated_features = np.zeros(
+            (MAX_PLAYERS, NB_FEATURES), dtype=np.float32
+        )
+
+    def start_game(self, board):
+        self.board = board
+        self.coins_stolen[:] = 0
+        self.uncaught_bluffs[:] = 0
+        self.challenges_won[:] = 0
+        self.is_eliminated[:] = False
+        for player in board.players:
+            self.baseline[player.id] = self.features(player.id)
+        self.metrics.start_game(board)
+
+    def claim(self, player, action):
+        if player.is_bluffing(action)[0]:
+            self.uncaught_bluffs[player.id] += 1
+        self.metrics.claim(player, action)
+
+    def challenge(self, action_type, is_bluffing: bool, challenger, claimant):
+        if is_bluffing:
+            self.uncaught_bluffs[claimant.id] -= 1
+            self.challenges_won[challenger.id] += 1
+        self.metrics.challenge(action_type, is_bluffing, challenger, claimant)
+
+    def steal(self, player, target, amount: int):
+        self.coins_stolen[player.id] += amount
+        self.metrics.steal(player, target, amount)
+
+    def end_move(self, board):
+        for player in board.players:
+            if not self.is_eliminated[player.id] and all(
+                card.is_revealed for card in player.hand
+            ):
+                self.eliminated_features[player.id] = self.features(player.id)
+                self.is_eliminated[player.id] = True
+        self.metrics.end_move(board)
+
+    def end_game(self, board, placements: list[int], n_moves: int, completed: bool):
+        self.metrics.end_game(board, placements, n_moves, completed)
+
+    def features(self, player_id: int) -> np.ndarray:
+        if self.is_eliminated[player_id]:
+            return self.eliminated_features[player_id].copy()
+        influences = [
+            max(0, INFLUENCE_PER_PLAYER - sum(card.is_revealed for card in player.hand))
+            for player in self.board.players
+        ]
+        return np.array(
+            [
+                self.board.players[player_id].coins,
+                influences[player_id],
+                sum(influences) - influences[player_id],
+                self.coins_stolen[player_id],
+                self.uncaught_bluffs[player_id],
+                self.challenges_won[player_id],
+            ],
+            dtype=np.float32,
+        )
+
+
+def label_trajectories(
+    features: list[np.ndarray],
+    baselines: np.ndarray,
+    placements: list[int],
+    completed: bool,
+    config: RewardConfig,
+) -> list[np.ndarray]:
+    """Rewards of every transition of a finished game in one pass.
+    features[seat] holds the [T, NB_FEATURES] features measured at the end
+    of each of the T transitions of the seat, baselines[seat] the features
+    at the start of the game. The shaped reward of a transition is the
+    weighted change of the features over it, the terminal reward is added to
+    the last one. Shaping is a difference of potentials, it telescopes to
+    the change over the whole game"""
+    lengths = np.array([len(seat_features) for seat_features in features])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    ends = starts + lengths
+    # Each seat's rows preceded by its baseline, the difference of
+    # consecutive rows then never crosses two seats
+    rows = np.concatenate(
+        [
+            np.concatenate([baselines[seat][None], seat_features])
+            for seat, seat_features in enumerate(features)
+        ]
+    )
+    is_first = np.zeros(len(rows), dtype=bool)
+    is_first[starts + np.arange(len(features))] = True
+    deltas = np.diff(rows, axis=0)[~is_first[1:]]
+    rewards = deltas @ config.feature_weights()
+    has_transitions = lengths > 0
+    rewards[ends[has_transitions] - 1] += config.terminal_rewards(
+        placements, completed
+    )[has_transitions]
+    return np.split(rewards, ends[:-1])
+
+
+class SeatTrajectory:
+    """replay_buffer of one agent during a game: transitions are held back
+    with the features measured when each was completed, and flushed to sink
+    (a replay buffer or a dataset SeatWriter) once labelled"""
+
+    def __init__(self, tally: RewardTally, seat: int, sink):
+        self.tally = tally
+        self.seat = seat
+        self.sink = sink
+        self.transitions = []
+        self.features = []
+
+    def add(self, *args, **kwargs):
+        self.transitions.append((args, kwargs))
+        self.features.append(self.tally.features(self.seat))
+
+    def flush(self, rewards: np.ndarray):
+        for (args, kwargs), reward in zip(self.transitions, rewards):
+            state, action_mask, action, _, *rest = args
+            self.sink.add(state, action_mask, action, float(reward), *rest, **kwargs)
+        self.transitions.clear()
+        self.features.clear()
+
+
+class RewardLabeller:
+    """Labels the transitions of the agents of a board at the end of each
+    game. The board's metrics must be the labeller's tally"""
+
+    def __init__(self, tally: RewardTally, config: RewardConfig):
+        self.tally = tally
+        self.config = config
+
+    def seat(self, seat: int, sink) -> SeatTrajectory:
+        return SeatTrajectory(self.tally, seat, sink)
+
+    def finish(self, agents: list, placements: list[int], completed: bool):
+        trajectories = []
+        for agent in agents:
+            # The terminal transition, its reward is set by the labelling
+            agent.end_episode(0.0)
+            trajectories.append(agent.replay_buffer)
+        seats = [trajectory.seat for trajectory in trajectories]
+        rewards = label_trajectories(
+            [
+                np.array(trajectory.features, dtype=np.float32).reshape(-1, NB_FEATURES)
+                for trajectory in trajectories
+            ],
+            self.tally.baseline[seats],
+            placements,
+            completed,
+            self.config,
+        )
+        for trajectory, seat_rewards in zip(trajectories, rewards):
+            trajectory.flush(seat_rewards)
+        return rewards
+
+
+if __name__ == "__main__":
+    import random
+    from functools import partial
+    from base_agent import RandomAgent
+    from board import Board, play_game
+    from heuristic_agent import HEURISTIC_PRESETS, heuristic_factory
+    from replay import ReplayBuffer
+    from action import get_nb_actions
+
+    parser = argparse.ArgumentParser(description="Reward labelling of headless games")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument(
+        "--rewards",
+        default="shaped",
+        help=f"preset ({', '.join(REWARD_PRESETS)}) or JSON file",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = load_reward_config(args.rewards)
+    tally = RewardTally()
+    labeller = RewardLabeller(tally, config)
+    board = Board(args.players, seed=args.seed, metrics=tally)
+    rng = random.Random(args.seed)
+    teachers = [heuristic_factory(preset, rng) for preset in HEURISTIC_PRESETS]
+    teachers.append(partial(RandomAgent, rng=rng))
+    buffer = ReplayBuffer(
+        1 << 16,
+        board.full_state_length,
+        board.state_item_width,
+        get_nb_actions(args.players),
+    )
+
+    def labelled(agent_factory):
+        def factory(player, full_state_length, state_item_width, nb_players):
+            agent = agent_factory(
+                player, full_state_length, state_item_width, nb_players
+            )
+            agent.replay_buffer = labeller.seat(player.id, buffer)
+            return agent
+
+        return factory
+
+    returns = {}
+    for game in range(args.games):
+        seats = [
+            teachers[(game + seat) % len(teachers)] for seat in range(args.players)
+        ]
+        placements, _, completed = play_game(board, [labelled(s) for s in seats])
+        for agent, rewards in zip(
+            board.agents, labeller.finish(board.agents, placements, completed)
+        ):
+            returns.setdefault(agent_kind(agent), []).append(rewards.sum())
+    print(json.dumps(config.model_dump(), indent=2))
+    for kind, kind_returns in returns.items():
+        print(f"{kind:<12} mean return {np.mean(kind_returns):+.3f}")
+    print(f"{len(buffer)} labelled transitions")
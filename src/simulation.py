@@ -1,12 +1,16 @@
+import math
 import sys
+import time
+from collections import deque
+import numpy as np
 import pygame
 from board import Board
 from card import Card
 from character import Character
-from deck import Deck
+from deck import CHARACTERS, Deck
+from game_record import GameRecordFile, GameReplay
 from player import Player
-
-pygame.init()
+from status_block import DEFAULT_NAME, StatusBlock
 
 # Constants
 WINDOW_WIDTH = 800
@@ -27,11 +31,6 @@ COLORS = {
     "border": (86, 95, 108),  # Medium gray
 }
 
-# Initialize pygame
-screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-pygame.display.set_caption("Coup - AI Learning Simulation")
-clock = pygame.time.Clock()
-
 # Game settings
 moves_per_second_options = [0.1, 0.2, 0.5, 1, 2, 5, 10]
 moves_per_second = moves_per_second_options[0]
@@ -39,6 +38,7 @@ reveal_player_cards = False
 is_active = False
 last_actions = []
 nb_games = 5
+nb_players = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 4
 models_path = "models"
 
 # Training metrics
@@ -49,13 +49,56 @@ record = 0
 n_games = 0
 
 # Board setup
-board = Board()
+board = Board(nb_players)
 board_zone_rect = pygame.Rect(0, BOARD_TOP, WINDOW_WIDTH, WINDOW_HEIGHT - BOARD_TOP)
 card_width = 100  # Slightly larger cards
 card_height = 100
 
-# Training stats display
-stats_font = pygame.font.Font(None, 24)
+
+def init_display():
+    # pygame, the window, fonts and card images are only set up when the
+    # simulation runs, so importing this module stays cheap and headless
+    global screen, clock, stats_font, title_font, font, small_font
+    global last_actions_font, face_down_card, duke_card, assassin_card
+    global ambassador_card, captain_card, contessa_card, card_images
+    pygame.init()
+    screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+    pygame.display.set_caption("Coup - AI Learning Simulation")
+    clock = pygame.time.Clock()
+    # Fonts
+    stats_font = pygame.font.Font(None, 24)
+    title_font = pygame.font.Font(None, 48)
+    font = pygame.font.Font(None, 36)
+    small_font = pygame.font.Font(None, 24)
+    last_actions_font = pygame.font.Font(None, 14)
+    # cards
+    face_down_card = pygame.image.load("assets/face_down_card.png").convert_alpha()
+    duke_card = pygame.image.load("assets/duke.png").convert_alpha()
+    assassin_card = pygame.image.load("assets/assassin.png").convert_alpha()
+    ambassador_card = pygame.image.load("assets/ambassador.png").convert_alpha()
+    captain_card = pygame.image.load("assets/captain.png").convert_alpha()
+    contessa_card = pygame.image.load("assets/contessa.png").convert_alpha()
+    card_images = {
+        None: face_down_card,
+        Character.DUKE: duke_card,
+        Character.ASSASSIN: assassin_card,
+        Character.AMBASSADOR: ambassador_card,
+        Character.CAPTAIN: captain_card,
+        Character.CONTESSA: contessa_card,
+    }
+
+
+# Scaled card images by (character, width, height), None being face down
+card_sprites = {}
+
+
+def get_card_sprite(character: Character | None, width: int, height: int):
+    key = (character, width, height)
+    sprite = card_sprites.get(key)
+    if sprite is None:
+        sprite = pygame.transform.smoothscale(card_images[character], (width, height))
+        card_sprites[key] = sprite
+    return sprite
 
 
 def display_training_stats(screen: pygame.Surface):
@@ -72,23 +115,10 @@ def display_training_stats(screen: pygame.Surface):
     screen.blit(stats_surface, (10, BOARD_TOP + 10))
 
 
-# Fonts
-title_font = pygame.font.Font(None, 48)
-font = pygame.font.Font(None, 36)
-small_font = pygame.font.Font(None, 24)
-last_actions_font = pygame.font.Font(None, 14)
-
 # Button dimensions
 BUTTON_WIDTH = 160
 BUTTON_HEIGHT = 80
 BUTTON_MARGIN = 20
-# cards
-face_down_card = pygame.image.load("assets/face_down_card.png").convert_alpha()
-duke_card = pygame.image.load("assets/duke.png").convert_alpha()
-assassin_card = pygame.image.load("assets/assassin.png").convert_alpha()
-ambassador_card = pygame.image.load("assets/ambassador.png").convert_alpha()
-captain_card = pygame.image.load("assets/captain.png").convert_alpha()
-contessa_card = pygame.image.load("assets/contessa.png").convert_alpha()
 # UI elements
 reveal_cards_button_rect = pygame.Rect(
     BUTTON_MARGIN, BUTTON_MARGIN, BUTTON_WIDTH, BUTTON_HEIGHT
@@ -301,26 +331,9 @@ def display_card(
     if reveal_card is None:
         reveal_card = reveal_player_cards
 
-    # Get the appropriate card image
-    if reveal_card or card.is_revealed:
-        card_image = None
-        match card.character:
-            case Character.DUKE:
-                card_image = duke_card
-            case Character.ASSASSIN:
-                card_image = assassin_card
-            case Character.AMBASSADOR:
-                card_image = ambassador_card
-            case Character.CAPTAIN:
-                card_image = captain_card
-            case Character.CONTESSA:
-                card_image = contessa_card
-    else:
-        card_image = face_down_card
-
-    # Scale and display the card image
-    scaled_image = pygame.transform.scale(card_image, (card_width, card_height))
-    screen.blit(scaled_image, (x, y))
+    # Card images are scaled once per size and reused every frame
+    character = card.character if reveal_card or card.is_revealed else None
+    screen.blit(get_card_sprite(character, card_width, card_height), (x, y))
 
 
 def display_player_info(
@@ -365,7 +378,8 @@ def display_player_zone(
     y: int,
     player_zone_width: int = 200,
     player_zone_height: int = 100,
-    player_index: int = 0,
+    is_horizontal: bool = True,
+    is_top_or_left: bool = True,
     is_current_player: bool = False,
 ):
     # Draw player zone background with a subtle gradient
@@ -390,7 +404,7 @@ def display_player_zone(
     screen.blit(gradient_surface, player_zone)
 
     # Draw cards and info based on player position
-    if player_index % 2 == 0:  # Top or bottom player
+    if is_horizontal:  # Top or bottom player
         card_spacing = (player_zone_width - 2 * card_width) / 3
         card_y = player_zone.y + (player_zone_height - card_height) / 2
 
@@ -405,7 +419,7 @@ def display_player_zone(
                 is_dead=not player.is_alive,
             )
 
-        info_y = player_zone.bottom + 30 if player_index == 0 else player_zone.top - 30
+        info_y = player_zone.bottom + 30 if is_top_or_left else player_zone.top - 30
         display_player_info(
             screen, player, player_zone.centerx, info_y, is_current_player
         )
@@ -424,7 +438,7 @@ def display_player_zone(
                 is_dead=not player.is_alive,
             )
 
-        info_x = player_zone.right + 60 if player_index == 3 else player_zone.left - 60
+        info_x = player_zone.right + 60 if is_top_or_left else player_zone.left - 60
         display_player_info(
             screen, player, info_x, player_zone.centery, is_current_player
         )
@@ -460,77 +474,420 @@ def display_board(board: Board):
         board_zone_rect.y + board_zone_rect.height / 2 - card_height / 2,
     )
 
+    # Seats are spread clockwise on an ellipse starting from the top, seats
+    # closer to the top or bottom edge get a horizontal zone
     for i, player in enumerate(board.players):
-        player_zone_width = 200 if i % 2 == 0 else 100
-        player_zone_height = 100 if i % 2 == 0 else 200
-        if i == 0:  # Top player
-            x = board_zone_rect.x + board_zone_rect.width / 2 - player_zone_width / 2
-            y = board_zone_rect.y
-        elif i == 1:  # Right player
-            x = board_zone_rect.x + board_zone_rect.width - player_zone_width
-            y = board_zone_rect.y + board_zone_rect.height / 2 - player_zone_height / 2
-        elif i == 2:  # Bottom player
-            x = board_zone_rect.x + board_zone_rect.width / 2 - player_zone_width / 2
-            y = board_zone_rect.y + board_zone_rect.height - player_zone_height
-        elif i == 3:  # Left player
-            x = board_zone_rect.x
-            y = board_zone_rect.y + board_zone_rect.height / 2 - player_zone_height / 2
+        angle = -math.pi / 2 + 2 * math.pi * i / len(board.players)
+        is_horizontal = abs(math.sin(angle)) >= abs(math.cos(angle))
+        player_zone_width = 200 if is_horizontal else 100
+        player_zone_height = 100 if is_horizontal else 200
+        center_x = board_zone_rect.centerx + math.cos(angle) * (
+            board_zone_rect.width / 2 - player_zone_width / 2
+        )
+        center_y = board_zone_rect.centery + math.sin(angle) * (
+            board_zone_rect.height / 2 - player_zone_height / 2
+        )
         display_player_zone(
             screen,
             player,
-            x,
-            y,
+            center_x - player_zone_width / 2,
+            center_y - player_zone_height / 2,
             player_zone_width,
             player_zone_height,
-            player_index=i,
+            is_horizontal=is_horizontal,
+            is_top_or_left=math.sin(angle) < 0
+            if is_horizontal
+            else math.cos(angle) < 0,
             is_current_player=board.current_player == player,
         )
 
 
-move_timer = pygame.USEREVENT + 2
-pygame.time.set_timer(move_timer, int(1000 / moves_per_second))
+# Dashboard of many headless tables (see status_block.py)
+DASHBOARD_FPS = 10
+THROUGHPUT_WINDOW = 5.0  # seconds of samples behind games/s and moves/s
+CHART_SAMPLE_PERIOD = 1.0  # seconds between two win rate chart points
+CHART_STEP = 4  # pixels per chart point
+SEAT_COLORS = [
+    (97, 175, 239),
+    (152, 195, 121),
+    (229, 192, 123),
+    (224, 108, 117),
+    (198, 120, 221),
+    (86, 182, 194),
+]
+
+
+class Dashboard:
+    """Grid of table thumbnails with throughput and win rate charts, drawn
+    from snapshots of a StatusBlock. Thumbnails are only redrawn when their
+    table published a new status, the chart scrolls by one point per sample"""
+
+    def __init__(self, block: StatusBlock):
+        self.block = block
+        self.tables = block.snapshot()
+        self.thumbnails: dict[int, tuple[int, pygame.Surface]] = {}
+        self.samples = deque()  # (time, games, moves)
+        self.games_per_second = 0.0
+        self.moves_per_second = 0.0
+        self.chart = pygame.Surface((380, BOARD_TOP - 60))
+        self.chart.fill(COLORS["background"])
+        self.last_chart_sample = 0.0
+        self.last_win_rates = None
+
+    def update(self):
+        self.tables = self.block.snapshot(self.tables)
+        now = time.perf_counter()
+        games, moves = self.tables["n_games"].sum(), self.tables["n_moves"].sum()
+        self.samples.append((now, games, moves))
+        while now - self.samples[0][0] > THROUGHPUT_WINDOW:
+            self.samples.popleft()
+        elapsed = now - self.samples[0][0]
+        if elapsed > 0:
+            self.games_per_second = (games - self.samples[0][1]) / elapsed
+            self.moves_per_second = (moves - self.samples[0][2]) / elapsed
+        if now - self.last_chart_sample >= CHART_SAMPLE_PERIOD:
+            self.last_chart_sample = now
+            self.add_chart_point()
+
+    def add_chart_point(self):
+        nb_seats = max(1, int(self.tables["nb_players"].max()))
+        win_rates = self.tables["wins"].sum(axis=0)[:nb_seats] / max(
+            1, self.tables["n_games"].sum()
+        )
+        # Scaled so that twice the chance level fills the chart
+        height = self.chart.get_height()
+        scale = min(1.0, 2 / nb_seats)
+        ys = height - 1 - np.clip(win_rates / scale, 0, 1) * (height - 1)
+        self.chart.scroll(-CHART_STEP, 0)
+        x = self.chart.get_width() - CHART_STEP
+        self.chart.fill(COLORS["background"], (x, 0, CHART_STEP, height))
+        chance_y = height - 1 - (1 / nb_seats) / scale * (height - 1)
+        pygame.draw.line(
+            self.chart, COLORS["border"], (x, chance_y), (x + CHART_STEP, chance_y)
+        )
+        if self.last_win_rates is not None and len(self.last_win_rates) == nb_seats:
+            for seat in range(nb_seats):
+                pygame.draw.line(
+                    self.chart,
+                    SEAT_COLORS[seat],
+                    (x - 1, self.last_win_rates[seat]),
+                    (x + CHART_STEP - 1, ys[seat]),
+                    2,
+                )
+        self.last_win_rates = ys
+
+    def thumbnail(self, table_id: int, width: int, height: int) -> pygame.Surface:
+        table = self.tables[table_id]
+        sequence = int(table["sequence"])
+        cached = self.thumbnails.get(table_id)
+        if (
+            cached is not None
+            and cached[0] == sequence
+            and cached[1].get_size() == (width, height)
+        ):
+            return cached[1]
+        surface = pygame.Surface((width, height))
+        surface.fill(COLORS["board"])
+        pygame.draw.rect(surface, COLORS["border"], surface.get_rect(), width=1)
+        title = last_actions_font.render(
+            f"#{table_id}  {table['n_games']} games", True, COLORS["accent"]
+        )
+        surface.blit(title, (4, 3))
+        nb_players = int(table["nb_players"])
+        row_height = (height - 16) // max(1, nb_players)
+        sprite_size = max(4, min(row_height - 2, (width - 40) // 2))
+        for seat in range(nb_players):
+            y = 14 + seat * row_height
+            is_alive = not table["revealed"][seat].all()
+            color = COLORS["text"]
+            if not is_alive:
+                color = COLORS["dead_player"]
+            elif seat == table["current_player"] and not table["game_has_ended"]:
+                color = COLORS["current_player"]
+            coins = last_actions_font.render(f"{table['coins'][seat]}", True, color)
+            surface.blit(coins, (4, y + (sprite_size - coins.get_height()) // 2))
+            for slot in range(2):
+                character_index = table["cards"][seat, slot]
+                if character_index < 0:
+                    continue
+                is_visible = reveal_player_cards or table["revealed"][seat, slot]
+                character = CHARACTERS[character_index] if is_visible else None
+                surface.blit(
+                    get_card_sprite(character, sprite_size, sprite_size),
+                    (24 + slot * (sprite_size + 2), y),
+                )
+        self.thumbnails[table_id] = (sequence, surface)
+        return surface
+
+    def draw(self, screen: pygame.Surface):
+        screen.fill(COLORS["background"])
+        ui_rect = pygame.Rect(0, 0, WINDOW_WIDTH, BOARD_TOP)
+        pygame.draw.rect(screen, COLORS["board"], ui_rect)
+        pygame.draw.line(
+            screen, COLORS["border"], (0, BOARD_TOP), (WINDOW_WIDTH, BOARD_TOP), 2
+        )
+        lines = [
+            f"{self.block.nb_tables} tables",
+            f"{self.games_per_second:.1f} games/s",
+            f"{self.moves_per_second:.0f} moves/s",
+            f"{self.tables['n_games'].sum()} games played",
+        ]
+        for i, line in enumerate(lines):
+            text = (title_font if i == 0 else font).render(line, True, COLORS["text"])
+            screen.blit(text, (BUTTON_MARGIN, BUTTON_MARGIN + i * 40))
+        chart_rect = self.chart.get_rect(
+            topright=(WINDOW_WIDTH - BUTTON_MARGIN, BUTTON_MARGIN + 25)
+        )
+        title = small_font.render("Win rate per seat", True, COLORS["accent"])
+        screen.blit(title, (chart_rect.left, BUTTON_MARGIN))
+        for seat in range(int(self.tables["nb_players"].max())):
+            label = last_actions_font.render(f"P{seat}", True, SEAT_COLORS[seat])
+            screen.blit(label, (chart_rect.left + 160 + seat * 25, BUTTON_MARGIN + 4))
+        screen.blit(self.chart, chart_rect)
+        pygame.draw.rect(screen, COLORS["border"], chart_rect, width=1)
+
+        # Thumbnails fill the board zone in a near square grid
+        nb_columns = math.ceil(math.sqrt(self.block.nb_tables))
+        nb_rows = math.ceil(self.block.nb_tables / nb_columns)
+        width = (WINDOW_WIDTH - 4) // nb_columns
+        height = (WINDOW_HEIGHT - BOARD_TOP - 4) // nb_rows
+        for table_id in range(self.block.nb_tables):
+            row, column = divmod(table_id, nb_columns)
+            screen.blit(
+                self.thumbnail(table_id, width - 4, height - 4),
+                (4 + column * width, BOARD_TOP + 4 + row * height),
+            )
 
-running = True
-while running:
-    # Fill background with base color
-    screen.fill(COLORS["background"])
 
-    # Handle events
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.MOUSEBUTTONDOWN and is_active:
-            mouse_pos = event.pos
-            # Check button clicks
-            if reveal_cards_button_rect.collidepoint(mouse_pos):
+def dashboard_main(name: str = DEFAULT_NAME):
+    # Only reads the status block, the workers never wait on the UI
+    global reveal_player_cards
+    init_display()
+    pygame.display.set_caption("Coup - Self-Play Dashboard")
+    block = StatusBlock.attach(name)
+    dashboard = Dashboard(block)
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_r:
                 reveal_player_cards = not reveal_player_cards
-            elif speed_button_rect.collidepoint(mouse_pos):
-                current_index = moves_per_second_options.index(moves_per_second)
-                next_index = (current_index + 1) % len(moves_per_second_options)
-                moves_per_second = moves_per_second_options[next_index]
-                pygame.time.set_timer(move_timer, int(1000 / moves_per_second))
-
-        # Running game logic
-        elif event.type == move_timer and is_active and not board.game_has_ended:
-            last_actions = board.agents_next_move(last_actions, LAST_ACTIONS_MAX_LENGTH)
-
-    # Draw game state
-    if not is_active:
-        display_start_menu(screen)
-    else:
+                dashboard.thumbnails.clear()
+        dashboard.update()
+        dashboard.draw(screen)
+        pygame.display.update()
+        clock.tick(DASHBOARD_FPS)
+    block.close()
+    pygame.quit()
+
+
+# Replay viewer of recorded games (see game_record.py)
+REPLAY_FPS = 60
+REPLAY_SPEEDS = [0.5, 1, 2, 5, 10, 20, 50, 100]  # moves per second
+REPLAY_PAGE = 10  # moves skipped by Page Up / Page Down
+REPLAY_HELP = [
+    "Space play/pause  B reverse  Up/Down speed  Left/Right step",
+    "PgUp/PgDn 10 moves  Home/End  N/P game  R cards",
+    "type a number then Enter (move) or G (game)",
+]
+
+
+class ReplayViewer:
+    """Steps forward and backward through the games of a record file at any
+    speed. Any move is reached by seeking, which restores the closest
+    keyframe and re-simulates the few moves after it"""
+
+    def __init__(self, record_file: GameRecordFile, game: int = 0, move: int = 0):
+        self.record_file = record_file
+        self.nb_games = len(record_file)
+        self.is_playing = False
+        self.direction = 1
+        self.speed_index = 1
+        self.pending_moves = 0.0
+        self.typed = ""
+        self.load(game)
+        self.replay.seek(move)
+
+    def load(self, game: int):
+        self.game = max(0, min(game, self.nb_games - 1))
+        self.replay = GameReplay(
+            self.record_file.load(self.game), LAST_ACTIONS_MAX_LENGTH
+        )
+        self.pending_moves = 0.0
+
+    def seek(self, move: int):
+        self.replay.seek(move)
+        self.pending_moves = 0.0
+
+    def handle_key(self, event):
+        global reveal_player_cards
+        replay = self.replay
+        if event.unicode.isdigit():
+            self.typed += event.unicode
+        elif event.key == pygame.K_BACKSPACE:
+            self.typed = self.typed[:-1]
+        elif event.key in (pygame.K_RETURN, pygame.K_KP_ENTER) and self.typed:
+            self.seek(int(self.typed))
+            self.typed = ""
+        elif event.key == pygame.K_g and self.typed:
+            self.load(int(self.typed))
+            self.typed = ""
+        elif event.key == pygame.K_SPACE:
+            self.is_playing = not self.is_playing
+        elif event.key == pygame.K_b:
+            self.direction = -self.direction
+        elif event.key == pygame.K_UP:
+            self.speed_index = min(self.speed_index + 1, len(REPLAY_SPEEDS) - 1)
+        elif event.key == pygame.K_DOWN:
+            self.speed_index = max(self.speed_index - 1, 0)
+        elif event.key in (pygame.K_RIGHT, pygame.K_LEFT):
+            self.is_playing = False
+            self.seek(replay.move + (1 if event.key == pygame.K_RIGHT else -1))
+        elif event.key in (pygame.K_PAGEUP, pygame.K_PAGEDOWN):
+            step = REPLAY_PAGE if event.key == pygame.K_PAGEDOWN else -REPLAY_PAGE
+            self.seek(replay.move + step)
+        elif event.key == pygame.K_HOME:
+            self.seek(0)
+        elif event.key == pygame.K_END:
+            self.seek(replay.record.n_moves)
+        elif event.key in (pygame.K_n, pygame.K_p):
+            self.load(self.game + (1 if event.key == pygame.K_n else -1))
+        elif event.key == pygame.K_r:
+            reveal_player_cards = not reveal_player_cards
+
+    def update(self, elapsed: float):
+        if not self.is_playing:
+            return
+        self.pending_moves += elapsed * REPLAY_SPEEDS[self.speed_index]
+        nb_moves = int(self.pending_moves)
+        if nb_moves:
+            self.pending_moves -= nb_moves
+            move = self.replay.move + self.direction * nb_moves
+            if not 0 <= move <= self.replay.record.n_moves:
+                self.is_playing = False
+            if self.direction > 0:
+                # Forward play keeps stepping, no keyframe restore
+                for _ in range(nb_moves):
+                    self.replay.step()
+            else:
+                self.replay.seek(move)
+
+    def draw(self, screen: pygame.Surface):
+        global last_actions
+        record = self.replay.record
+        last_actions = self.replay.last_actions
+        screen.fill(COLORS["background"])
         display_board_background(screen)
+        display_board(self.replay.board)
+        pygame.draw.rect(screen, COLORS["board"], (0, 0, WINDOW_WIDTH, BOARD_TOP))
+        pygame.draw.line(
+            screen, COLORS["border"], (0, BOARD_TOP), (WINDOW_WIDTH, BOARD_TOP), 2
+        )
+        state = "playing" if self.is_playing else "paused"
+        if self.is_playing and self.direction < 0:
+            state = "reversing"
+        lines = [
+            f"Game {self.game} / {self.nb_games - 1}",
+            f"Move {self.replay.move} / {record.n_moves}",
+            f"{REPLAY_SPEEDS[self.speed_index]} moves/s, {state}",
+            ", ".join(record.agent_kinds),
+        ]
+        if self.replay.move == record.n_moves:
+            if record.completed:
+                lines[-1] = f"Player {record.placements.index(1)} wins"
+            else:
+                lines[-1] = "Unfinished game"
+        if self.typed:
+            lines[-1] = f"Go to {self.typed}_"
+        for i, line in enumerate(lines):
+            text = (font if i < 2 else small_font).render(line, True, COLORS["text"])
+            screen.blit(text, (BUTTON_MARGIN, BUTTON_MARGIN + i * 30))
+        for i, line in enumerate(REPLAY_HELP):
+            text = last_actions_font.render(line, True, COLORS["accent"])
+            screen.blit(text, (BUTTON_MARGIN, BOARD_TOP - 50 + i * 14))
+        display_info(
+            screen,
+            pygame.Rect(
+                WINDOW_WIDTH - 400, BUTTON_MARGIN, 380, BOARD_TOP - 2 * BUTTON_MARGIN
+            ),
+        )
+
+
+def replay_main(path: str, game: int = 0, move: int = 0):
+    init_display()
+    pygame.display.set_caption(f"Coup - Replay of {path}")
+    viewer = ReplayViewer(GameRecordFile(path), game, move)
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                viewer.handle_key(event)
+        viewer.update(clock.tick(REPLAY_FPS) / 1000)
+        viewer.draw(screen)
+        pygame.display.update()
+    pygame.quit()
 
-        # Draw game elements
-        display_board(board)
-        display_ui_and_info(screen)
-        display_training_stats(screen)
 
-        # Draw game over state if applicable
-        if board.game_has_ended:
-            display_game_over(screen)
+def main():
+    global reveal_player_cards, moves_per_second, last_actions
+    init_display()
+    move_timer = pygame.USEREVENT + 2
+    pygame.time.set_timer(move_timer, int(1000 / moves_per_second))
 
-    pygame.display.update()
-    clock.tick(60)  # limits FPS to 60
+    running = True
+    while running:
+        # Fill background with base color
+        screen.fill(COLORS["background"])
+
+        # Handle events
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.MOUSEBUTTONDOWN and is_active:
+                mouse_pos = event.pos
+                # Check button clicks
+                if reveal_cards_button_rect.collidepoint(mouse_pos):
+                    reveal_player_cards = not reveal_player_cards
+                elif speed_button_rect.collidepoint(mouse_pos):
+                    current_index = moves_per_second_options.index(moves_per_second)
+                    next_index = (current_index + 1) % len(moves_per_second_options)
+                    moves_per_second = moves_per_second_options[next_index]
+                    pygame.time.set_timer(move_timer, int(1000 / moves_per_second))
+
+            # Running game logic
+            elif event.type == move_timer and is_active and not board.game_has_ended:
+                last_actions = board.agents_next_move(
+                    last_actions, LAST_ACTIONS_MAX_LENGTH
+                )
+
+        # Draw game state
+        if not is_active:
+            display_start_menu(screen)
+        else:
+            display_board_background(screen)
+
+            # Draw game elements
+            display_board(board)
+            display_ui_and_info(screen)
+            display_training_stats(screen)
 
-pygame.quit()
-sys.exit()
+            # Draw game over state if applicable
+            if board.game_has_ended:
+                display_game_over(screen)
+
+        pygame.display.update()
+        clock.tick(60)  # limits FPS to 60
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--dashboard":
+        dashboard_main(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_NAME)
+    elif len(sys.argv) > 2 and sys.argv[1] == "--replay":
+        replay_main(sys.argv[2], *map(int, sys.argv[3:5]))
+    else:
+        main()
+    sys.exit()
@@ -0,0 +1,217 @@
+import argparse
+import multiprocessing
+import random
+import signal
+import sys
+import time
+from functools import partial
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from action import MAX_PLAYERS
+from deck import CHARACTERS
+
+DEFAULT_NAME = "coup_status"
+NO_CARD = -1
+
+# One row per table. A worker publishes a copy of its board every few moves,
+# the dashboard only ever reads the block
+TABLE_STATUS_DTYPE = np.dtype(
+    [
+        ("sequence", np.uint64),  # odd while the worker is writing the row
+        ("nb_players", np.int8),
+        ("current_player", np.int8),
+        ("game_has_ended", np.bool_),
+        ("coins", np.int8, MAX_PLAYERS),
+        ("cards", np.int8, (MAX_PLAYERS, 2)),  # index in CHARACTERS or NO_CARD
+        ("revealed", np.bool_, (MAX_PLAYERS, 2)),
+        ("n_games", np.int64),
+        ("n_moves", np.int64),
+        ("wins", np.int64, MAX_PLAYERS),
+    ]
+)
+HEADER_SIZE = 8  # number of tables, as an int64
+
+
+class StatusBlock:
+    """Table statuses of many headless games in a named shared memory block.
+    Rows are written under a sequence lock, so the single writer of a row
+    never waits and readers retry the rows they caught mid-update"""
+
+    def __init__(self, nb_tables: int, name: str = DEFAULT_NAME):
+        self.shared_memory = SharedMemory(
+            name,
+            create=True,
+            size=HEADER_SIZE + nb_tables * TABLE_STATUS_DTYPE.itemsize,
+        )
+        self.is_owner = True
+        self.map(nb_tables)
+        self.header[0] = nb_tables
+        self.tables[:] = 0
+        self.tables["cards"] = NO_CARD
+
+    @classmethod
+    def attach(cls, name: str = DEFAULT_NAME) -> "StatusBlock":
+        block = cls.__new__(cls)
+        block.shared_memory = SharedMemory(name)
+        # Attaching registers the block with this process' resource tracker,
+        # which would unlink it when a worker or the dashboard exits
+        resource_tracker.unregister(block.shared_memory._name, "shared_memory")
+        block.is_owner = False
+        nb_tables = int(np.ndarray(1, np.int64, block.shared_memory.buf)[0])
+        block.map(nb_tables)
+        return block
+
+    def map(self, nb_tables: int):
+        self.nb_tables = nb_tables
+        self.header = np.ndarray(1, np.int64, self.shared_memory.buf)
+        self.tables = np.ndarray(
+            nb_tables, TABLE_STATUS_DTYPE, self.shared_memory.buf, offset=HEADER_SIZE
+        )
+
+    def close(self):
+        del self.header, self.tables
+        self.shared_memory.close()
+        if self.is_owner:
+            # Forked workers share the owner's resource tracker and their
+            # attach unregistered the block, register it again so unlinking
+            # finds it
+            resource_tracker.register(self.shared_memory._name, "shared_memory")
+            self.shared_memory.unlink()
+
+    def write(self, table_id: int, status: np.ndarray):
+        row = self.tables[table_id : table_id + 1]
+        sequence = row["sequence"][0]
+        row["sequence"] = sequence + 1
+        status["sequence"] = sequence + 1
+        row[:] = status
+        row["sequence"] = sequence + 2
+
+    def snapshot(self, previous: np.ndarray | None = None, max_retries: int = 3):
+        """Consistent copy of every row. A row still being written after
+        max_retries keeps its value from the previous snapshot"""
+        tables = self.tables.copy()
+        for _ in range(max_retries):
+            torn = (tables["sequence"] & 1).astype(bool) | (
+                self.tables["sequence"] != tables["sequence"]
+            )
+            if not torn.any():
+                return tables
+            tables[torn] = self.tables[torn]
+        if previous is not None:
+            tables[torn] = previous[torn]
+        return tables
+
+
+class StatusWriter:
+    """Publishes the board of one table. Cost in the game loop: a counter
+    increment per move and a few small array writes every publish_every moves"""
+
+    def __init__(self, block: StatusBlock, table_id: int, publish_every: int = 8):
+        self.block = block
+        self.table_id = table_id
+        self.publish_every = publish_every
+        self.status = np.zeros(1, TABLE_STATUS_DTYPE)
+        self.status["cards"] = NO_CARD
+        self.moves_since_publish = 0
+        self.character_index = {character: i for i, character in enumerate(CHARACTERS)}
+
+    def move(self, board):
+        self.status["n_moves"] += 1
+        self.moves_since_publish += 1
+        if self.moves_since_publish >= self.publish_every:
+            self.publish(board)
+
+    def game_over(self, board, placements: list[int]):
+        self.status["n_games"] += 1
+        if board.game_has_ended:
+            self.status["wins"][0, placements.index(1)] += 1
+        self.publish(board)
+
+    def publish(self, board):
+        status = self.status[0]
+        status["nb_players"] = board.nb_players
+        status["current_player"] = board.current_player.id
+        status["game_has_ended"] = board.game_has_ended
+        for player in board.players:
+            status["coins"][player.id] = player.coins
+            for slot, card in enumerate(player.hand[:2]):
+                status["cards"][player.id, slot] = self.character_index[card.character]
+                status["revealed"][player.id, slot] = card.is_revealed
+        self.block.write(self.table_id, self.status)
+        self.moves_since_publish = 0
+
+
+def run_table(
+    name: str,
+    table_id: int,
+    nb_players: int,
+    seed: int,
+    publish_every: int,
+    agent: str,
+    max_moves: int = 500,
+):
+    # Rules-only by default: a random agent worker never imports torch
+    from board import Board, play_game
+
+    if agent == "random":
+        from base_agent import RandomAgent
+
+        agent_factories = [partial(RandomAgent, rng=random.Random(seed))] * nb_players
+    else:
+        agent_factories = None
+    block = StatusBlock.attach(name)
+    writer = StatusWriter(block, table_id, publish_every)
+    board = Board(nb_players, seed=seed)
+    while True:
+        placements, _, _ = play_game(
+            board, agent_factories, max_moves, on_move=writer.move
+        )
+        writer.game_over(board, placements)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Headless games publishing their tables for the dashboard"
+    )
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--name", default=DEFAULT_NAME)
+    parser.add_argument("--publish-every", type=int, default=8)
+    parser.add_argument("--agent", default="random", choices=["random", "dqn"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    block = StatusBlock(args.workers, args.name)
+    # Also release the block when stopped with SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    workers = [
+        multiprocessing.Process(
+            target=run_table,
+            args=(
+                args.name,
+                table_id,
+                args.players,
+                args.seed + table_id,
+                args.publish_every,
+                args.agent,
+            ),
+            daemon=True,
+        )
+        for table_id in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    print(f"{args.workers} tables publishing to {args.name}, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(5)
+            tables = block.snapshot()
+            print(f"{tables['n_games'].sum()} games, {tables['n_moves'].sum()} moves")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        block.close()
@@ -0,0 +1,584 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from functools import partial
+from typing import NamedTuple
+import numpy as np
+from action import get_action_type_and_target
+from action_mask import DecisionPhase
+from board import Board, game_placements
+from game_record import (
+    DecisionScript,
+    ReplayAgent,
+    board_keyframe,
+    restore_keyframe,
+)
+
+
+class DecisionNeeded(Exception):
+    # Raised by a ServerAgent asked for a decision that is not made yet
+    def __init__(self, seat: int, phase: DecisionPhase, action_mask: np.ndarray):
+        super().__init__(seat, phase)
+        self.seat = seat
+        self.phase = phase
+        self.action_mask = action_mask
+
+
+class ServerAgent(ReplayAgent):
+    """Plays the decisions already made at a table, then stops the move by
+    raising DecisionNeeded with the legal actions of the next one"""
+
+    phase = DecisionPhase.ACTION
+
+    def select_action_id(self, state: np.ndarray, action_mask: np.ndarray) -> int:
+        if self.script.position == len(self.script.decisions):
+            raise DecisionNeeded(self.id, self.phase, action_mask)
+        return super().select_action_id(state, action_mask)
+
+    def choose_action(self, player, alive_players: list):
+        self.phase = DecisionPhase.ACTION
+        return super().choose_action(player, alive_players)
+
+    def choose_challenge(self, action_to_challenge, player_to_challenge):
+        self.phase = DecisionPhase.CHALLENGE
+        return super().choose_challenge(action_to_challenge, player_to_challenge)
+
+    def choose_counter(self, action_to_counter, player_to_counter):
+        self.phase = DecisionPhase.COUNTER
+        return super().choose_counter(action_to_counter, player_to_counter)
+
+    def choose_card_to_reveal_from_hand(self, hand: list):
+        self.phase = DecisionPhase.REVEAL
+        return super().choose_card_to_reveal_from_hand(hand)
+
+    def choose_card_to_discard_from_hand(self, hand: list):
+        self.phase = DecisionPhase.DISCARD
+        return super().choose_card_to_discard_from_hand(hand)
+
+
+class ServerBoard(Board):
+    # States are only encoded for the decisions of AI seats, see TableEngine.
+    # The last action of the move is kept to tell human seats what they are
+    # asked to challenge, counter or reveal a card for
+    last_action = None
+
+    def encode_agent_states(self):
+        pass
+
+    def extend_actions_history(self, action):
+        self.last_action = action
+        super().extend_actions_history(action)
+
+
+class PendingDecision(NamedTuple):
+    seat: int
+    phase: DecisionPhase
+    action_mask: np.ndarray
+    state: np.ndarray | None  # for AI seats
+    view: dict | None  # for human seats
+
+
+def table_view(board: ServerBoard, seat: int) -> dict:
+    # What the player of seat can see of the board
+    last_action = board.last_action
+    return {
+        "move": board.nb_moves,
+        "current_player": board.current_player.id,
+        "last_action": None
+        if last_action is None
+        else [
+            last_action.action_type.name,
+            last_action.origin_player_id,
+            last_action.target_player_id,
+        ],
+        "players": [
+            {
+                "coins": player.coins,
+                "alive": player.is_alive,
+                "cards": len(player.hand),
+                "revealed": [
+                    card.character.name for card in player.hand if card.is_revealed
+                ],
+            }
+            for player in board.players
+        ],
+        "hand": [
+            card.character.name
+            for card in board.players[seat].hand
+            if not card.is_revealed
+        ],
+    }
+
+
+def legal_actions(action_mask: np.ndarray, nb_players: int) -> list:
+    # [action id, action type name, target or -1] of each legal action
+    actions = []
+    for action_id in np.flatnonzero(action_mask).tolist():
+        action_type, target = get_action_type_and_target(action_id, nb_players)
+        actions.append([action_id, action_type.name, target])
+    return actions
+
+
+class Table:
+    """A game in compact form: a keyframe of the board at the last move
+    boundary and the decisions made since. Seats are held by a Session or
+    played by the shared policy (None)"""
+
+    __slots__ = (
+        "id",
+        "nb_players",
+        "sessions",
+        "nb_free_seats",
+        "keyframe",
+        "decisions",
+        "waiting",
+        "waiting_seat",
+        "waiting_mask",
+        "task",
+        "placements",
+        "completed",
+    )
+
+    def __init__(self, table_id: int, nb_players: int, keyframe: bytes):
+        self.id = table_id
+        self.nb_players = nb_players
+        self.sessions = [None] * nb_players
+        self.nb_free_seats = 0
+        self.keyframe = keyframe
+        self.decisions = []
+        # Future of the human decision the table is waiting for
+        self.waiting = None
+        self.waiting_seat = -1
+        self.waiting_mask = None
+        self.task = None
+        self.placements = None
+        self.completed = False
+
+
+class TableEngine:
+    """Plays the tables of a process on one scratch board per player count.
+    A table is advanced by restoring its keyframe and replaying its recent
+    decisions until a decision is missing, so between decisions a table
+    only holds its keyframe and a few action ids. Boards are not encoded
+    while replaying, the state is only encoded when an AI seat decides"""
+
+    def __init__(
+        self, max_moves: int = 500, history_length: int | None = None, seed=None
+    ):
+        self.max_moves = max_moves
+        self.history_length = history_length
+        self.rng = random.Random(seed)
+        self.script = DecisionScript(np.zeros(0, dtype=np.int16))
+        self.boards = {}
+
+    def board(self, nb_players: int) -> ServerBoard:
+        board = self.boards.get(nb_players)
+        if board is None:
+            board = ServerBoard(nb_players, history_length=self.history_length)
+            self.boards[nb_players] = board
+        return board
+
+    def new_keyframe(self, nb_players: int, seed: int | None = None) -> bytes:
+        board = self.board(nb_players)
+        board.rng.seed(seed if seed is not None else self.rng.getrandbits(32))
+        board.start([partial(ServerAgent, script=self.script)] * nb_players)
+        return board_keyframe(board)
+
+    def advance(self, table: Table) -> PendingDecision | None:
+        """Play the table until a seat has to decide, or to the end of the
+        game in which case None is returned and its placements are set"""
+        board = self.board(table.nb_players)
+        restore_keyframe(board, table.keyframe)
+        board.last_action = None
+        self.script.decisions = table.decisions
+        self.script.position = 0
+        while board.nb_moves < self.max_moves:
+            try:
+                board.agents_next_move([], 0)
+            except DecisionNeeded as decision:
+                state = view = None
+                if table.sessions[decision.seat] is None:
+                    Board.encode_agent_states(board)
+                    # Encoding builds new arrays, the state stays valid once
+                    # the board is reused for another table
+                    state = board.agents[decision.seat].state
+                else:
+                    view = table_view(board, decision.seat)
+                return PendingDecision(
+                    decision.seat, decision.phase, decision.action_mask, state, view
+                )
+            if board.game_has_ended:
+                break
+            table.keyframe = board_keyframe(board)
+            table.decisions = []
+            board.last_action = None
+            self.script.decisions = table.decisions
+            self.script.position = 0
+        table.placements = game_placements(board)
+        table.completed = board.game_has_ended
+        return None
+
+
+class Session:
+    # A connected client, it can sit at any number of tables
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.tables = set()
+
+    def send(self, message: dict):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+
+
+class TableServer:
+    """Line-delimited JSON game server over TCP or a Unix socket. A session
+    opens tables, takes human seats and answers the decide events of its
+    seats, every other seat is played by the batched policy of the table's
+    player count (an inference_server.InferenceServer). All the tables of
+    the process run as asyncio tasks, an idle table is a task waiting for
+    its human and the compact Table.
+
+    Requests: {"op": "open", "players": 4, "humans": 1, "seed": 0},
+    {"op": "join", "table": id} and {"op": "act", "table": id, "action": id}.
+    Events: seated, decide (phase, legal actions and the seat's view), end
+    (placements) and error. Seats of a disconnected session are handed to
+    the policy"""
+
+    def __init__(self, policies: dict, engine: TableEngine | None = None):
+        self.policies = policies
+        self.engine = engine if engine is not None else TableEngine()
+        self.tables = {}
+        self.table_ids = itertools.count()
+        self.nb_games = 0
+        self.nb_decisions = 0
+
+    async def serve_tcp(self, host: str, port: int) -> asyncio.Server:
+        return await asyncio.start_server(self.handle_session, host, port)
+
+    async def serve_unix(self, path: str) -> asyncio.Server:
+        return await asyncio.start_unix_server(self.handle_session, path)
+
+    async def handle_session(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        session = Session(writer)
+        try:
+            async for line in reader:
+                try:
+                    self.dispatch(session, json.loads(line))
+                except (ValueError, KeyError, TypeError, IndexError) as error:
+                    session.send({"event": "error", "message": str(error)})
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.disconnect(session)
+            writer.close()
+
+    def dispatch(self, session: Session, message: dict):
+        match message["op"]:
+            case "open":
+                self.open_table(
+                    session,
+                    int(message.get("players", 4)),
+                    int(message.get("humans", 1)),
+                    message.get("seed"),
+                )
+            case "join":
+                self.join_table(session, self.get_table(message["table"]))
+            case "act":
+                self.act(session, self.get_table(message["table"]), message["action"])
+            case op:
+                raise ValueError(f"Unknown op {op}")
+
+    def get_table(self, table_id: int) -> Table:
+        table = self.tables.get(table_id)
+        if table is None:
+            raise KeyError(f"No table {table_id}")
+        return table
+
+    def open_table(
+        self, session: Session, nb_players: int, nb_humans: int, seed: int | None
+    ):
+        if nb_players not in self.policies:
+            raise ValueError(f"No policy for {nb_players} players")
+        if not 1 <= nb_humans <= nb_players:
+            raise ValueError(f"humans must be between 1 and {nb_players}")
+        table = Table(
+            next(self.table_ids),
+            nb_players,
+            self.engine.new_keyframe(nb_players, seed),
+        )
+        table.nb_free_seats = nb_humans
+        self.tables[table.id] = table
+        self.join_table(session, table)
+
+    def join_table(self, session: Session, table: Table):
+        if not table.nb_free_seats:
+            raise ValueError(f"No free seat at table {table.id}")
+        # Human seats come first, the others are played by the policy
+        seat = table.sessions.index(None)
+        table.sessions[seat] = session
+        table.nb_free_seats -= 1
+        session.tables.add(table.id)
+        session.send(
+            {
+                "event": "seated",
+                "table": table.id,
+                "seat": seat,
+                "players": table.nb_players,
+            }
+        )
+        if not table.nb_free_seats:
+            table.task = asyncio.create_task(self.run_table(table))
+
+    def act(self, session: Session, table: Table, action_id: int):
+        if table.waiting is None or table.sessions[table.waiting_seat] is not session:
+            raise ValueError(f"Not your decision at table {table.id}")
+        # JSON also decodes 3.0 and true, which would index the mask as a
+        # float or a bool
+        if not isinstance(action_id, int) or isinstance(action_id, bool):
+            raise ValueError(f"Action {action_id!r} is not an action id")
+        if not 0 <= action_id < len(table.waiting_mask):
+            raise ValueError(f"No action {action_id}")
+        if not table.waiting_mask[action_id]:
+            raise ValueError(f"Action {action_id} is not legal")
+        table.waiting.set_result(action_id)
+        table.waiting = None
+
+    def disconnect(self, session: Session):
+        for table_id in session.tables:
+            table = self.tables.get(table_id)
+            if table is None:
+                continue
+            if table.task is None:
+                # Not started yet, the other players are told it is closed
+                del self.tables[table_id]
+                for other in set(table.sessions) - {None, session}:
+                    other.tables.discard(table_id)
+                    other.send(
+                        {"event": "error", "message": f"Table {table_id} closed"}
+                    )
+                continue
+            table.sessions = [
+                None if seat_session is session else seat_session
+                for seat_session in table.sessions
+            ]
+            if table.waiting is not None and table.sessions[table.waiting_seat] is None:
+                # The decision is asked again, to the policy
+                table.waiting.set_result(None)
+                table.waiting = None
+        session.tables.clear()
+
+    async def run_table(self, table: Table):
+        loop = asyncio.get_running_loop()
+        try:
+            while (decision := self.engine.advance(table)) is not None:
+                session = table.sessions[decision.seat]
+                if session is None:
+                    action_id = await self.policies[
+                        table.nb_players
+                    ].select_action_id_async(decision.state, decision.action_mask)
+                else:
+                    table.waiting = loop.create_future()
+                    table.waiting_seat = decision.seat
+                    table.waiting_mask = decision.action_mask
+                    session.send(
+                        {
+                            "event": "decide",
+                            "table": table.id,
+                            "seat": decision.seat,
+                            "phase": decision.phase.name.lower(),
+                            "legal": legal_actions(
+                                decision.action_mask, table.nb_players
+                            ),
+                            "view": decision.view,
+                        }
+                    )
+                    action_id = await table.waiting
+                    table.waiting_mask = None
+                    if action_id is None:
+                        continue
+                table.decisions.append(action_id)
+                self.nb_decisions += 1
+            message = {
+                "event": "end",
+                "table": table.id,
+                "placements": table.placements,
+                "completed": table.completed,
+            }
+            self.nb_games += 1
+        except Exception as error:
+            message = {
+                "event": "error",
+                "message": f"Table {table.id} stopped: {error!r}",
+            }
+        del self.tables[table.id]
+        for session in set(table.sessions) - {None}:
+            session.tables.discard(table.id)
+            session.send(message)
+
+
+async def run_bot_session(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    nb_tables: int,
+    nb_players: int = 4,
+    nb_humans: int = 1,
+    rng: random.Random | None = None,
+    answer: bool = True,
+) -> list[dict]:
+    """Scripted client: opens nb_tables tables and plays its seats with
+    uniformly random legal actions until they end, returning the end
+    events. Without answer it only waits for the first decision of each
+    table and leaves them idle"""
+    rng = rng if rng is not None else random.Random()
+    for _ in range(nb_tables):
+        message = {"op": "open", "players": nb_players, "humans": nb_humans}
+        writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+    ends = []
+    nb_waiting = 0
+    while len(ends) < nb_tables:
+        message = json.loads(await reader.readline())
+        match message["event"]:
+            case "decide" if answer:
+                action_id = rng.choice(message["legal"])[0]
+                reply = {"op": "act", "table": message["table"], "action": action_id}
+                writer.write(json.dumps(reply).encode() + b"\n")
+            case "decide":
+                nb_waiting += 1
+                if nb_waiting == nb_tables:
+                    break
+            case "end":
+                ends.append(message)
+            case "error":
+                raise RuntimeError(message["message"])
+    return ends
+
+
+if __name__ == "__main__":
+    import os
+    import tracemalloc
+    from action import get_nb_actions
+    from dqn import DQN
+    from inference_server import InferenceServer
+
+    parser = argparse.ArgumentParser(
+        description="Serve game tables over a socket, or benchmark it with bots"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--unix", default=None, help="Unix socket path")
+    parser.add_argument("--players", type=int, nargs="+", default=[4])
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--history-length", type=int, default=None)
+    parser.add_argument("--max-moves", type=int, default=500)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-us", type=int, default=500)
+    parser.add_argument(
+        "--bots", type=int, default=0, help="benchmark with this many bot clients"
+    )
+    parser.add_argument("--tables", type=int, default=100, help="tables per bot")
+    parser.add_argument("--idle", type=int, default=0, help="idle tables to measure")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    policies = {}
+    for nb_players in args.players:
+        board = Board(nb_players, history_length=args.history_length)
+        if args.checkpoint is not None:
+            from checkpoint import load_policy_net
+
+            policy_net = load_policy_net(args.checkpoint)
+            if (
+                policy_net.nb_players != nb_players
+                or policy_net.fc1.in_features
+                != board.full_state_length * board.state_item_width
+            ):
+                parser.error(
+                    f"{args.checkpoint} does not take the states of {nb_players} "
+                    "players with this history length"
+                )
+        else:
+            policy_net = DQN(
+                board.full_state_length, board.state_item_width, nb_players
+            )
+        policies[nb_players] = InferenceServer(
+            policy_net,
+            board.full_state_length,
+            board.state_item_width,
+            get_nb_actions(nb_players),
+            max_batch_size=args.max_batch_size,
+            max_wait_us=args.max_wait_us,
+        )
+    table_server = TableServer(
+        policies, TableEngine(args.max_moves, args.history_length, args.seed)
+    )
+
+    async def connect():
+        if args.unix is not None:
+            return await asyncio.open_unix_connection(args.unix, limit=1 << 20)
+        return await asyncio.open_connection(args.host, args.port, limit=1 << 20)
+
+    async def benchmark():
+        start_time = time.perf_counter()
+        sessions = [
+            run_bot_session(
+                *await connect(),
+                args.tables,
+                args.players[0],
+                rng=random.Random(args.seed + bot),
+            )
+            for bot in range(args.bots)
+        ]
+        await asyncio.gather(*sessions)
+        elapsed = time.perf_counter() - start_time
+        policy = policies[args.players[0]]
+        print(
+            f"{args.bots * args.tables} games on {args.bots} sessions: "
+            f"{table_server.nb_games / elapsed:.1f} games/s, "
+            f"{table_server.nb_decisions / elapsed:.0f} decisions/s, "
+            f"mean policy batch size {policy.mean_batch_size:.1f}"
+        )
+        if args.idle:
+            tracemalloc.start()
+            reader, writer = await connect()
+            await run_bot_session(
+                reader, writer, args.idle, args.players[0], answer=False
+            )
+            memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            keyframe_bytes = np.mean(
+                [len(table.keyframe) for table in table_server.tables.values()]
+            )
+            print(
+                f"{len(table_server.tables)} idle tables: "
+                f"{memory / args.idle / 1024:.1f} KB per table, "
+                f"keyframes of {keyframe_bytes / 1024:.1f} KB"
+            )
+            writer.close()
+
+    async def main():
+        if args.unix is not None:
+            if os.path.exists(args.unix):
+                os.remove(args.unix)
+            server = await table_server.serve_unix(args.unix)
+        else:
+            server = await table_server.serve_tcp(args.host, args.port)
+        async with server:
+            if args.bots:
+                await benchmark()
+            else:
+                print(f"Serving tables of {args.players} players")
+                await server.serve_forever()
+
+    for policy in policies.values():
+        policy.start()
+    try:
+        asyncio.run(main())
+    finally:
+        for policy in policies.values():
+            policy.stop()
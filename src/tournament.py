@@ -0,0 +1,296 @@
+import argparse
+import itertools
+import math
+import multiprocessing
+import random
+import time
+import torch
+from functools import partial
+from pydantic import BaseModel
+from agent import CoupAgent, RandomAgent
+from board import Board, play_game
+import checkpoint
+from dqn import DQN
+from inference import InferencePolicy
+from action import get_nb_actions
+
+ELO_SCALE = 400 / math.log(10)
+
+
+class Contestant(BaseModel):
+    name: str
+    kind: str  # "checkpoint", "fresh" (randomly initialised DQN) or "random"
+    checkpoint_path: str | None = None
+    seed: int = 0
+
+
+class GameResult(BaseModel):
+    game_id: int
+    seats: list[str]  # contestant name for each seat
+    placements: list[int]  # 1 is the winner, nb_players the first eliminated
+    n_moves: int
+    completed: bool
+
+
+class ContestantStats(BaseModel):
+    # Same metrics as the simulation window, per contestant
+    rating: float
+    information: float = 0.0  # Fisher information of the rating, for the CI
+    n_games: int = 0
+    record: int = 0  # number of games won
+    # Opponents outlasted, averaged over the seats held in a game
+    total_score: float = 0.0
+
+    @property
+    def confidence_interval(self) -> float:
+        # 95% half width of the rating estimate
+        if self.information == 0:
+            return math.inf
+        return 1.96 / math.sqrt(self.information)
+
+    @property
+    def mean_score(self) -> float:
+        return self.total_score / max(1, self.n_games)
+
+
+class RatingTable:
+    """Incremental multiplayer Elo: each game counts as every pairwise result
+    between seats held by different contestants"""
+
+    def __init__(self, names: list[str], k_factor: float = 16, initial: float = 1000):
+        self.k_factor = k_factor
+        self.stats = {name: ContestantStats(rating=initial) for name in names}
+
+    def expected_score(self, rating: float, opponent_rating: float) -> float:
+        return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+    def update(self, result: GameResult):
+        nb_players = len(result.seats)
+        deltas = {name: 0.0 for name in set(result.seats)}
+        for i, j in itertools.combinations(range(nb_players), 2):
+            name_i, name_j = result.seats[i], result.seats[j]
+            if name_i == name_j:
+                continue
+            stats_i, stats_j = self.stats[name_i], self.stats[name_j]
+            if result.placements[i] < result.placements[j]:
+                score = 1.0
+            elif result.placements[i] > result.placements[j]:
+                score = 0.0
+            else:
+                score = 0.5
+            expected = self.expected_score(stats_i.rating, stats_j.rating)
+            # Each game yields nb_players - 1 correlated comparisons per seat,
+            # the step and the information they add are scaled alike
+            step = self.k_factor * (score - expected) / (nb_players - 1)
+            deltas[name_i] += step
+            deltas[name_j] -= step
+            information = expected * (1 - expected) / ELO_SCALE**2 / (nb_players - 1)
+            stats_i.information += information
+            stats_j.information += information
+        for name, delta in deltas.items():
+            self.stats[name].rating += delta
+        # A contestant holding several seats plays the game once
+        for name in deltas:
+            placements = [
+                placement
+                for seat_name, placement in zip(result.seats, result.placements)
+                if seat_name == name
+            ]
+            stats = self.stats[name]
+            stats.n_games += 1
+            stats.total_score += nb_players - sum(placements) / len(placements)
+            if 1 in placements:
+                stats.record += 1
+
+    def has_converged(self, max_confidence_interval: float, min_games: int) -> bool:
+        return all(
+            stats.n_games >= min_games
+            and stats.confidence_interval <= max_confidence_interval
+            for stats in self.stats.values()
+        )
+
+    def __str__(self):
+        lines = [
+            f"{'contestant':<20} {'rating':>8} {'+/-':>7} {'games':>7} {'wins':>6} {'mean score':>10}"
+        ]
+        ranked = sorted(self.stats.items(), key=lambda item: -item[1].rating)
+        for name, stats in ranked:
+            lines.append(
+                f"{name:<20} {stats.rating:>8.1f} {stats.confidence_interval:>7.1f} "
+                f"{stats.n_games:>7} {stats.record:>6} {stats.mean_score:>10.2f}"
+            )
+        return "\n".join(lines)
+
+
+def round_robin_schedule(
+    nb_contestants: int, nb_players: int, max_games: int, seed: int = 0
+):
+    """Yield (game_id, seat contestant indices, game seed). Every group of
+    contestants plays every rotation of its seating before the next round"""
+    if nb_contestants >= nb_players:
+        groups = list(itertools.combinations(range(nb_contestants), nb_players))
+    else:
+        groups = [tuple(i % nb_contestants for i in range(nb_players))]
+    rng = random.Random(seed)
+    game_id = 0
+    while True:
+        rng.shuffle(groups)
+        for group in groups:
+            for rotation in range(nb_players):
+                if game_id >= max_games:
+                    return
+                seats = group[rotation:] + group[:rotation]
+                yield game_id, seats, rng.getrandbits(32)
+                game_id += 1
+
+
+def load_policy_net(contestant: Contestant, nb_players: int) -> DQN:
+    board = Board(nb_players)
+    if contestant.kind == "checkpoint":
+        return checkpoint.load_policy_net(
+            contestant.checkpoint_path,
+            board.full_state_length,
+            board.state_item_width,
+            nb_players,
+        )
+    # Seeding makes "fresh" contestants identical in every worker
+    torch.manual_seed(contestant.seed)
+    policy_net = DQN(board.full_state_length, board.state_item_width, nb_players)
+    return policy_net.eval()
+
+
+# Per worker process state, filled once by init_worker
+worker_contestants: list[Contestant] = []
+worker_policies: dict[str, InferencePolicy] = {}
+
+
+def init_worker(
+    contestants: list[Contestant],
+    nb_players: int,
+    torch_threads: int,
+    quantize: bool = False,
+):
+    global worker_contestants
+    worker_contestants = contestants
+    worker_policies.clear()
+    board = Board(nb_players)
+    for contestant in contestants:
+        if contestant.kind != "random":
+            worker_policies[contestant.name] = InferencePolicy(
+                load_policy_net(contestant, nb_players),
+                board.full_state_length,
+                board.state_item_width,
+                get_nb_actions(nb_players),
+                quantize=quantize,
+                num_threads=torch_threads,
+            )
+
+
+def make_agent_factory(contestant: Contestant, rng: random.Random):
+    if contestant.kind == "random":
+        return partial(RandomAgent, rng=rng)
+    return partial(CoupAgent, inference_policy=worker_policies[contestant.name])
+
+
+def run_scheduled_game(
+    scheduled_game: tuple[int, tuple[int, ...], int], nb_players: int, max_moves: int
+) -> GameResult:
+    game_id, seats, seed = scheduled_game
+    board = Board(nb_players=nb_players, seed=seed)
+    rng = random.Random(seed)
+    agent_factories = [
+        make_agent_factory(worker_contestants[seat], rng) for seat in seats
+    ]
+    placements, n_moves, completed = play_game(board, agent_factories, max_moves)
+    return GameResult(
+        game_id=game_id,
+        seats=[worker_contestants[seat].name for seat in seats],
+        placements=placements,
+        n_moves=n_moves,
+        completed=completed,
+    )
+
+
+def run_tournament(
+    contestants: list[Contestant],
+    nb_players: int = 4,
+    max_games: int = 10000,
+    min_games: int = 200,
+    max_confidence_interval: float = 25.0,
+    nb_workers: int | None = None,
+    max_moves: int = 500,
+    seed: int = 0,
+    report_every: int = 500,
+    quantize: bool = False,
+) -> RatingTable:
+    """Play seat-rotated games across a process pool and stream their results
+    into a rating table, stopping as soon as every rating has converged"""
+    nb_workers = nb_workers or multiprocessing.cpu_count()
+    table = RatingTable([contestant.name for contestant in contestants])
+    schedule = round_robin_schedule(len(contestants), nb_players, max_games, seed)
+    start_time = time.perf_counter()
+    with multiprocessing.Pool(
+        nb_workers,
+        initializer=init_worker,
+        initargs=(contestants, nb_players, 1, quantize),
+    ) as pool:
+        results = pool.imap_unordered(
+            partial(run_scheduled_game, nb_players=nb_players, max_moves=max_moves),
+            schedule,
+            chunksize=4,
+        )
+        for n_results, result in enumerate(results, start=1):
+            table.update(result)
+            if n_results % report_every == 0:
+                elapsed = time.perf_counter() - start_time
+                print(f"{n_results} games, {n_results / elapsed:.1f} games/s")
+                print(table)
+            if table.has_converged(max_confidence_interval, min_games):
+                print(f"Ratings converged after {n_results} games")
+                pool.terminate()
+                break
+    return table
+
+
+def parse_contestant(spec: str, index: int) -> Contestant:
+    # "random", "fresh" or "name=path" with path a checkpoint directory or a
+    # bare policy state dict file
+    if spec in ("random", "fresh"):
+        return Contestant(name=f"{spec}_{index}", kind=spec, seed=index)
+    name, checkpoint_path = spec.split("=", 1)
+    return Contestant(name=name, kind="checkpoint", checkpoint_path=checkpoint_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Round-robin Coup tournament")
+    parser.add_argument("contestants", nargs="+")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--min-games", type=int, default=200)
+    parser.add_argument("--ci", type=float, default=25.0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--quantize", action="store_true", help="int8 dynamic quantization"
+    )
+    parser.add_argument(
+        "--registry",
+        default=None,
+        help="models directory whose registry receives the final ratings",
+    )
+    args = parser.parse_args()
+    table = run_tournament(
+        [parse_contestant(spec, i) for i, spec in enumerate(args.contestants)],
+        nb_players=args.players,
+        max_games=args.games,
+        min_games=args.min_games,
+        max_confidence_interval=args.ci,
+        nb_workers=args.workers,
+        seed=args.seed,
+        quantize=args.quantize,
+    )
+    print(table)
+    if args.registry is not None:
+        checkpoint.ModelRegistry(args.registry).update_ratings(
+            {name: stats.rating for name, stats in table.stats.items()}
+        )